@@ -0,0 +1,139 @@
+# action_router.py - Табличная маршрутизация действий WebApp со схемами данных
+import json
+import re
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Telegram ограничивает web_app_data 4096 байтами
+DEFAULT_MAX_PAYLOAD_BYTES = 4096
+
+# Поиск action до полного разбора JSON: внутри строковых значений кавычки
+# экранированы, но ключ "action" может быть и во вложенном объекте, а
+# настоящий - записан через \uXXXX. Поэтому отказ по сканированию - только
+# когда ключ в данных один и последовательностей \u нет, иначе решает
+# json.loads
+_ACTION_RE = re.compile(r'"action"\s*:\s*"([A-Za-z0-9_\-]{1,64})"')
+
+
+class PayloadError(ValueError):
+    """Данные WebApp отклонены; user_message - текст для пользователя"""
+
+    user_message = "❌ Ошибка обработки данных от приложения"
+
+
+class UnknownActionError(PayloadError):
+    """Действие не зарегистрировано в роутере"""
+
+    def __init__(self, action: Optional[str]):
+        super().__init__(f"Неизвестное действие: {action}")
+        self.action = action
+        self.user_message = f"Получено неизвестное действие: {action}"
+
+
+@dataclass(frozen=True)
+class Field:
+    """Описание поля данных WebApp"""
+    type: type = str
+    required: bool = False
+    max_length: Optional[int] = None
+    default: Any = None
+
+
+Schema = Dict[str, Field]
+Validator = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+
+def compile_schema(schema: Optional[Schema]) -> Validator:
+    """Собирает функцию проверки один раз при регистрации действия"""
+    if not schema:
+        return lambda data: data
+
+    checks: List[Tuple[str, Field]] = list(schema.items())
+
+    def validate(data: Dict[str, Any]) -> Dict[str, Any]:
+        for name, spec in checks:
+            value = data.get(name)
+            if value is None:
+                if spec.required:
+                    raise PayloadError(f"Нет обязательного поля {name}")
+                if spec.default is not None:
+                    data[name] = spec.default
+                continue
+            if not isinstance(value, spec.type):
+                raise PayloadError(f"Поле {name} должно быть {spec.type.__name__}")
+            if spec.max_length is not None and len(value) > spec.max_length:
+                raise PayloadError(f"Поле {name} длиннее {spec.max_length}")
+        return data
+
+    return validate
+
+
+class TruncatedPayload:
+    """Ленивое представление данных для логов: обрезается только при выводе"""
+
+    __slots__ = ('raw', 'limit')
+
+    def __init__(self, raw: str, limit: int = 300):
+        self.raw = raw
+        self.limit = limit
+
+    def __str__(self) -> str:
+        if len(self.raw) <= self.limit:
+            return self.raw
+        return f"{self.raw[:self.limit]}... ({len(self.raw)} символов)"
+
+
+Handler = Callable[..., Awaitable[Any]]
+
+
+class ActionRouter:
+    """Реестр action -> (обработчик, схема) с диспетчеризацией за O(1).
+
+    parse() отбрасывает слишком большие и явно некорректные данные, а также
+    неизвестные действия до json.loads, затем проверяет данные схемой.
+    """
+
+    def __init__(self, max_payload_bytes: int = DEFAULT_MAX_PAYLOAD_BYTES):
+        self.max_payload_bytes = max_payload_bytes
+        self._routes: Dict[str, Tuple[Handler, Validator]] = {}
+
+    def register(self, action: str, handler: Handler, schema: Optional[Schema] = None):
+        self._routes[action] = (handler, compile_schema(schema))
+
+    @property
+    def actions(self) -> List[str]:
+        return list(self._routes)
+
+    def parse(self, raw: str) -> Tuple[Handler, Dict[str, Any]]:
+        """Проверка и разбор данных, возвращает (обработчик, данные)"""
+        # Символов не больше, чем байт: кодируем только пограничные случаи
+        if len(raw) > self.max_payload_bytes or (
+            len(raw) * 4 > self.max_payload_bytes and len(raw.encode()) > self.max_payload_bytes
+        ):
+            raise PayloadError(f"Данные больше {self.max_payload_bytes} байт")
+        if not raw.lstrip().startswith('{'):
+            raise PayloadError("Данные не являются JSON-объектом")
+
+        match = _ACTION_RE.search(raw)
+        if (match is not None and match.group(1) not in self._routes
+                and raw.count('"action"') == 1 and '\\u' not in raw):
+            raise UnknownActionError(match.group(1))
+
+        try:
+            data = json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise PayloadError(f"Ошибка парсинга JSON: {e}") from e
+        if not isinstance(data, dict):
+            raise PayloadError("Некорректная структура данных")
+        action = data.get('action')
+        route = self._routes.get(action) if isinstance(action, str) else None
+        if route is None:
+            raise UnknownActionError(action)
+
+        handler, validate = route
+        return handler, validate(data)
+
+    async def dispatch(self, raw: str, *args) -> Any:
+        """parse() + вызов обработчика с (*args, data)"""
+        handler, data = self.parse(raw)
+        return await handler(*args, data)
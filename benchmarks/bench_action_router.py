@@ -0,0 +1,97 @@
+# benchmarks/bench_action_router.py - Накладные расходы диспетчеризации WebApp данных
+#
+# Сравнивает прежнюю схему (json.loads + цепочка if/elif + четыре INFO-лога
+# с повторной сериализацией json.dumps) с ActionRouter и ленивым логом.
+#
+# Запуск из корня репозитория:
+#   python -m benchmarks.bench_action_router
+import asyncio
+import io
+import json
+import logging
+import time
+
+from action_router import ActionRouter, Field, PayloadError, TruncatedPayload
+
+logger = logging.getLogger('bench')
+
+
+async def noop(update, data):
+    return None
+
+
+async def legacy_dispatch(raw: str):
+    data = json.loads(raw)
+    user_id = 42
+    action = data.get('action')
+    logger.info(f"📱 Получены данные от WebApp:")
+    logger.info(f"   Пользователь: {user_id}")
+    logger.info(f"   Действие: {action}")
+    logger.info(f"   Данные: {json.dumps(data, ensure_ascii=False)}")
+    if action == 'test':
+        await noop(None, data)
+    elif action == 'download_table':
+        await noop(None, data)
+    elif action == 'open_course':
+        await noop(None, data)
+    elif action == 'submit_homework':
+        await noop(None, data)
+
+
+def build_router() -> ActionRouter:
+    router = ActionRouter()
+    router.register('test', noop)
+    router.register('download_table', noop, {'taskId': Field(str, max_length=128)})
+    router.register('open_course', noop, {'taskId': Field(str, max_length=128)})
+    router.register('submit_homework', noop, {
+        'taskId': Field(str, max_length=128),
+        'userAnswer': Field(str, required=True),
+    })
+    return router
+
+
+async def router_dispatch(router: ActionRouter, raw: str):
+    try:
+        handler, data = router.parse(raw)
+    except PayloadError:
+        return
+    logger.info("📱 WebApp: пользователь %s, действие %s", 42, data['action'])
+    logger.debug("   Данные: %s", TruncatedPayload(raw))
+    await handler(None, data)
+
+
+async def measure(name: str, fn, payloads, rounds: int = 2000) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for raw in payloads:
+            await fn(raw)
+    per_update = (time.perf_counter() - start) / (rounds * len(payloads))
+    print(f"{name:<28} {per_update * 1e6:>8.1f} мкс/апдейт")
+    return per_update
+
+
+async def main():
+    # Логи пишутся в память, чтобы мерить форматирование, а не терминал
+    handler = logging.StreamHandler(io.StringIO())
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    answer = 'SELECT cohort, COUNT(*) FROM orders GROUP BY 1; -- ' + 'анализ ' * 400
+    payloads = [
+        json.dumps({'action': 'submit_homework', 'taskId': 'cohort-analysis-sql', 'userAnswer': answer[:3000]},
+                   ensure_ascii=False),
+        json.dumps({'action': 'download_table', 'taskId': 'cohort-analysis-sql'}),
+        json.dumps({'action': 'open_course', 'taskId': 'cohort-analysis-sql'}),
+    ]
+    rejected = ['{"action": "unknown_action", "data": "' + 'x' * 3000 + '"}', 'x' * 5000]
+
+    router = build_router()
+    base = await measure('legacy if/elif + json.dumps', legacy_dispatch, payloads)
+    fast = await measure('ActionRouter', lambda raw: router_dispatch(router, raw), payloads)
+    await measure('ActionRouter (отказ)', lambda raw: router_dispatch(router, raw), rejected)
+    print(f"\nУскорение на валидных данных: x{base / fast:.1f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
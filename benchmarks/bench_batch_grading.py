@@ -0,0 +1,78 @@
+# benchmarks/bench_batch_grading.py - Пакетная проверка: пропускная способность и задержка
+#
+# Студенты отправляют ответы на одно задание с заданной интенсивностью
+# (пуассоновский поток). Сравнивается проверка по одному ответу за вызов и
+# пакетная проверка при одинаковом числе одновременных вызовов проверяющего.
+# Задержка считается от постановки в очередь до результата.
+#
+# Запуск из корня репозитория:
+#   python -m benchmarks.bench_batch_grading --submissions 400 --rate 200
+#   python -m benchmarks.bench_batch_grading --rate 5   # низкая нагрузка: цена max_wait
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from grading import GradingQueue, Submission
+from grading_batch import BatchingGrader, FakeBatchGrader
+
+ANSWER = 'SELECT user_id, date_trunc(\'month\', first_order) AS cohort FROM orders'
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run(grader, workers: int, submissions: int, rate: float, seed: int):
+    queue = GradingQueue(grader, workers=workers, max_size=submissions, max_per_user=submissions)
+    await queue.start()
+    rng = random.Random(seed)
+    latencies = []
+    finished = asyncio.Event()
+
+    async def on_result(submission, result, error):
+        latencies.append(time.monotonic() - submission.enqueued_at)
+        if len(latencies) == submissions:
+            finished.set()
+
+    start = time.monotonic()
+    for i in range(submissions):
+        queue.submit(Submission(user_id=i, task_id='cohort-analysis-sql', user_answer=ANSWER), on_result)
+        await asyncio.sleep(rng.expovariate(rate))
+    await finished.wait()
+    elapsed = time.monotonic() - start
+    await queue.stop()
+    return submissions / elapsed, percentile(latencies, 0.5), percentile(latencies, 0.99)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк пакетной проверки')
+    parser.add_argument('--submissions', type=int, default=400)
+    parser.add_argument('--rate', type=float, default=200, help='отправок в секунду')
+    parser.add_argument('--calls', type=int, default=4, help='одновременных вызовов проверяющего')
+    parser.add_argument('--call-overhead', type=float, default=0.2, help='постоянная цена вызова, с')
+    parser.add_argument('--item-delay', type=float, default=0.01, help='цена одного ответа в вызове, с')
+    parser.add_argument('--batch-sizes', default='4,8,16')
+    parser.add_argument('--max-wait', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'вариант':<22} {'вызовов':>8} {'ответов/с':>10} {'p50, с':>8} {'p99, с':>8}")
+
+    grader = FakeBatchGrader(args.call_overhead, args.item_delay)
+    throughput, p50, p99 = await run(grader, args.calls, args.submissions, args.rate, args.seed)
+    print(f"{'по одному':<22} {grader.calls:>8} {throughput:>10.1f} {p50:>8.3f} {p99:>8.3f}")
+
+    for size in (int(value) for value in args.batch_sizes.split(',')):
+        fake = FakeBatchGrader(args.call_overhead, args.item_delay)
+        grader = BatchingGrader(fake, max_batch_size=size, max_wait=args.max_wait, max_concurrent_calls=args.calls)
+        throughput, p50, p99 = await run(grader, size * args.calls, args.submissions, args.rate, args.seed)
+        name = f"пачка {size}, wait {args.max_wait * 1000:.0f} мс"
+        print(f"{name:<22} {fake.calls:>8} {throughput:>10.1f} {p50:>8.3f} {p99:>8.3f}"
+              f"  (средняя пачка {grader.stats()['mean_batch_size']})")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
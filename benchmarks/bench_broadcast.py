@@ -0,0 +1,135 @@
+# benchmarks/bench_broadcast.py - Рассылка по когорте через фейковый Bot API
+#
+# Генерирует выгрузку получателей (CSV), поднимает FakeBotApi с задержкой и
+# 429 и запускает Broadcast с лимитами Telegram. Темп считается по времени
+# прихода sendMessage на фейковый сервер в секундных окнах: после начальной
+# пачки (емкость ведра) он должен держаться у --rate и не превышать его.
+# Для сравнения - наивный цикл: sendMessage по одному с ожиданием ответа.
+#
+# Запуск из корня репозитория:
+#   python -m benchmarks.bench_broadcast --recipients 3000 --rate 30 --latency 0.08
+#   python -m benchmarks.bench_broadcast --rate-limit-prob 0.01 --resume
+import argparse
+import asyncio
+import csv
+import os
+import statistics
+import tempfile
+import time
+from collections import Counter
+
+from bot_api import AsyncBotApiClient
+from broadcast import Broadcast, StatusLog, read_recipients
+from fake_bot_api import FakeBotApi
+from message_templates import Template
+from send_scheduler import SendScheduler
+
+TEMPLATE = Template(
+    "📅 <b>{first_name}</b>, до дедлайна модуля «{module}» осталось 2 дня.\n"
+    "Сдайте домашнее задание в тренажере."
+)
+FIRST_CHAT_ID = 10_000_000
+
+
+def write_export(path: str, recipients: int, duplicates: float):
+    """Выгрузка user_courses с telegram_id; часть получателей записана на два курса"""
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['user_id', 'telegram_id', 'first_name', 'course_id', 'module'])
+        every = round(1 / duplicates) if duplicates else 0
+        for number in range(recipients):
+            row = [f'u{number}', FIRST_CHAT_ID + number, f'Студент {number}', 'course-1', 'Когортный анализ']
+            writer.writerow(row)
+            if every and number % every == 0:
+                writer.writerow(row)
+
+
+def windows(times, start: float):
+    """Число сообщений в каждой полной секунде после start"""
+    per_second = Counter(int(at - start) for at in times)
+    last = max(per_second) if per_second else 0
+    return [per_second.get(second, 0) for second in range(last)]
+
+
+async def run_broadcast(fake: FakeBotApi, export: str, status: str, args):
+    scheduler = SendScheduler(args.rate, 1.0)
+    client = AsyncBotApiClient('123456:BENCH-TOKEN', base_url=fake.url, pool_size=args.concurrency,
+                               scheduler=scheduler)
+    broadcast = Broadcast(client, TEMPLATE, StatusLog(status), concurrency=args.concurrency, progress_every=0)
+    await scheduler.start()
+    try:
+        return await broadcast.run(read_recipients(export))
+    finally:
+        await scheduler.stop()
+        await client.close()
+
+
+async def run_naive(fake: FakeBotApi, count: int) -> float:
+    """Цикл без планировщика и параллелизма: сообщения/с"""
+    client = AsyncBotApiClient('123456:BENCH-TOKEN', base_url=fake.url)
+    start = time.monotonic()
+    for number in range(count):
+        await client.call('sendMessage', chat_id=FIRST_CHAT_ID + number,
+                          text=TEMPLATE.render(first_name='Студент', module='Когортный анализ'))
+    elapsed = time.monotonic() - start
+    await client.close()
+    return count / elapsed
+
+
+async def main_async(args):
+    fake = FakeBotApi(latency=args.latency, jitter=args.jitter, rate_limit_probability=args.rate_limit_prob,
+                      seed=args.seed)
+    await fake.start()
+    with tempfile.TemporaryDirectory(prefix='bench-broadcast-') as directory:
+        export = os.path.join(directory, 'enrollments.csv')
+        status = os.path.join(directory, 'status.jsonl')
+        write_export(export, args.recipients, args.duplicates)
+
+        if args.resume:
+            # Прерываем первую рассылку на середине и продолжаем по журналу
+            task = asyncio.create_task(run_broadcast(fake, export, status, args))
+            await asyncio.sleep(args.recipients / args.rate / 2)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            print(f"прервано после {len(fake.calls)} сообщений, продолжаем по журналу")
+
+        before = len(fake.calls)
+        start = time.monotonic()
+        stats = await run_broadcast(fake, export, status, args)
+        per_second = windows([call['at'] for call in fake.calls[before:]], start)
+        delivered = Counter(call['params'].get('chat_id') for call in fake.calls)
+
+        naive_rate = await run_naive(fake, args.naive)
+    await fake.stop()
+
+    steady = per_second[1:] or per_second
+    print(f"получателей {args.recipients}, лимит {args.rate:.0f}/с, задержка API {args.latency * 1000:.0f} мс")
+    print(f"  отправлено {stats.sent}, ошибок {stats.failed}, уже было {stats.resumed}, "
+          f"повторов в выгрузке {stats.duplicates}, 429 от API {fake.rate_limited}")
+    print(f"  время {stats.elapsed:.1f} с, в среднем {stats.rate:.1f} сообщений/с")
+    if steady:
+        print(f"  по секундам после первой: медиана {statistics.median(steady):.0f}, "
+              f"мин {min(steady)}, макс {max(steady)}")
+    print(f"  получили дважды: {sum(1 for count in delivered.values() if count > 1)}")
+    print(f"наивный цикл: {naive_rate:.1f} сообщений/с "
+          f"({args.recipients / naive_rate / 60:.1f} мин на ту же когорту)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк рассылки по когорте')
+    parser.add_argument('--recipients', type=int, default=3000)
+    parser.add_argument('--duplicates', type=float, default=0.05, help='доля записанных на два курса')
+    parser.add_argument('--rate', type=float, default=30.0, help='лимит сообщений/с на бота')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--latency', type=float, default=0.08)
+    parser.add_argument('--jitter', type=float, default=0.04)
+    parser.add_argument('--rate-limit-prob', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--naive', type=int, default=100, help='сообщений в наивном цикле')
+    parser.add_argument('--resume', action='store_true', help='прервать на середине и продолжить')
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+# benchmarks/bench_cluster.py - Масштабирование бота по процессам-воркерам
+#
+# Фейковый Bot API работает в отдельном процессе и сам подает апдейты
+# (/start и /help вперемешку от множества пользователей). Фронт bot_cluster
+# забирает их через getUpdates и раскладывает по воркерам. Замеряется время
+# до ответа на каждый апдейт и проверяется, что ответы каждому пользователю
+# пришли в порядке его сообщений, в том числе при перебалансировке
+# посреди нагрузки (--resize-to).
+#
+# Запуск из корня репозитория:
+#   python -m benchmarks.bench_cluster --updates 4000 --workers 1 2 4
+#   python -m benchmarks.bench_cluster --workers 2 --resize-to 3
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+from collections import defaultdict
+
+_STATE_DIR = tempfile.mkdtemp(prefix='bench-cluster-')
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:BENCH-TOKEN')
+# Меряем обработку апдейтов, а не лимиты Telegram
+os.environ.setdefault('SEND_GLOBAL_RATE', '1000000')
+os.environ.setdefault('SEND_CHAT_RATE', '1000000')
+os.environ.setdefault('STATS_DB_PATH', '')
+os.environ.setdefault('SUBMISSION_JOURNAL', os.path.join(_STATE_DIR, 'submissions.journal'))
+os.environ.setdefault('MATERIALS_SNAPSHOT', '')
+
+from bot_api import AsyncBotApiClient  # noqa: E402
+from bot_cluster import ClusterFront  # noqa: E402
+from fake_bot_api import FakeBotApi, make_message_update  # noqa: E402
+
+COMMANDS = ('/start', '/help')
+# Начало ответа на каждую команду (шаблоны WELCOME и HELP)
+REPLY_MARKERS = {'/start': 'Добро пожаловать', '/help': 'Помощь по'}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def expected_commands(updates: int, users: int):
+    """Последовательность (update_id, user_id, команда): у каждого пользователя чередование"""
+    sequence = []
+    sent = defaultdict(int)
+    for update_id in range(1, updates + 1):
+        user_id = 100000 + update_id % users
+        sequence.append((update_id, user_id, COMMANDS[sent[user_id] % len(COMMANDS)]))
+        sent[user_id] += 1
+    return sequence
+
+
+def run_fake_api(port: int, latency: float, conn):
+    """Процесс фейкового Bot API: команды от бенчмарка приходят через pipe"""
+
+    async def main():
+        fake = FakeBotApi(latency=latency)
+        await fake.start(port=port)
+        conn.send('ready')
+        while True:
+            command, payload = await asyncio.to_thread(conn.recv)
+            if command == 'push':
+                for update in payload:
+                    fake.push_update(update)
+            elif command == 'count':
+                conn.send(fake.method_counts['sendMessage'])
+            elif command == 'replies':
+                conn.send([
+                    (call['params'].get('chat_id'), call['params'].get('text', ''))
+                    for call in fake.calls if call['method'] == 'sendMessage'
+                ])
+            elif command == 'stop':
+                await fake.stop()
+                conn.send('stopped')
+                return
+
+    asyncio.run(main())
+
+
+def order_violations(replies, sequence) -> int:
+    expected = defaultdict(list)
+    for _, user_id, command in sequence:
+        expected[user_id].append(REPLY_MARKERS[command])
+    received = defaultdict(list)
+    for chat_id, text in replies:
+        received[int(chat_id)].append(text)
+    violations = 0
+    for user_id, markers in expected.items():
+        texts = received.get(user_id, [])
+        if len(texts) != len(markers) or any(marker not in text for marker, text in zip(markers, texts)):
+            violations += 1
+    return violations
+
+
+async def run(workers: int, updates: int, users: int, latency: float, resize_to: int = 0):
+    context = multiprocessing.get_context('spawn')
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    os.environ['BOT_API_BASE_URL'] = base_url
+    conn, child_conn = context.Pipe()
+    fake_process = context.Process(target=run_fake_api, args=(port, latency, child_conn), name='fake-bot-api')
+    fake_process.start()
+    conn.recv()
+
+    async def request(command, payload=None):
+        conn.send((command, payload))
+        return await asyncio.to_thread(conn.recv)
+
+    front = ClusterFront(workers, global_rate=float(os.environ['SEND_GLOBAL_RATE']))
+    await front.start()
+    client = AsyncBotApiClient(os.environ['TELEGRAM_BOT_TOKEN'], base_url=base_url, timeout=30)
+    poller = asyncio.create_task(front.poll(client, poll_timeout=1))
+
+    sequence = expected_commands(updates, users)
+    batches = [sequence[i:i + 500] for i in range(0, len(sequence), 500)]
+    start = time.perf_counter()
+    for number, batch in enumerate(batches):
+        conn.send(('push', [make_message_update(update_id, user_id, command) for update_id, user_id, command in batch]))
+        if resize_to and number == len(batches) // 2:
+            await front.resize(resize_to)
+    while await request('count') < updates:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - start
+
+    replies = await request('replies')
+    poller.cancel()
+    await asyncio.gather(poller, return_exceptions=True)
+    await front.stop()
+    await client.close()
+    await request('stop')
+    fake_process.join()
+    return updates / elapsed, order_violations(replies, sequence)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк масштабирования бота по процессам')
+    parser.add_argument('--updates', type=int, default=4000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.01, help='задержка фейкового Bot API, с')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--resize-to', type=int, default=0, help='перебалансировка посреди нагрузки')
+    args = parser.parse_args()
+
+    print(f"{'воркеров':>9} {'апдейтов/с':>11} {'ускорение':>10} {'нарушений порядка':>18}")
+    baseline = None
+    for workers in args.workers:
+        rate, violations = await run(workers, args.updates, args.users, args.latency, args.resize_to)
+        baseline = baseline or rate
+        name = f"{workers}->{args.resize_to}" if args.resize_to else str(workers)
+        print(f"{name:>9} {rate:>11,.0f} {rate / baseline:>9.2f}x {violations:>18}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
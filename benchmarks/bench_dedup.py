@@ -0,0 +1,87 @@
+# benchmarks/bench_dedup.py - Окно повторов: фильтры Блума против точного словаря
+#
+# Сравнивает RecentKeys с dict ключ -> время (с чисткой по окну) по
+# скорости проверки+записи, памяти и доле ложных повторов.
+#
+# Запуск из корня репозитория:
+#   python -m benchmarks.bench_dedup --keys 500000
+import argparse
+import sys
+import time
+import tracemalloc
+
+from dedup import RecentKeys
+
+
+class ExactWindow:
+    """Точное окно: словарь с временем записи, устаревшие ключи чистятся пачкой"""
+
+    def __init__(self, window: float):
+        self.window = window
+        self.seen = {}
+        self._cleaned = time.monotonic()
+
+    def check_and_add(self, key, now: float) -> bool:
+        if now - self._cleaned > self.window / 4:
+            self.seen = {k: t for k, t in self.seen.items() if now - t < self.window}
+            self._cleaned = now
+        duplicate = key in self.seen
+        self.seen[key] = now
+        return duplicate
+
+
+def timed(fn, keys: int):
+    """Скорость - без tracemalloc, память - отдельным прогоном под ним"""
+    start = time.perf_counter()
+    fn()
+    rate = keys / (time.perf_counter() - start)
+    tracemalloc.start()
+    structure = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return rate, peak, structure
+
+
+def run_bloom(keys: int, capacity: int, error_rate: float):
+    def fill():
+        recent = RecentKeys(window=300, capacity=capacity, error_rate=error_rate)
+        for update_id in range(keys):
+            recent.check_and_add(('update', update_id))
+        return recent
+
+    rate, peak, recent = timed(fill, keys)
+    probes = 100_000
+    false_positives = sum(('update', keys + i) in recent for i in range(probes))
+    return rate, max(peak, recent.memory_bytes()), false_positives / probes
+
+
+def run_exact(keys: int):
+    def fill():
+        exact = ExactWindow(window=300)
+        for update_id in range(keys):
+            exact.check_and_add(('update', update_id), time.monotonic())
+        return exact
+
+    rate, peak, _ = timed(fill, keys)
+    return rate, peak, 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк окна повторов')
+    parser.add_argument('--keys', type=int, default=500_000, help='ключей за окно')
+    parser.add_argument('--capacity', type=int, default=100_000, help='ключей на поколение фильтра')
+    parser.add_argument('--error-rate', type=float, default=1e-6)
+    args = parser.parse_args()
+
+    print(f"{'структура':<22} {'операций/с':>12} {'память, МБ':>11} {'ложные повторы':>15}")
+    for name, (rate, memory, fp_rate) in (
+        ('фильтры Блума', run_bloom(args.keys, args.capacity, args.error_rate)),
+        ('dict с временем', run_exact(args.keys)),
+    ):
+        print(f"{name:<22} {rate:>12,.0f} {memory / 2**20:>11.1f} {fp_rate:>15.2e}")
+    print(f"\nPython {sys.version.split()[0]}; память фильтров не растет с числом ключей сверх "
+          f"4 x {args.capacity:,} (поколение сменяется при заполнении)")
+
+
+if __name__ == '__main__':
+    main()
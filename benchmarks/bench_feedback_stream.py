@@ -0,0 +1,55 @@
+# benchmarks/bench_feedback_stream.py - Время до первой обратной связи
+#
+# Сравнивает итоговую отправку (StubGrader) и потоковую выдачу
+# (FakeStreamingGrader + ProgressiveEditor) по времени до первого
+# видимого студенту текста и числу правок сообщения.
+#
+# Запуск из корня репозитория:
+#   python -m benchmarks.bench_feedback_stream
+import argparse
+import asyncio
+import time
+
+from grading import FakeStreamingGrader, ProgressiveEditor, StubGrader, Submission
+
+
+async def run(grader, streaming: bool, interval: float):
+    start = time.monotonic()
+    first_text = []
+    edits = []
+
+    async def edit(text: str):
+        edits.append(text)
+        if not first_text:
+            first_text.append(time.monotonic() - start)
+
+    editor = ProgressiveEditor(edit, min_interval=interval)
+    submission = Submission(user_id=1, task_id='cohort-analysis-sql', user_answer='SELECT ...')
+    await grader.grade(submission, editor.update if streaming else None)
+    await editor.close()
+    total = time.monotonic() - start
+    # Итоговый результат - тоже одна правка
+    ttff = first_text[0] if first_text else total
+    return ttff, total, len(edits) + 1
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк потоковой обратной связи')
+    parser.add_argument('--first-token', type=float, default=0.4)
+    parser.add_argument('--token-delay', type=float, default=0.08)
+    parser.add_argument('--interval', type=float, default=1.5)
+    args = parser.parse_args()
+
+    streaming = FakeStreamingGrader(args.first_token, args.token_delay)
+    # Заглушка с тем же полным временем проверки
+    _, total, _ = await run(streaming, False, args.interval)
+    stub = StubGrader(delay=total)
+
+    print(f"{'режим':<12} {'первый текст, с':>16} {'всего, с':>10} {'правок':>7}")
+    for name, grader, is_streaming in (('итоговый', stub, False), ('потоковый', streaming, True)):
+        ttff, total, edits = await run(grader, is_streaming, args.interval)
+        print(f"{name:<12} {ttff:>16.2f} {total:>10.2f} {edits:>7}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
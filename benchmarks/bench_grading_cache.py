@@ -0,0 +1,83 @@
+# benchmarks/bench_grading_cache.py - Эффект кэша проверки на повторных отправках
+#
+# Студенты отправляют ответ, затем часть из них жмет "Попробовать снова" и
+# присылает тот же ответ (возможно, с мелкой правкой). Сравнивается время
+# проверки без кэша, с точным кэшем и с поиском почти повторов (MinHash).
+#
+# Запуск из корня репозитория:
+#   python -m benchmarks.bench_grading_cache --students 200 --retries 3
+import argparse
+import asyncio
+import random
+import time
+
+from grading import StubGrader, Submission
+from grading_cache import CachingGrader, GradingCache
+
+WORDS = (
+    'select user_id date_trunc month first_order cohort count distinct orders '
+    'from join on where group by order having retention revenue sum avg'
+).split()
+
+
+def make_answer(rng: random.Random) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(40, 120)))
+
+
+def edit_answer(rng: random.Random, answer: str) -> str:
+    """Мелкая правка: регистр, пробелы или одно слово в конце"""
+    kind = rng.random()
+    if kind < 0.4:
+        return answer.upper()
+    if kind < 0.7:
+        return answer.replace(' ', '  ', 3) + '\n'
+    return answer + ' ' + rng.choice(WORDS)
+
+
+def workload(students: int, retries: int, seed: int):
+    rng = random.Random(seed)
+    submissions = []
+    for user_id in range(students):
+        answer = make_answer(rng)
+        submissions.append(Submission(user_id=user_id, task_id='cohort-analysis-sql', user_answer=answer))
+        for _ in range(rng.randint(0, retries)):
+            answer = edit_answer(rng, answer)
+            submissions.append(Submission(user_id=user_id, task_id='cohort-analysis-sql', user_answer=answer))
+    return submissions
+
+
+async def run(submissions, grader) -> float:
+    start = time.perf_counter()
+    for submission in submissions:
+        await grader.grade(submission)
+    return time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк кэша проверки')
+    parser.add_argument('--students', type=int, default=200)
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--grade-delay', type=float, default=0.01, help='время одной проверки, с')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    submissions = workload(args.students, args.retries, args.seed)
+    print(f"Отправок: {len(submissions)}, студентов: {args.students}")
+    print(f"{'вариант':<12} {'время, с':>9} {'вызовов':>8} {'hit rate':>9} {'сэкономлено, с':>15}")
+
+    base = StubGrader(delay=args.grade_delay)
+    elapsed = await run(submissions, base)
+    print(f"{'без кэша':<12} {elapsed:>9.2f} {len(submissions):>8}")
+
+    for name, threshold in (('точный', 1.0), ('minhash', 0.9)):
+        cache = GradingCache(near_threshold=threshold)
+        elapsed = await run(submissions, CachingGrader(StubGrader(delay=args.grade_delay), cache))
+        stats = cache.stats()
+        print(
+            f"{name:<12} {elapsed:>9.2f} {stats['misses']:>8} "
+            f"{stats['hit_rate']:>9.1%} {stats['saved_seconds']:>15.2f}"
+        )
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+# benchmarks/bench_init_data.py - Микробенчмарк проверки initData
+#
+# Запуск из корня репозитория:
+#   python -m benchmarks.bench_init_data
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import parse_qs, urlencode
+
+from telegram_auth import InitDataVerifier
+
+BOT_TOKEN = "123456:TEST-TOKEN"
+
+
+def legacy_verify(init_data: str) -> bool:
+    """Прежняя реализация verify_telegram_web_app_data + повторный parse_qs"""
+    parsed_data = parse_qs(init_data)
+    received_hash = parsed_data.get('hash', [''])[0]
+    data_check_arr = []
+    for key, value in parsed_data.items():
+        if key != 'hash':
+            data_check_arr.append(f"{key}={value[0]}")
+    data_check_arr.sort()
+    data_check_string = '\n'.join(data_check_arr)
+    secret_key = hmac.new("WebAppData".encode(), BOT_TOKEN.encode(), hashlib.sha256).digest()
+    calculated_hash = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    ok = calculated_hash == received_hash
+    # submit_homework разбирал init_data второй раз ради user
+    json.loads(parse_qs(init_data).get('user', ['{}'])[0])
+    return ok
+
+
+def make_init_data(user_id: int) -> str:
+    fields = {
+        'query_id': f'AAH{user_id}',
+        'user': json.dumps({'id': user_id, 'first_name': 'Тест', 'language_code': 'ru'}),
+        'auth_date': str(int(time.time())),
+    }
+    data_check_string = '\n'.join(f"{k}={fields[k]}" for k in sorted(fields))
+    secret_key = hmac.new(b"WebAppData", BOT_TOKEN.encode(), hashlib.sha256).digest()
+    fields['hash'] = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+def measure(name: str, fn, samples, rounds: int = 20) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for init_data in samples:
+            assert fn(init_data)
+    elapsed = time.perf_counter() - start
+    rate = rounds * len(samples) / elapsed
+    print(f"{name:<32} {rate:>12,.0f} проверок/с")
+    return rate
+
+
+def main():
+    samples = [make_init_data(user_id) for user_id in range(1000)]
+
+    cold = InitDataVerifier(BOT_TOKEN, cache_size=0)
+    warm = InitDataVerifier(BOT_TOKEN)
+
+    base = measure("legacy (parse_qs x2, HMAC x2)", legacy_verify, samples)
+    fast = measure("verifier без кэша", cold.verify, samples)
+    cached = measure("verifier с LRU кэшем", warm.verify, samples)
+
+    print(f"\nУскорение без кэша: x{fast / base:.1f}, с кэшем: x{cached / base:.1f}")
+    print(f"Попаданий в кэш: {warm.hits}, промахов: {warm.misses}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+# benchmarks/bench_journal.py - Пропускная способность журнала заданий и проверка восстановления
+#
+# Режим по умолчанию сравнивает fsync на каждую запись с групповым коммитом
+# (SubmissionJournal и SyncSubmissionJournal) при параллельных отправках.
+#
+# --crash запускает дочерний процесс, который пишет в журнал и печатает
+# подтвержденные записи, убивает его SIGKILL посреди работы и проверяет,
+# что после открытия журнала не потеряно ни одно подтвержденное задание
+# и не воскресло ни одно подтвержденно завершенное.
+#
+# Запуск из корня репозитория:
+#   python -m benchmarks.bench_journal --appends 20000 --concurrency 256
+#   python -m benchmarks.bench_journal --crash
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from submission_journal import (
+    SubmissionJournal,
+    SyncSubmissionJournal,
+    _JournalFile,
+    _encode,
+    accept_record,
+    new_entry_id,
+    read_journal,
+)
+
+ANSWER = 'SELECT user_id, date_trunc(\'month\', first_order) AS cohort FROM orders ' * 4
+
+
+async def bench_fsync_each(path: str, appends: int, concurrency: int) -> float:
+    """Базовый вариант: каждая запись - отдельный write + fsync"""
+    journal_file = _JournalFile(path)
+    lock = asyncio.Lock()
+    per_worker = appends // concurrency
+
+    async def producer(worker: int):
+        for i in range(per_worker):
+            line = _encode(accept_record(new_entry_id(), 'bench', worker, 'task', ANSWER))
+            async with lock:
+                await asyncio.to_thread(journal_file.write_batch, [line])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(producer(worker) for worker in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    journal_file.close()
+    return per_worker * concurrency / elapsed
+
+
+async def bench_group_commit(path: str, appends: int, concurrency: int, commit_delay: float):
+    journal = SubmissionJournal(path, commit_delay=commit_delay)
+    journal.open()
+    await journal.start()
+    per_worker = appends // concurrency
+
+    async def producer(worker: int):
+        for i in range(per_worker):
+            await journal.accept(new_entry_id(), 'bench', worker, 'task', ANSWER)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(producer(worker) for worker in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    stats = journal.stats()
+    await journal.close()
+    return per_worker * concurrency / elapsed, stats['records'] / max(stats['commits'], 1)
+
+
+def bench_sync(path: str, appends: int, threads: int) -> float:
+    journal = SyncSubmissionJournal(path)
+    journal.open()
+    per_worker = appends // threads
+
+    def producer(worker: int):
+        for i in range(per_worker):
+            journal.accept(new_entry_id(), 'bench', worker, 'task', ANSWER)
+
+    workers = [threading.Thread(target=producer, args=(worker,)) for worker in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    journal.close()
+    return per_worker * threads / elapsed
+
+
+async def run_benchmarks(args):
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        baseline_appends = min(args.appends, 2000)
+        rate = await bench_fsync_each(os.path.join(tmp, 'each.journal'), baseline_appends, args.concurrency)
+        print(f"{'вариант':<28} {'записей/с':>10} {'записей на fsync':>17}")
+        print(f"{'fsync на запись':<28} {rate:>10,.0f} {1:>17}")
+        for delay in (0.0, 0.002):
+            rate, batch = await bench_group_commit(
+                os.path.join(tmp, f'group-{delay}.journal'), args.appends, args.concurrency, delay
+            )
+            print(f"{f'group commit, delay={delay * 1000:.0f} мс':<28} {rate:>10,.0f} {batch:>17.1f}")
+        rate = bench_sync(os.path.join(tmp, 'sync.journal'), args.appends, min(args.concurrency, 64))
+        print(f"{'sync group commit (потоки)':<28} {rate:>10,.0f}")
+
+
+# ----------------------------------------------------------------------
+# Проверка восстановления после сбоя
+
+async def crash_child(path: str):
+    """Пишет задания и печатает подтвержденные записи, пока его не убьют"""
+    journal = SubmissionJournal(path)
+    journal.open()
+    await journal.start()
+    rng = random.Random(os.getpid())
+
+    async def producer(worker: int):
+        while True:
+            entry_id = new_entry_id()
+            await journal.accept(entry_id, 'crash', worker, 'task', ANSWER)
+            print(f"A {entry_id}", flush=True)
+            if rng.random() < 0.5:
+                await journal.done(entry_id)
+                print(f"D {entry_id}", flush=True)
+
+    await asyncio.gather(*(producer(worker) for worker in range(64)))
+
+
+def run_crash_check(args) -> bool:
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        path = os.path.join(tmp, 'crash.journal')
+        ok = True
+        for round_no in range(args.rounds):
+            child = subprocess.Popen(
+                [sys.executable, '-m', 'benchmarks.bench_journal', '--crash-child', path],
+                stdout=subprocess.PIPE,
+                text=True,
+            )
+            time.sleep(random.uniform(0.2, 0.6))
+            child.send_signal(signal.SIGKILL)
+            output, _ = child.communicate()
+
+            accepted, done = set(), set()
+            for line in output.splitlines():
+                kind, _, entry_id = line.partition(' ')
+                (accepted if kind == 'A' else done).add(entry_id)
+
+            # Имитация оборванной записи в хвосте файла
+            with open(path, 'ab') as f:
+                f.write(b'{"op":"accept","id":"torn","user_')
+
+            pending = {entry.id for entry in read_journal(path)}
+            # done мог успеть попасть на диск, а подтверждение - нет: это не потеря
+            with open(path, 'rb') as f:
+                written_done = {
+                    json.loads(line)['id'] for line in f
+                    if line.startswith(b'{"op":"done"') and line.endswith(b'\n')
+                }
+            lost = accepted - pending - written_done
+            resurrected = done & pending
+            print(
+                f"раунд {round_no + 1}: подтверждено {len(accepted)}, завершено {len(done)}, "
+                f"в журнале {len(pending)}, потеряно {len(lost)}, воскресло {len(resurrected)}"
+            )
+            ok = ok and not lost and not resurrected and 'torn' not in pending
+
+            # Следующий раунд стартует с восстановленного журнала, как бот после рестарта
+            journal = SyncSubmissionJournal(path)
+            journal.open()
+            journal.close()
+        print('OK' if ok else 'FAIL')
+        return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк журнала заданий')
+    parser.add_argument('--appends', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=256)
+    parser.add_argument('--dir', default=None, help='каталог для файлов журнала (по умолчанию /tmp)')
+    parser.add_argument('--crash', action='store_true', help='проверка восстановления после SIGKILL')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--crash-child', metavar='PATH', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.crash_child:
+        asyncio.run(crash_child(args.crash_child))
+    elif args.crash:
+        sys.exit(0 if run_crash_check(args) else 1)
+    else:
+        asyncio.run(run_benchmarks(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# benchmarks/bench_session_store.py - Задержки get/set хранилищ сессий
+#
+# Запуск из корня репозитория:
+#   python -m benchmarks.bench_session_store --users 1000000
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from session_store import MemorySessionStore, SqliteSessionStore, WriteBehindSessionStore
+
+
+def percentile(samples, q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+async def measure(store, users: int, reads: int, sample_every: int = 100):
+    session = {'last_task_id': 'cohort-analysis-sql', 'step': 3, 'score': 85}
+
+    set_samples = []
+    start = time.perf_counter()
+    for user_id in range(users):
+        if user_id % sample_every == 0:
+            t0 = time.perf_counter()
+            await store.set(user_id, session)
+            set_samples.append(time.perf_counter() - t0)
+        else:
+            await store.set(user_id, session)
+        if user_id % 1000 == 0:
+            # Даем отработать фоновому сбросу, как между апдейтами в боте
+            await asyncio.sleep(0)
+    set_rate = users / (time.perf_counter() - start)
+
+    get_samples = []
+    start = time.perf_counter()
+    for _ in range(reads):
+        t0 = time.perf_counter()
+        await store.get(random.randrange(users))
+        get_samples.append(time.perf_counter() - t0)
+    get_rate = reads / (time.perf_counter() - start)
+    return set_rate, set_samples, get_rate, get_samples
+
+
+def report(name: str, set_rate, set_samples, get_rate, get_samples, stats):
+    us = 1e6
+    print(f"\n{name}")
+    print(f"  set: {set_rate:>10,.0f}/с  p50 {statistics.median(set_samples) * us:.1f} мкс  "
+          f"p99 {percentile(set_samples, 0.99) * us:.1f} мкс")
+    print(f"  get: {get_rate:>10,.0f}/с  p50 {statistics.median(get_samples) * us:.1f} мкс  "
+          f"p99 {percentile(get_samples, 0.99) * us:.1f} мкс")
+    print(f"  stats: {stats}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк хранилищ сессий')
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--reads', type=int, default=200_000)
+    parser.add_argument('--max-entries', type=int, default=100_000)
+    args = parser.parse_args()
+
+    memory = MemorySessionStore(max_entries=args.max_entries)
+    report('memory (LRU+TTL)', *await measure(memory, args.users, args.reads), memory.stats())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = WriteBehindSessionStore(
+            MemorySessionStore(max_entries=args.max_entries),
+            SqliteSessionStore(os.path.join(tmp, 'sessions.db')),
+        )
+        await store.start()
+        result = await measure(store, args.users, args.reads)
+        await store.close()
+        report('sqlite (WAL) + write-behind', *result, store.stats())
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+# benchmarks/bench_startup.py - Холодный старт точек входа
+#
+# Каждый замер - новый процесс интерпретатора: время от старта процесса до
+# конца импорта модуля точки входа (по startup.elapsed()) и, с --report,
+# самые медленные пакеты из отчета startup.
+#
+# Запуск из корня репозитория:
+#   python -m benchmarks.bench_startup --runs 5
+#   python -m benchmarks.bench_startup --modules webapp_async --report
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ENTRY_POINTS = ('telegram_bot', 'webapp_server', 'webapp_async')
+
+PROBE = """
+import startup
+import {module}
+print(startup.elapsed())
+for package, seconds in startup.import_times({top}):
+    print(package, seconds)
+"""
+
+
+def measure(module: str, top: int):
+    env = dict(os.environ, STARTUP_REPORT='1', METRICS_PORT='0', LOG_LEVEL='WARNING')
+    env.setdefault('TELEGRAM_BOT_TOKEN', '123456:BENCH-TOKEN')
+    completed = subprocess.run(
+        [sys.executable, '-c', PROBE.format(module=module, top=top)],
+        capture_output=True, text=True, env=env,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+    lines = completed.stdout.split('\n')
+    imports = [(name, float(seconds)) for name, seconds in (line.split() for line in lines[1:] if line)]
+    return float(lines[0]), imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк холодного старта')
+    parser.add_argument('--modules', nargs='+', default=list(ENTRY_POINTS))
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--report', action='store_true', help='медленные пакеты последнего запуска')
+    parser.add_argument('--top', type=int, default=8)
+    args = parser.parse_args()
+
+    print(f"{'модуль':<16} {'медиана, с':>11} {'мин, с':>8}")
+    for module in args.modules:
+        try:
+            samples = [measure(module, args.top) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f"{module:<16} не импортируется: {e}")
+            continue
+        times = [elapsed for elapsed, _ in samples]
+        print(f"{module:<16} {statistics.median(times):>11.3f} {min(times):>8.3f}")
+        if args.report:
+            for package, seconds in samples[-1][1]:
+                print(f"    {package:<22} {seconds:>7.3f} с")
+
+
+if __name__ == '__main__':
+    main()
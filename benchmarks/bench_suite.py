@@ -0,0 +1,376 @@
+# benchmarks/bench_suite.py - Нагрузочные сценарии бота и сервера WebApp с базовой линией
+#
+# Каждый сценарий запускается в отдельном процессе вместе с фейковым Bot API
+# (задержка, разброс задержки, инъекция 429). Для каждого апдейта или запроса
+# замеряется время от появления до завершающего вызова Bot API:
+#
+#   start_storm     /start от множества новых пользователей -> sendMessage
+#   submit_burst    sendData submit_homework -> editMessageText с оценкой
+#   callback_flood  нажатия "Следующее задание"/"Попробовать снова" -> editMessageText
+#   webapp_submit   POST /api/submit-homework на webapp_async -> HTTP-ответ
+#
+# Итог: пропускная способность, p50/p95/p99 и прирост пикового RSS процесса.
+# --save-baseline сохраняет результаты в benchmarks/baselines.json, следующие
+# запуски с теми же параметрами сравниваются с ними (код выхода 1 при регрессии).
+#
+# Запуск из корня репозитория:
+#   python -m benchmarks.bench_suite --save-baseline
+#   python -m benchmarks.bench_suite --only start_storm callback_flood --rate-limit-prob 0.01
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import resource
+import socket
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlencode
+
+_STATE_DIR = tempfile.mkdtemp(prefix='bench-suite-')
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:BENCH-TOKEN')
+# Меряем обработку апдейтов, а не лимиты Telegram
+os.environ.setdefault('SEND_GLOBAL_RATE', '1000000')
+os.environ.setdefault('SEND_CHAT_RATE', '1000000')
+# Разные студенты присылают разные ответы: кэш проверки не участвует
+os.environ.setdefault('GRADING_CACHE_SIZE', '0')
+os.environ.setdefault('STATS_DB_PATH', '')
+os.environ.setdefault('SUBMISSION_JOURNAL', os.path.join(_STATE_DIR, 'submissions.journal'))
+os.environ.setdefault('WEBAPP_JOURNAL', os.path.join(_STATE_DIR, 'webapp.journal'))
+os.environ.setdefault('MATERIALS_SNAPSHOT', '')
+os.environ.setdefault('METRICS_PORT', '0')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+WORKLOADS = ('start_storm', 'submit_burst', 'callback_flood', 'webapp_submit')
+FIRST_USER_ID = 100000
+# Начало текста с итоговой оценкой (шаблон HOMEWORK_RESULT)
+RESULT_MARKER = 'Задание проверено'
+
+
+@dataclass
+class Result:
+    workload: str
+    requests: int
+    completed: int
+    seconds: float
+    throughput: float
+    p50: float
+    p95: float
+    p99: float
+    rss_mb: float
+    rate_limited: int
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss в Linux - килобайты
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def sign_init_data(token: str, user_id: int) -> str:
+    """initData, подписанный как в Telegram WebApp"""
+    fields = {
+        'query_id': f'AAH{user_id}',
+        'user': json.dumps({'id': user_id, 'first_name': 'Тест', 'language_code': 'ru'}),
+        'auth_date': str(int(time.time())),
+    }
+    data_check_string = '\n'.join(f"{k}={fields[k]}" for k in sorted(fields))
+    secret_key = hmac.new(b"WebAppData", token.encode(), hashlib.sha256).digest()
+    fields['hash'] = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+# ----------------------------------------------------------------------
+# Сценарии бота: апдейты через фейковый Bot API, завершение - вызов Bot API
+
+def make_updates(workload: str, count: int, users: int) -> List[Dict[str, Any]]:
+    from fake_bot_api import make_callback_update, make_message_update, make_web_app_data_update
+
+    updates = []
+    for update_id in range(1, count + 1):
+        if workload == 'start_storm':
+            updates.append(make_message_update(update_id, FIRST_USER_ID + update_id, '/start'))
+        elif workload == 'submit_burst':
+            updates.append(make_web_app_data_update(update_id, FIRST_USER_ID + update_id, {
+                'action': 'submit_homework',
+                'taskId': 'cohort-analysis-sql',
+                'userAnswer': f"SELECT cohort, COUNT(*) FROM orders_{update_id} GROUP BY cohort",
+            }))
+        else:
+            data = 'next_task' if update_id % 2 else 'retry'
+            updates.append(make_callback_update(update_id, FIRST_USER_ID + update_id % users, data))
+    return updates
+
+
+def completed_update(workload: str, call: Dict[str, Any]) -> Optional[int]:
+    """update_id, который завершает этот вызов Bot API, или None"""
+    method = call['method']
+    params = call['params']
+    if workload == 'start_storm' and method == 'sendMessage':
+        return int(params['chat_id']) - FIRST_USER_ID
+    if workload == 'submit_burst' and method == 'editMessageText' and RESULT_MARKER in params.get('text', ''):
+        return int(params['chat_id']) - FIRST_USER_ID
+    if workload == 'callback_flood' and method == 'editMessageText':
+        # make_callback_update: message_id сообщения с кнопкой равен update_id
+        return int(params['message_id'])
+    return None
+
+
+def latencies(fake, workload: str) -> Dict[int, float]:
+    done: Dict[int, float] = {}
+    for call in fake.calls:
+        update_id = completed_update(workload, call)
+        if update_id is not None and update_id not in done and update_id in fake.pushed_at:
+            done[update_id] = call['at'] - fake.pushed_at[update_id]
+    return done
+
+
+async def run_bot_workload(workload: str, options: Dict[str, Any]) -> Result:
+    from fake_bot_api import FakeBotApi
+    from grading import StubGrader
+    import telegram_bot
+
+    fake = FakeBotApi(
+        latency=options['latency'],
+        jitter=options['jitter'],
+        rate_limit_every=options['rate_limit_every'],
+        rate_limit_probability=options['rate_limit_prob'],
+        seed=options['seed'],
+    )
+    telegram_bot.BOT_API_BASE_URL = await fake.start()
+    telegram_bot.BOT_CONCURRENT_UPDATES = options['concurrency']
+    telegram_bot.create_grader = lambda: StubGrader(delay=options['grading_delay'])
+
+    bot = telegram_bot.TrainingBot()
+    application = telegram_bot.build_application(bot)
+    allowed_updates = telegram_bot.allowed_updates_for(application)
+    updates = make_updates(workload, options['count'], options['users'])
+
+    async with application:
+        # post_init/post_stop вызывает только run_polling/run_webhook
+        await bot.post_init(application)
+        await application.start()
+        if options['mode'] == 'webhook':
+            port = _free_port()
+            await application.updater.start_webhook(
+                listen='127.0.0.1',
+                port=port,
+                url_path='telegram',
+                webhook_url=f'http://127.0.0.1:{port}/telegram',
+                secret_token='bench',
+                allowed_updates=allowed_updates,
+            )
+        else:
+            await application.updater.start_polling(poll_interval=0.0, timeout=1, allowed_updates=allowed_updates)
+
+        rss_before = _peak_rss_mb()
+        start = time.monotonic()
+        for update in updates:
+            fake.push_update(update)
+        deadline = start + options['timeout']
+        done = {}
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            done = latencies(fake, workload)
+            if len(done) >= len(updates):
+                break
+        elapsed = (max(fake.pushed_at[u] + t for u, t in done.items()) - start) if done else time.monotonic() - start
+        rss_growth = _peak_rss_mb() - rss_before
+
+        await application.updater.stop()
+        await application.stop()
+        await bot.post_stop(application)
+
+    await fake.stop()
+    return _result(workload, len(updates), list(done.values()), elapsed, rss_growth, fake.rate_limited)
+
+
+# ----------------------------------------------------------------------
+# Сценарий сервера WebApp: HTTP-запросы к webapp_async
+
+async def run_webapp_workload(options: Dict[str, Any]) -> Result:
+    import aiohttp
+    from aiohttp import web
+
+    from fake_bot_api import FakeBotApi
+
+    fake = FakeBotApi(
+        latency=options['latency'],
+        jitter=options['jitter'],
+        rate_limit_every=options['rate_limit_every'],
+        rate_limit_probability=options['rate_limit_prob'],
+        seed=options['seed'],
+    )
+    os.environ['BOT_API_BASE_URL'] = await fake.start()
+    import webapp_async
+
+    runner = web.AppRunner(webapp_async.create_app())
+    await runner.setup()
+    port = _free_port()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    url = f'http://127.0.0.1:{port}/api/submit-homework'
+    token = os.environ['TELEGRAM_BOT_TOKEN']
+
+    samples: List[float] = []
+    semaphore = asyncio.Semaphore(options['concurrency'])
+
+    async def submit(session: aiohttp.ClientSession, number: int):
+        user_id = FIRST_USER_ID + number
+        body = {'taskId': 'cohort-analysis-sql', 'userAnswer': f"SELECT * FROM orders_{number}"}
+        headers = {'X-Telegram-Init-Data': sign_init_data(token, user_id)}
+        async with semaphore:
+            t0 = time.monotonic()
+            async with session.post(url, json=body, headers=headers) as response:
+                await response.read()
+                if response.status == 200:
+                    samples.append(time.monotonic() - t0)
+
+    rss_before = _peak_rss_mb()
+    start = time.monotonic()
+    connector = aiohttp.TCPConnector(limit=options['concurrency'])
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.wait_for(
+            asyncio.gather(*(submit(session, n) for n in range(1, options['count'] + 1))),
+            options['timeout'],
+        )
+    elapsed = time.monotonic() - start
+    rss_growth = _peak_rss_mb() - rss_before
+
+    await runner.cleanup()
+    await fake.stop()
+    return _result('webapp_submit', options['count'], samples, elapsed, rss_growth, fake.rate_limited)
+
+
+def _result(workload: str, requests: int, samples: List[float], elapsed: float,
+            rss_growth: float, rate_limited: int) -> Result:
+    return Result(
+        workload=workload,
+        requests=requests,
+        completed=len(samples),
+        seconds=round(elapsed, 3),
+        throughput=round(len(samples) / elapsed, 1) if elapsed > 0 else 0.0,
+        p50=round(percentile(samples, 0.50), 4),
+        p95=round(percentile(samples, 0.95), 4),
+        p99=round(percentile(samples, 0.99), 4),
+        rss_mb=round(rss_growth, 1),
+        rate_limited=rate_limited,
+    )
+
+
+def run_in_child(workload: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Точка входа процесса сценария: RSS меряется без следов других сценариев"""
+    if workload == 'webapp_submit':
+        result = asyncio.run(run_webapp_workload(options))
+    else:
+        result = asyncio.run(run_bot_workload(workload, options))
+    return asdict(result)
+
+
+# ----------------------------------------------------------------------
+# Базовая линия
+
+def load_baselines() -> Dict[str, Any]:
+    if not os.path.exists(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baselines(baselines: Dict[str, Any]):
+    with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+        json.dump(baselines, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def regressions(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Ухудшения относительно базовой линии больше чем на tolerance"""
+    found = []
+    if result['completed'] < baseline['completed']:
+        found.append(f"завершено {result['completed']} < {baseline['completed']}")
+    if result['throughput'] < baseline['throughput'] * (1 - tolerance):
+        found.append(f"throughput {result['throughput']:,.0f} < {baseline['throughput']:,.0f}/с")
+    for key in ('p95', 'p99'):
+        if result[key] > baseline[key] * (1 + tolerance):
+            found.append(f"{key} {result[key] * 1000:.0f} > {baseline[key] * 1000:.0f} мс")
+    # Мелкий прирост памяти шумит: сравниваем, только если он заметен
+    if result['rss_mb'] > max(baseline['rss_mb'] * (1 + tolerance), baseline['rss_mb'] + 5):
+        found.append(f"RSS +{result['rss_mb']:.0f} > +{baseline['rss_mb']:.0f} МБ")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочные сценарии бота и сервера WebApp')
+    parser.add_argument('--only', nargs='+', choices=WORKLOADS, default=list(WORKLOADS))
+    parser.add_argument('--count', type=int, default=1000, help='апдейтов/запросов на сценарий')
+    parser.add_argument('--users', type=int, default=200, help='пользователей в callback_flood')
+    parser.add_argument('--mode', choices=['polling', 'webhook'], default='polling')
+    parser.add_argument('--concurrency', type=int, default=32, help='параллельных апдейтов/HTTP-запросов')
+    parser.add_argument('--latency', type=float, default=0.02, help='задержка фейкового Bot API, с')
+    parser.add_argument('--jitter', type=float, default=0.01, help='случайная добавка к задержке, с')
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='429 на каждый N-й вызов')
+    parser.add_argument('--rate-limit-prob', type=float, default=0.0, help='вероятность ответа 429')
+    parser.add_argument('--grading-delay', type=float, default=0.05, help='время проверки заглушкой, с')
+    parser.add_argument('--timeout', type=float, default=120.0, help='предел на сценарий, с')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tolerance', type=float, default=0.2, help='допустимое ухудшение, доля')
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    options = {
+        key: getattr(args, key) for key in (
+            'count', 'users', 'mode', 'concurrency', 'latency', 'jitter', 'rate_limit_every',
+            'rate_limit_prob', 'grading_delay', 'timeout', 'seed',
+        )
+    }
+    # С базовой линией сравниваются только запуски с теми же параметрами
+    params = {key: value for key, value in options.items() if key != 'timeout'}
+    baselines = load_baselines()
+
+    print(f"{'сценарий':<15} {'готово':>11} {'в секунду':>10} {'p50, мс':>8} {'p95, мс':>8} "
+          f"{'p99, мс':>8} {'RSS, МБ':>8} {'429':>5}  базовая линия")
+    failed = False
+    for workload in args.only:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            result = executor.submit(run_in_child, workload, options).result()
+
+        baseline = baselines.get(workload)
+        if baseline is None or baseline['params'] != params:
+            verdict = '-'
+        else:
+            found = regressions(result, baseline['result'], args.tolerance)
+            failed = failed or bool(found)
+            verdict = 'РЕГРЕССИЯ: ' + '; '.join(found) if found else 'ok'
+        print(f"{workload:<15} {result['completed']:>5}/{result['requests']:<5} {result['throughput']:>10,.0f} "
+              f"{result['p50'] * 1000:>8.0f} {result['p95'] * 1000:>8.0f} {result['p99'] * 1000:>8.0f} "
+              f"{result['rss_mb']:>8.1f} {result['rate_limited']:>5}  {verdict}")
+        if args.save_baseline:
+            baselines[workload] = {'params': params, 'result': result}
+
+    if args.save_baseline:
+        save_baselines(baselines)
+        print(f"\nБазовая линия сохранена в {BASELINE_PATH}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
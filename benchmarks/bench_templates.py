@@ -0,0 +1,112 @@
+# benchmarks/bench_templates.py - Стоимость подготовки одного ответа бота
+#
+# Сравнивает прежнюю сборку (f-строка + новые объекты клавиатуры на каждый
+# ответ) с предкомпилированными шаблонами и закэшированной разметкой.
+#
+# Запуск из корня репозитория:
+#   python -m benchmarks.bench_templates --iterations 20000
+import argparse
+import html
+import time
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup, WebAppInfo
+
+import keyboards
+import message_templates
+from grading import STUB_ACHIEVEMENT, STUB_FEEDBACK, STUB_RECOMMENDATIONS
+
+APP_URL = 'https://tap-tile-tango.onrender.com'
+ANSWER = 'SELECT user_id, date_trunc(\'month\', first_order) AS cohort FROM orders WHERE amount > 0 ' * 5
+
+
+def legacy_start(first_name: str):
+    keyboard = [
+        [KeyboardButton("🚀 Открыть тренажер", web_app=WebAppInfo(url=APP_URL))],
+        [KeyboardButton("📊 Мои результаты"), KeyboardButton("❓ Помощь")],
+    ]
+    markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True, input_field_placeholder="Выберите действие...")
+    text = f"""
+🎯 <b>Добро пожаловать в AI Тренажер, {first_name}!</b>
+
+Это интерактивная система обучения работе с ИИ-инструментами.
+
+<b>🔥 Возможности:</b>
+• Практические задания по анализу данных
+• Автоматическая проверка домашних заданий
+• Персональная обратная связь от ИИ
+• Отслеживание прогресса
+
+<b>📱 Как начать:</b>
+Нажмите кнопку <b>"🚀 Открыть тренажер"</b> внизу экрана.
+
+<i>💡 Подсказка: WebApp откроется прямо в Telegram!</i>
+        """
+    return text, markup
+
+
+def legacy_result(score: int, user_answer: str):
+    recommendations = '\n'.join(f"• {html.escape(item, quote=False)}" for item in STUB_RECOMMENDATIONS)
+    text = f"""
+🎉 <b>Задание проверено!</b>
+
+🎯 <b>Оценка: {score}/100</b>
+
+<b>📝 Ваш ответ:</b>
+<i>{user_answer[:200]}...</i>
+
+<b>✅ Обратная связь:</b>
+{html.escape(STUB_FEEDBACK, quote=False)}
+
+<b>💡 Рекомендации:</b>
+{recommendations}
+"""
+    text += f"""
+<b>🏆 Достижение разблокировано:</b>
+{STUB_ACHIEVEMENT}
+"""
+    keyboard = [
+        [
+            InlineKeyboardButton("📊 Следующее задание", callback_data="next_task"),
+            InlineKeyboardButton("🔄 Попробовать снова", callback_data="retry"),
+        ],
+        [InlineKeyboardButton("🏠 В главное меню", web_app=WebAppInfo(url=APP_URL))],
+    ]
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+def templated_start(first_name: str):
+    return message_templates.WELCOME.render(first_name=first_name), keyboards.main_menu(APP_URL)
+
+
+def templated_result(score: int, user_answer: str):
+    text = message_templates.render_homework_result(
+        score, user_answer, STUB_FEEDBACK, STUB_RECOMMENDATIONS, STUB_ACHIEVEMENT,
+    )
+    return text, keyboards.homework_result(APP_URL)
+
+
+def measure(fn, iterations: int, *args) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(*args)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк подготовки ответов')
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    cases = (
+        ('/start', legacy_start, templated_start, ('Анна',)),
+        ('результат', legacy_result, templated_result, (85, ANSWER)),
+    )
+    print(f"{'ответ':<12} {'было, мкс':>10} {'стало, мкс':>11} {'ускорение':>10}")
+    for name, legacy, templated, case_args in cases:
+        before = measure(legacy, args.iterations, *case_args)
+        after = measure(templated, args.iterations, *case_args)
+        print(f"{name:<12} {before:>10.2f} {after:>11.2f} {before / after:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# benchmarks/bench_updates.py - Пропускная способность бота: polling vs webhook
+#
+# Бот работает против локального fake_bot_api.py, апдейты /start подаются
+# пачкой, замеряется время до отправки ответа на каждый.
+#
+# Запуск из корня репозитория:
+#   python -m benchmarks.bench_updates --updates 2000 --concurrency 1 32
+import argparse
+import asyncio
+import os
+import socket
+import time
+
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:BENCH-TOKEN')
+# В бенчмарке меряем обработку апдейтов, а не лимиты Telegram
+os.environ.setdefault('SEND_GLOBAL_RATE', '1000000')
+
+import telegram_bot  # noqa: E402
+from fake_bot_api import FakeBotApi, make_message_update  # noqa: E402
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def run_mode(mode: str, updates: int, concurrency: int, latency: float) -> float:
+    fake = FakeBotApi(latency=latency)
+    telegram_bot.BOT_API_BASE_URL = await fake.start()
+    telegram_bot.BOT_CONCURRENT_UPDATES = concurrency
+
+    bot = telegram_bot.TrainingBot()
+    application = telegram_bot.build_application(bot)
+    allowed_updates = telegram_bot.allowed_updates_for(application)
+
+    async with application:
+        await application.start()
+        if mode == 'webhook':
+            port = _free_port()
+            await application.updater.start_webhook(
+                listen='127.0.0.1',
+                port=port,
+                url_path='telegram',
+                webhook_url=f'http://127.0.0.1:{port}/telegram',
+                secret_token='bench',
+                allowed_updates=allowed_updates,
+            )
+        else:
+            await application.updater.start_polling(
+                poll_interval=0.0,
+                timeout=1,
+                allowed_updates=allowed_updates,
+            )
+
+        start = time.perf_counter()
+        for update_id in range(1, updates + 1):
+            fake.push_update(make_message_update(update_id, 100000 + update_id, '/start'))
+        while fake.method_counts['sendMessage'] < updates:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+
+        await application.updater.stop()
+        await application.stop()
+
+    await fake.stop()
+    return updates / elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк polling vs webhook')
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.02, help='задержка фейкового Bot API, с')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 32])
+    args = parser.parse_args()
+
+    print(f"{'режим':<10} {'параллельно':>12} {'апдейтов/с':>12}")
+    for concurrency in args.concurrency:
+        for mode in ('polling', 'webhook'):
+            rate = await run_mode(mode, args.updates, concurrency, args.latency)
+            print(f"{mode:<10} {concurrency:>12} {rate:>12,.0f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
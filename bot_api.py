@@ -0,0 +1,281 @@
+# bot_api.py - Общий клиент Telegram Bot API с пулом соединений и повторами
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+import metrics
+from send_scheduler import PRIORITY_NORMAL
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = 'https://api.telegram.org'
+# Методы, создающие сообщения: после таймаута чтения или 5xx запрос мог
+# дойти, и повтор продублирует сообщение. Их повторяем только на 429 и
+# ошибках установки соединения
+NON_IDEMPOTENT_PREFIXES = ('send', 'forward', 'copy')
+
+
+class BotApiError(Exception):
+    """Ошибка вызова метода Bot API"""
+
+    def __init__(self, method: str, status: int, description: str = '', retry_after: Optional[float] = None):
+        super().__init__(f"{method}: {status} {description}".strip())
+        self.method = method
+        self.status = status
+        self.description = description
+        self.retry_after = retry_after
+
+
+def _retry_delay(attempt: int, payload: Optional[Dict[str, Any]], backoff: float) -> float:
+    """Пауза перед повтором: retry_after от Telegram или экспоненциальная"""
+    if payload:
+        retry_after = (payload.get('parameters') or {}).get('retry_after')
+        if retry_after is not None:
+            return float(retry_after)
+    return backoff * (2 ** attempt) * (0.5 + random.random() / 2)
+
+
+def is_idempotent(method: str) -> bool:
+    return not method.startswith(NON_IDEMPOTENT_PREFIXES)
+
+
+def _should_retry(method: str, status: int) -> bool:
+    return status == 429 or (status >= 500 and is_idempotent(method))
+
+
+def _connect_failed(error: BaseException) -> bool:
+    """Запрос не ушел: соединение не установлено (requests)"""
+    import requests
+    from urllib3.exceptions import NewConnectionError
+
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if isinstance(error, requests.ConnectionError) and error.args:
+        reason = getattr(error.args[0], 'reason', error.args[0])
+        return isinstance(reason, NewConnectionError)
+    return False
+
+
+def _count_failure(method: str, status: int):
+    """Учет неуспешной попытки в метриках (0 - сетевая ошибка)"""
+    if status == 429:
+        metrics.BOT_API_RATE_LIMITED.labels(method).inc()
+    else:
+        metrics.BOT_API_ERRORS.labels(method).inc()
+
+
+class BotApiClient:
+    """Синхронный клиент Bot API поверх requests.Session.
+
+    Одна сессия с keep-alive пулом переиспользуется между запросами,
+    каждый вызов ограничен таймаутом, ответы 429 повторяются после
+    retry_after, 5xx и сетевые ошибки - с экспоненциальной паузой
+    (send*/forward*/copy* - только ошибки соединения). retry_after больше
+    max_retry_after не ждем: поток Flask не должен спать минутами, ошибка
+    с retry_after уходит вызывающему.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        base_url: str = DEFAULT_BASE_URL,
+        timeout: float = 10.0,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        pool_size: int = 32,
+        rate_limiter=None,
+        max_retry_after: float = 5.0,
+    ):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.api_url = f"{base_url.rstrip('/')}/bot{token}"
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.rate_limiter = rate_limiter
+        self.max_retry_after = max_retry_after
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def call(self, method: str, timeout: Optional[float] = None, **params) -> Any:
+        """Вызов метода Bot API, возвращает поле result ответа"""
+        import requests
+
+        attempt = 0
+        while True:
+            payload = None
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(params.get('chat_id'))
+            try:
+                with metrics.BOT_API_SECONDS.labels(method).time():
+                    response = self.session.post(
+                        f"{self.api_url}/{method}",
+                        json=params,
+                        timeout=timeout or self.timeout,
+                    )
+                    status = response.status_code
+                    try:
+                        payload = response.json()
+                    except ValueError:
+                        payload = None
+            except requests.RequestException as e:
+                _count_failure(method, 0)
+                if attempt >= self.max_retries or not (is_idempotent(method) or _connect_failed(e)):
+                    raise BotApiError(method, 0, str(e)) from e
+                status = 0
+                logger.warning(f"Сетевая ошибка {method}: {e}")
+            else:
+                if status == 200 and payload and payload.get('ok'):
+                    return payload.get('result')
+                _count_failure(method, status)
+                if not _should_retry(method, status) or attempt >= self.max_retries:
+                    raise self._error(method, status, payload)
+
+            delay = _retry_delay(attempt, payload, self.backoff)
+            if delay > self.max_retry_after:
+                raise self._error(method, status, payload)
+            logger.warning(f"Повтор {method} через {delay:.1f} с (статус {status})")
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self):
+        self.session.close()
+
+    @staticmethod
+    def _error(method: str, status: int, payload: Optional[Dict[str, Any]]) -> BotApiError:
+        payload = payload or {}
+        retry_after = (payload.get('parameters') or {}).get('retry_after')
+        return BotApiError(method, status, payload.get('description', ''), retry_after)
+
+
+class AsyncBotApiClient:
+    """Асинхронный клиент Bot API поверх aiohttp.ClientSession.
+
+    Сессия создается лениво внутри работающего event loop и держит
+    keep-alive соединения в TCPConnector. Семантика повторов та же,
+    что у BotApiClient, кроме предела retry_after: ожидание не держит поток.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        base_url: str = DEFAULT_BASE_URL,
+        timeout: float = 10.0,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        pool_size: int = 100,
+        scheduler=None,
+    ):
+        self.api_url = f"{base_url.rstrip('/')}/bot{token}"
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.scheduler = scheduler
+        self._session = None
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            import aiohttp
+
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def call(
+        self,
+        method: str,
+        timeout: Optional[float] = None,
+        priority: Optional[int] = None,
+        coalesce_key: Optional[Any] = None,
+        **params
+    ) -> Any:
+        """Вызов метода Bot API, возвращает поле result ответа.
+
+        Если задан scheduler, вызов проходит через SendScheduler с
+        указанным приоритетом и ключом склейки.
+        """
+        if self.scheduler is None:
+            return await self._call(method, timeout, params)
+
+        # 429 не повторяем внутри: планировщик сам приостановит ведро чата
+        return await self.scheduler.send(
+            params.get('chat_id'),
+            lambda: self._call(method, timeout, params, retry_rate_limits=False),
+            PRIORITY_NORMAL if priority is None else priority,
+            coalesce_key,
+        )
+
+    async def get_updates(
+        self,
+        offset: int = 0,
+        poll_timeout: int = 30,
+        limit: int = 100,
+        allowed_updates: Optional[List[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Long polling getUpdates: таймаут запроса больше таймаута опроса"""
+        params: Dict[str, Any] = {'offset': offset, 'timeout': poll_timeout, 'limit': limit}
+        if allowed_updates is not None:
+            params['allowed_updates'] = allowed_updates
+        return await self._call('getUpdates', poll_timeout + self.timeout, params)
+
+    async def _call(
+        self,
+        method: str,
+        timeout: Optional[float],
+        params: Dict[str, Any],
+        retry_rate_limits: bool = True,
+    ) -> Any:
+        import aiohttp
+
+        session = await self._get_session()
+        request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+        attempt = 0
+        while True:
+            payload = None
+            try:
+                with metrics.BOT_API_SECONDS.labels(method).time():
+                    async with session.post(
+                        f"{self.api_url}/{method}",
+                        json=params,
+                        timeout=request_timeout,
+                    ) as response:
+                        status = response.status
+                        try:
+                            payload = await response.json(content_type=None)
+                        except ValueError:
+                            payload = None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                _count_failure(method, 0)
+                connect_failed = isinstance(e, aiohttp.ClientConnectorError)
+                if attempt >= self.max_retries or not (is_idempotent(method) or connect_failed):
+                    raise BotApiError(method, 0, str(e) or type(e).__name__) from e
+                status = 0
+                logger.warning(f"Сетевая ошибка {method}: {e!r}")
+            else:
+                if status == 200 and payload and payload.get('ok'):
+                    return payload.get('result')
+                _count_failure(method, status)
+                if status == 429 and not retry_rate_limits:
+                    raise BotApiClient._error(method, status, payload)
+                if not _should_retry(method, status) or attempt >= self.max_retries:
+                    raise BotApiClient._error(method, status, payload)
+
+            delay = _retry_delay(attempt, payload, self.backoff)
+            logger.warning(f"Повтор {method} через {delay:.1f} с (статус {status})")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
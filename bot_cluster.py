@@ -0,0 +1,660 @@
+# bot_cluster.py - Горизонтальное масштабирование бота: фронт-процесс и шарды по user_id
+#
+# Фронт получает апдейты (long polling или webhook) и раскладывает их по N
+# процессам-воркерам по хэшу user_id на консистентном кольце. У каждого
+# воркера свой event loop и свой Application. Апдейты идут строками JSON
+# через unix-сокет, поэтому порядок апдейтов одного пользователя сохраняется
+# по пути до воркера, а внутри воркера его держит PerChatUpdateProcessor.
+#
+# Изменение числа воркеров (SIGUSR1 - добавить, SIGUSR2 - убрать) меняет
+# кольцо. Прежний владелец дожидается обработки уже полученных апдейтов
+# уходящих пользователей и передает их сессии и статистику новому. Пока
+# передача не закончена, фронт придерживает новые апдейты этих пользователей.
+# Проверки, начатые до перебалансировки, доставляет прежний воркер (журнал
+# заданий у каждого воркера свой).
+#
+# Воркер подтверждает каждый апдейт, поставленный в свою очередь; offset
+# getUpdates (и ответ на webhook) продвигается только после подтверждения.
+# Не подтвержденный за ACK_TIMEOUT апдейт отправляется снова (например,
+# воркер упал с ним в буфере сокета), повтор отбрасывает дедупликация
+# update_id в боте. Доставка - "хотя бы раз" до очереди воркера; апдейт,
+# принятый воркером, но не обработанный до его падения, теряется - отправки
+# заданий при этом восстанавливает журнал воркера.
+#
+# Запуск: python telegram_bot.py --workers 4 (или BOT_WORKERS=4)
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import tempfile
+import time
+from bisect import bisect
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Dict, List, Optional, Set, Tuple
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+import telegram_bot
+from bot_api import DEFAULT_BASE_URL, AsyncBotApiClient, BotApiError
+
+logger = logging.getLogger(__name__)
+
+# Строки с состоянием пользователей при передаче могут быть большими
+MAX_LINE_BYTES = 16 * 1024 * 1024
+HANDOFF_CHUNK = 1000
+WORKER_START_TIMEOUT = 60.0
+WORKER_STOP_TIMEOUT = 60.0
+# Сколько ждать подтверждения апдейтов от воркеров до повторной отправки
+ACK_TIMEOUT = 10.0
+
+# Поля апдейта, в которых Telegram присылает пользователя или чат
+_UPDATE_FIELDS = (
+    'message', 'edited_message', 'channel_post', 'edited_channel_post',
+    'callback_query', 'inline_query', 'chosen_inline_result', 'shipping_query',
+    'pre_checkout_query', 'poll_answer', 'my_chat_member', 'chat_member', 'chat_join_request',
+)
+
+
+def routing_key(update: Dict[str, Any]) -> int:
+    """Ключ шардирования сырого апдейта: пользователь, иначе чат, иначе update_id.
+
+    Совпадает с PerChatUpdateProcessor.key_for() для разобранного Update.
+    """
+    for name in _UPDATE_FIELDS:
+        payload = update.get(name)
+        if not payload:
+            continue
+        user = payload.get('from') or payload.get('user')
+        if user:
+            return user['id']
+        chat = payload.get('chat') or (payload.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+    return update.get('update_id', 0)
+
+
+def _ring_hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Консистентное кольцо: при изменении числа воркеров переезжает ~1/N пользователей"""
+
+    def __init__(self, workers: int, vnodes: int = 128):
+        self.workers = workers
+        points = sorted(
+            (_ring_hash(f"worker-{worker}-{replica}"), worker)
+            for worker in range(workers)
+            for replica in range(vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [worker for _, worker in points]
+
+    def owner(self, key: int) -> int:
+        index = bisect(self._hashes, _ring_hash(str(key)))
+        return self._owners[index % len(self._owners)]
+
+
+def _encode(message: Dict[str, Any]) -> bytes:
+    return json.dumps(message, ensure_ascii=False, separators=(',', ':')).encode() + b'\n'
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка разных пользователей, строгий порядок у одного.
+
+    Апдейт ждет завершения предыдущего апдейта того же пользователя до
+    захвата слота конкурентности, поэтому поток сообщений одного чата не
+    занимает слоты остальных.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._tails: Dict[int, asyncio.Future] = {}
+
+    @staticmethod
+    def key_for(update: object) -> Optional[int]:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        return update.update_id
+
+    def active_keys(self) -> List[int]:
+        """Пользователи, у которых есть апдейты в обработке или в ожидании"""
+        return list(self._tails)
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]):
+        key = self.key_for(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+        previous = self._tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+        try:
+            if previous is not None:
+                try:
+                    await asyncio.shield(previous)
+                except asyncio.CancelledError:
+                    coroutine.close()
+                    raise
+            await super().process_update(update, coroutine)
+        finally:
+            done.set_result(None)
+            if self._tails.get(key) is done:
+                del self._tails[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+# ----------------------------------------------------------------------
+# Воркер
+
+class ShardWorker:
+    """Процесс-воркер: Application без Updater, апдейты приходят от фронта"""
+
+    def __init__(self, index: int, workers: int, socket_path: str, global_rate: float):
+        self.index = index
+        self.workers = workers
+        self.socket_path = socket_path
+        self.global_rate = global_rate
+
+    async def run(self):
+        self.bot = telegram_bot.TrainingBot()
+        # Лимит Telegram общий на бота - каждый воркер получает свою долю
+        self.bot.send_scheduler.set_global_rate(self.global_rate / self.workers)
+        self.processor = PerChatUpdateProcessor(telegram_bot.BOT_CONCURRENT_UPDATES)
+        self.application = telegram_bot.build_application(self.bot, concurrent_updates=self.processor)
+        self._stopped = asyncio.Event()
+
+        async with self.application:
+            await self.bot.post_init(self.application)
+            await self.application.start()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            server = await asyncio.start_unix_server(self._serve, path=self.socket_path, limit=MAX_LINE_BYTES)
+            logger.info(f"🧩 Воркер {self.index}/{self.workers} готов")
+            try:
+                await self._stopped.wait()
+            finally:
+                server.close()
+                await server.wait_closed()
+                # post_init/post_stop вызывает только run_polling/run_webhook
+                await self.application.stop()
+                await self.bot.post_stop(self.application)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        allowed_updates = telegram_bot.allowed_updates_for(self.application)
+        writer.write(_encode({'op': 'hello', 'index': self.index, 'allowed_updates': allowed_updates}))
+        await writer.drain()
+        update_queue = self.application.update_queue
+        bot = self.application.bot
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                op = message.get('op')
+                if op is None:
+                    await update_queue.put(Update.de_json(message, bot))
+                    writer.write(_encode({'op': 'ack', 'update_id': message.get('update_id')}))
+                elif op == 'rebalance':
+                    await self._handoff(message['workers'], writer)
+                elif op == 'adopt':
+                    await self.bot.import_user_state(message['state'])
+                elif op == 'stop':
+                    break
+        finally:
+            writer.close()
+            self._stopped.set()
+
+    async def _handoff(self, workers: int, writer: asyncio.StreamWriter):
+        ring = HashRing(workers)
+        self.workers = workers
+        self.bot.send_scheduler.set_global_rate(self.global_rate / workers)
+
+        def keep(user_id: int) -> bool:
+            return ring.owner(user_id) == self.index
+
+        # Уже полученные апдейты уходящих пользователей обрабатываем до передачи,
+        # их проверки - тоже: иначе запись статистики после проверки попадет в
+        # общий файл, а переданная копия нового владельца ее затрет
+        grading_queue = self.bot.grading_queue
+        while True:
+            await asyncio.sleep(0.01)
+            if (
+                self.application.update_queue.empty()
+                and all(keep(key) for key in self.processor.active_keys())
+                and all(keep(user_id) for user_id in grading_queue.active_users())
+            ):
+                break
+
+        state = await self.bot.export_user_state(keep)
+        moved: Dict[int, Dict[str, Dict[str, Any]]] = {}
+        for user_id, session in state['sessions'].items():
+            moved.setdefault(ring.owner(user_id), {'sessions': {}, 'stats': {}})['sessions'][user_id] = session
+        for key, data in state['stats'].items():
+            moved.setdefault(ring.owner(int(key)), {'sessions': {}, 'stats': {}})['stats'][key] = data
+
+        users = 0
+        for target, target_state in moved.items():
+            for kind in ('sessions', 'stats'):
+                items = list(target_state[kind].items())
+                users += len(items)
+                for start in range(0, len(items), HANDOFF_CHUNK):
+                    chunk = {kind: dict(items[start:start + HANDOFF_CHUNK])}
+                    writer.write(_encode({'op': 'handoff', 'target': target, 'state': chunk}))
+                    await writer.drain()
+        writer.write(_encode({'op': 'handoff_done', 'records': users}))
+        await writer.drain()
+        logger.info(f"🔀 Воркер {self.index}: передано {users} записей состояния")
+
+
+def run_worker(index: int, workers: int, socket_path: str, global_rate: float):
+    """Точка входа процесса-воркера (multiprocessing spawn)"""
+    # Останавливает воркеры фронт: по сигналу терминала они дорабатывают штатно
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    if telegram_bot.SUBMISSION_JOURNAL:
+        telegram_bot.SUBMISSION_JOURNAL = f"{telegram_bot.SUBMISSION_JOURNAL}.{index}"
+    # /metrics фронта - на METRICS_PORT, воркера i - на METRICS_PORT + i + 1
+    if telegram_bot.METRICS_PORT:
+        telegram_bot.METRICS_PORT += index + 1
+    # Каталог строят все воркеры, снимок на диск пишет только воркер 0
+    telegram_bot.MATERIALS_SNAPSHOT_WRITER = index == 0
+    asyncio.run(ShardWorker(index, workers, socket_path, global_rate).run())
+
+
+# ----------------------------------------------------------------------
+# Фронт
+
+@dataclass
+class _WorkerLink:
+    index: int
+    process: multiprocessing.Process
+    reader: Optional[asyncio.StreamReader] = None
+    writer: Optional[asyncio.StreamWriter] = None
+    reader_task: Optional[asyncio.Task] = None
+    # Пока воркер перезапускается, апдейты копятся здесь
+    backlog: List[bytes] = field(default_factory=list)
+    handoff: Optional[asyncio.Future] = None
+
+
+class ClusterFront:
+    """Маршрутизатор апдейтов по воркерам с перебалансировкой"""
+
+    def __init__(
+        self,
+        workers: int,
+        socket_dir: Optional[str] = None,
+        global_rate: float = telegram_bot.SEND_GLOBAL_RATE,
+    ):
+        self.socket_dir = socket_dir or tempfile.mkdtemp(prefix='bot-cluster-')
+        self.global_rate = global_rate
+        self.ring = HashRing(workers)
+        self.allowed_updates: Optional[List[str]] = None
+
+        self._context = multiprocessing.get_context('spawn')
+        self._links: Dict[int, _WorkerLink] = {}
+        self._old_ring: Optional[HashRing] = None
+        # Старый владелец -> придержанные апдейты (новый владелец, строка)
+        self._held: Dict[int, List[Tuple[int, bytes]]] = {}
+        self._resize_lock: Optional[asyncio.Lock] = None
+        self._stopping = False
+        # update_id, переданные воркерам и еще не подтвержденные
+        self._unacked: Set[int] = set()
+        self._acked: Optional[asyncio.Event] = None
+
+        # Метрики
+        self.routed = 0
+        self.held = 0
+        self.rebalances = 0
+        self.restarts = 0
+        self.redelivered = 0
+
+    # ------------------------------------------------------------------
+    # Воркеры
+
+    async def start(self):
+        self._resize_lock = asyncio.Lock()
+        self._acked = asyncio.Event()
+        await asyncio.gather(*(self._spawn(index, self.ring.workers) for index in range(self.ring.workers)))
+        logger.info(f"🧩 Кластер запущен: {self.ring.workers} воркеров, сокеты в {self.socket_dir}")
+
+    def _socket_path(self, index: int) -> str:
+        return os.path.join(self.socket_dir, f"worker-{index}.sock")
+
+    async def _spawn(self, index: int, workers: int, backlog: Optional[List[bytes]] = None):
+        path = self._socket_path(index)
+        if os.path.exists(path):
+            os.unlink(path)
+        process = self._context.Process(
+            target=run_worker,
+            args=(index, workers, path, self.global_rate),
+            name=f"bot-worker-{index}",
+        )
+        process.start()
+        link = _WorkerLink(index, process, backlog=backlog or [])
+        self._links[index] = link
+
+        # Воркер сначала поднимает Application (getMe), затем слушает сокет
+        deadline = time.monotonic() + WORKER_START_TIMEOUT
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(path, limit=MAX_LINE_BYTES)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if not process.is_alive():
+                    raise RuntimeError(f"Воркер {index} завершился при запуске (код {process.exitcode})")
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Воркер {index} не запустился за {WORKER_START_TIMEOUT:.0f} с")
+                await asyncio.sleep(0.05)
+        hello = json.loads(await reader.readline())
+        self.allowed_updates = hello.get('allowed_updates')
+
+        link.reader, link.writer = reader, writer
+        for line in link.backlog:
+            writer.write(line)
+        link.backlog = []
+        link.reader_task = asyncio.create_task(self._read_worker(link), name=f"cluster-link-{index}")
+
+    async def _read_worker(self, link: _WorkerLink):
+        try:
+            while True:
+                line = await link.reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                op = message.get('op')
+                if op == 'ack':
+                    self._unacked.discard(message.get('update_id'))
+                    self._acked.set()
+                elif op == 'handoff':
+                    # Состояние уходит новому владельцу раньше придержанных апдейтов
+                    self._send(message['target'], _encode({'op': 'adopt', 'state': message['state']}))
+                elif op == 'handoff_done' and link.handoff is not None and not link.handoff.done():
+                    link.handoff.set_result(message['records'])
+        except (ConnectionError, ValueError) as e:
+            logger.error(f"Ошибка связи с воркером {link.index}: {e}")
+
+        if self._stopping or self._links.get(link.index) is not link:
+            return
+        link.writer = None
+        if link.handoff is not None and not link.handoff.done():
+            link.handoff.set_exception(RuntimeError(f"Воркер {link.index} отключился во время передачи"))
+        logger.error(f"💥 Воркер {link.index} отключился (код {link.process.exitcode}), перезапуск")
+        self.restarts += 1
+        await asyncio.to_thread(link.process.join, 5)
+        try:
+            await self._spawn(link.index, self.ring.workers, link.backlog)
+        except RuntimeError as e:
+            logger.error(f"Не удалось перезапустить воркер {link.index}: {e}")
+
+    async def _stop_worker(self, index: int):
+        link = self._links.pop(index)
+        if link.writer is not None:
+            link.writer.write(_encode({'op': 'stop'}))
+            try:
+                await link.writer.drain()
+            except ConnectionError:
+                pass
+        # Воркер дожидается очереди проверки и закрывает журнал
+        await asyncio.to_thread(link.process.join, WORKER_STOP_TIMEOUT)
+        if link.process.is_alive():
+            logger.warning(f"Воркер {index} не остановился за {WORKER_STOP_TIMEOUT:.0f} с, завершаем")
+            link.process.kill()
+            await asyncio.to_thread(link.process.join)
+        if link.reader_task is not None:
+            link.reader_task.cancel()
+            await asyncio.gather(link.reader_task, return_exceptions=True)
+        if link.writer is not None:
+            link.writer.close()
+        if os.path.exists(self._socket_path(index)):
+            os.unlink(self._socket_path(index))
+
+    async def stop(self):
+        self._stopping = True
+        await asyncio.gather(*(self._stop_worker(index) for index in list(self._links)))
+        logger.info(f"🛑 Кластер остановлен: {self.stats()}")
+
+    # ------------------------------------------------------------------
+    # Маршрутизация
+
+    def _send(self, index: int, line: bytes):
+        link = self._links[index]
+        if link.writer is None:
+            link.backlog.append(line)
+        else:
+            link.writer.write(line)
+
+    def route(self, update: Dict[str, Any]):
+        """Отправка апдейта владельцу; запись буферизуется, см. drain()"""
+        key = routing_key(update)
+        line = _encode(update)
+        owner = self.ring.owner(key)
+        self.routed += 1
+        if self._old_ring is not None:
+            previous = self._old_ring.owner(key)
+            held = self._held.get(previous) if previous != owner else None
+            if held is not None:
+                held.append((owner, line))
+                self.held += 1
+                return
+        self._send(owner, line)
+
+    async def deliver(self, updates: List[Dict[str, Any]], timeout: float = ACK_TIMEOUT) -> bool:
+        """route() с ожиданием подтверждения воркеров.
+
+        False - не все апдейты подтверждены за timeout: их нужно получить
+        снова (offset не продвигать), повторная передача отправит их заново.
+        """
+        pending = []
+        for update in updates:
+            update_id = update.get('update_id')
+            if update_id is None:
+                self.route(update)
+                continue
+            pending.append(update_id)
+            # Повтор еще не подтвержденного апдейта второй раз не отправляется
+            if update_id not in self._unacked:
+                self._unacked.add(update_id)
+                self.route(update)
+        await self.drain()
+        deadline = time.monotonic() + timeout
+        while any(update_id in self._unacked for update_id in pending):
+            remaining = deadline - time.monotonic()
+            self._acked.clear()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                await asyncio.wait_for(self._acked.wait(), remaining)
+            except asyncio.TimeoutError:
+                lost = [update_id for update_id in pending if update_id in self._unacked]
+                self._unacked.difference_update(lost)
+                self.redelivered += len(lost)
+                logger.warning(f"Воркеры не подтвердили {len(lost)} апдейтов за {timeout:.0f} с, повтор")
+                return False
+        return True
+
+    async def drain(self):
+        """Ожидание, пока сокеты воркеров примут записанное (обратное давление)"""
+        writers = [link.writer for link in self._links.values() if link.writer is not None]
+        try:
+            await asyncio.gather(*(writer.drain() for writer in writers))
+        except ConnectionError as e:
+            logger.warning(f"Воркер недоступен: {e}")
+
+    # ------------------------------------------------------------------
+    # Перебалансировка
+
+    async def resize(self, workers: int):
+        """Новое число воркеров с передачей состояния переезжающих пользователей"""
+        async with self._resize_lock:
+            old_ring = self.ring
+            if workers < 1 or workers == old_ring.workers:
+                return
+            start = time.monotonic()
+            await asyncio.gather(*(self._spawn(index, workers) for index in range(old_ring.workers, workers)))
+
+            self._held = {index: [] for index in range(old_ring.workers)}
+            self._old_ring, self.ring = old_ring, HashRing(workers)
+            try:
+                records = await asyncio.gather(*(self._handoff(index, workers) for index in range(old_ring.workers)))
+            finally:
+                self._old_ring = None
+                self._held = {}
+            await asyncio.gather(*(self._stop_worker(index) for index in range(workers, old_ring.workers)))
+
+            self.rebalances += 1
+            logger.info(
+                f"🔀 Перебалансировка {old_ring.workers} -> {workers}: передано {sum(records)} записей "
+                f"за {time.monotonic() - start:.2f} с"
+            )
+
+    async def _handoff(self, index: int, workers: int) -> int:
+        link = self._links[index]
+        link.handoff = asyncio.get_running_loop().create_future()
+        self._send(index, _encode({'op': 'rebalance', 'workers': workers}))
+        records = 0
+        try:
+            records = await link.handoff
+        except RuntimeError as e:
+            logger.error(f"Передача состояния воркера {index} не завершена: {e}")
+        finally:
+            link.handoff = None
+        # adopt уже отправлены из _read_worker - теперь придержанные апдейты
+        for owner, line in self._held.pop(index, []):
+            self._send(owner, line)
+        await self.drain()
+        return records
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'workers': self.ring.workers,
+            'routed': self.routed,
+            'held': self.held,
+            'rebalances': self.rebalances,
+            'restarts': self.restarts,
+            'redelivered': self.redelivered,
+            'unacked': len(self._unacked),
+        }
+
+    def register_metrics(self):
+        metrics.CallbackMetric('cluster_workers', 'Воркеры кластера', lambda: self.ring.workers)
+        metrics.CallbackMetric(
+            'cluster_updates_total', 'Апдейты, переданные воркерам (held - придержанные на перебалансировке)',
+            lambda: [(('routed',), self.routed), (('held',), self.held)],
+            labelnames=['result'], kind='counter',
+        )
+        metrics.CallbackMetric('cluster_rebalances_total', 'Перебалансировки', lambda: self.rebalances,
+                               kind='counter')
+        metrics.CallbackMetric('cluster_worker_restarts_total', 'Перезапуски упавших воркеров',
+                               lambda: self.restarts, kind='counter')
+        metrics.CallbackMetric('cluster_redelivered_total', 'Апдейты, отправленные повторно без подтверждения',
+                               lambda: self.redelivered, kind='counter')
+
+    # ------------------------------------------------------------------
+    # Получение апдейтов
+
+    async def poll(self, client: AsyncBotApiClient, poll_timeout: int = 30):
+        """Long polling: offset подтверждает апдейты, принятые воркерами"""
+        await client.call('deleteWebhook')
+        offset = 0
+        while True:
+            try:
+                updates = await client.get_updates(offset, poll_timeout, allowed_updates=self.allowed_updates)
+            except BotApiError as e:
+                logger.error(f"Ошибка getUpdates: {e}")
+                await asyncio.sleep(1)
+                continue
+            if not updates:
+                continue
+            if await self.deliver(updates):
+                offset = updates[-1]['update_id'] + 1
+
+    def make_webhook_app(self, path: str, secret: Optional[str] = None):
+        from aiohttp import web
+
+        async def handle(request: web.Request) -> web.Response:
+            if secret and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret:
+                return web.Response(status=403)
+            # Без подтверждения воркера Telegram повторит апдейт
+            if not await self.deliver([await request.json()]):
+                return web.Response(status=503)
+            return web.Response()
+
+        app = web.Application()
+        app.router.add_post(f"/{path.strip('/')}", handle)
+        return app
+
+
+async def _serve(workers: int, mode: str):
+    front = ClusterFront(workers)
+    front.register_metrics()
+    telegram_bot.start_metrics_server()
+    await front.start()
+    client = AsyncBotApiClient(
+        telegram_bot.TELEGRAM_BOT_TOKEN or '',
+        base_url=telegram_bot.BOT_API_BASE_URL or DEFAULT_BASE_URL,
+    )
+
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    loop.add_signal_handler(signal.SIGINT, stop.set)
+    loop.add_signal_handler(signal.SIGUSR1, lambda: asyncio.create_task(front.resize(front.ring.workers + 1)))
+    loop.add_signal_handler(signal.SIGUSR2, lambda: asyncio.create_task(front.resize(front.ring.workers - 1)))
+
+    receiver = None
+    runner = None
+    if mode == 'webhook':
+        from aiohttp import web
+
+        path = telegram_bot.WEBHOOK_PATH
+        runner = web.AppRunner(front.make_webhook_app(path, telegram_bot.WEBHOOK_SECRET))
+        await runner.setup()
+        await web.TCPSite(runner, telegram_bot.WEBHOOK_LISTEN, telegram_bot.WEBHOOK_PORT).start()
+        params = {
+            'url': f"{telegram_bot.WEBHOOK_URL.rstrip('/')}/{path}",
+            'allowed_updates': front.allowed_updates,
+        }
+        if telegram_bot.WEBHOOK_SECRET:
+            params['secret_token'] = telegram_bot.WEBHOOK_SECRET
+        await client.call('setWebhook', **params)
+    else:
+        receiver = asyncio.create_task(front.poll(client), name='cluster-poll')
+
+    logger.info(f"🚀 Бот запущен: режим {mode}, воркеров {workers} (SIGUSR1/SIGUSR2 - добавить/убрать)")
+    await stop.wait()
+
+    if receiver is not None:
+        receiver.cancel()
+        await asyncio.gather(receiver, return_exceptions=True)
+    if runner is not None:
+        await runner.cleanup()
+    await front.drain()
+    await front.stop()
+    await client.close()
+
+
+def serve(workers: int, mode: str = 'polling'):
+    """Запуск фронта и воркеров до SIGTERM/SIGINT"""
+    if mode == 'webhook' and not telegram_bot.WEBHOOK_URL:
+        logger.error("❌ WEBHOOK_URL не установлен!")
+        raise SystemExit(1)
+    asyncio.run(_serve(workers, mode))
@@ -0,0 +1,345 @@
+# broadcast.py - Рассылка по когорте: открытие модуля, напоминания о дедлайнах
+#
+# Получатели читаются потоком из выгрузки записей на курс (user_courses,
+# соединенной с telegram_id профиля) в CSV или JSON Lines, текст собирается
+# из общего Template по полям строки. Отправка идет через AsyncBotApiClient
+# с SendScheduler: темп ограничен ведрами токенов (общее и на чат), общими
+# с ботом и серверами WebApp через SEND_LIMITS_DB, 429 приостанавливает чат
+# и повторяется. Одновременно в работе не больше
+# concurrency получателей - выгрузка любого размера не читается в память.
+#
+# Статус каждого получателя дописывается в журнал рассылки (JSON Lines) и
+# сбрасывается на диск пачками - это и есть контрольная точка. Повторный
+# запуск с тем же журналом пропускает доставленных и получателей с
+# постоянной ошибкой (бот заблокирован, чат не найден); после сбоя повторно
+# могут уйти только сообщения последней несохраненной пачки.
+#
+# Запуск:
+#   python broadcast.py --export enrollments.csv --template-file deadline.html \
+#       --where course_id=<uuid> --status broadcasts/deadline-m3.jsonl --at 2026-10-20T10:00
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import metrics
+from bot_api import AsyncBotApiClient, BotApiError
+from message_templates import Template
+from send_scheduler import PRIORITY_NOTICE, SendScheduler, SharedLimits
+
+logger = logging.getLogger(__name__)
+
+# Потолок рассылки. Лимит Telegram (~30 сообщений/с на бота) рассылка делит
+# с ботом и серверами WebApp через общие ведра SEND_LIMITS_DB (тот же путь,
+# что у них); 10/с оставляют интерактивным ответам не меньше 20/с. Без
+# общих ведер (пустой SEND_LIMITS_DB) бот и сервер надо на время рассылки
+# ограничить так, чтобы сумма потолков не превышала 30/с
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '10'))
+SEND_LIMITS_DB = os.getenv('SEND_LIMITS_DB', 'send_limits.db')
+SEND_TOTAL_RATE = float(os.getenv('SEND_TOTAL_RATE', '30'))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '64'))
+BROADCAST_CHECKPOINT_INTERVAL = float(os.getenv('BROADCAST_CHECKPOINT_INTERVAL', '1'))
+
+# Ошибки, после которых повторять отправку этому получателю бессмысленно:
+# 403 (бот заблокирован, пользователь удален) и 400 "chat not found".
+# Прочие 400 (ошибка шаблона, разметки) исправляются и рассылаются заново
+PERMANENT_STATUSES = {403}
+PERMANENT_DESCRIPTIONS = ('chat not found',)
+
+BROADCAST_MESSAGES = metrics.Counter('broadcast_messages_total', 'Сообщения рассылок', ['status'])
+BROADCAST_SEND_SECONDS = metrics.Histogram('broadcast_send_seconds', 'Отправка сообщения рассылки с ожиданием лимита')
+
+
+def is_permanent(code: Any, description: Optional[str]) -> bool:
+    if code in PERMANENT_STATUSES:
+        return True
+    text = (description or '').lower()
+    return code == 400 and any(marker in text for marker in PERMANENT_DESCRIPTIONS)
+
+
+def read_recipients(path: str) -> Iterator[Dict[str, Any]]:
+    """Строки выгрузки по одной: CSV с заголовком или JSON Lines"""
+    if path.endswith('.jsonl'):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif path.endswith('.csv'):
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            yield from csv.DictReader(f)
+    else:
+        raise ValueError(f"Выгрузка {path}: поддерживаются .csv и .jsonl (массив JSON потоком не читается)")
+
+
+def parse_filters(conditions: Iterable[str]) -> List[Tuple[str, str]]:
+    """Условия вида колонка=значение для --where"""
+    filters = []
+    for condition in conditions:
+        column, sep, value = condition.partition('=')
+        if not sep or not column:
+            raise ValueError(f"Условие должно быть вида колонка=значение: {condition!r}")
+        filters.append((column, value))
+    return filters
+
+
+@dataclass
+class BroadcastStats:
+    """Итог рассылки"""
+    sent: int = 0
+    failed: int = 0
+    skipped: int = 0
+    resumed: int = 0
+    duplicates: int = 0
+    elapsed: float = 0.0
+    errors: Dict[int, int] = field(default_factory=dict)
+
+    @property
+    def rate(self) -> float:
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+
+class StatusLog:
+    """Журнал рассылки: статус каждого получателя, сброс на диск пачками"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._buffer: List[str] = []
+        self._file = None
+
+    def load(self) -> Set[str]:
+        """Получатели, которым повторно не отправляем: доставлено или постоянная ошибка"""
+        finished: Set[str] = set()
+        if not os.path.exists(self.path):
+            return finished
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Оборванная последняя строка: статус не был сохранен
+                    continue
+                if record.get('status') == 'sent' or is_permanent(record.get('code'), record.get('error')):
+                    finished.add(str(record['chat_id']))
+        return finished
+
+    def record(self, chat_id: str, status: str, **fields):
+        entry = {'chat_id': chat_id, 'status': status, 'ts': round(time.time(), 3), **fields}
+        self._buffer.append(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+    def _write(self, lines: List[str]):
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.writelines(lines)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    async def checkpoint(self):
+        """Накопленные статусы - на диск (запись и fsync в потоке)"""
+        if not self._buffer:
+            return
+        lines, self._buffer = self._buffer, []
+        await asyncio.to_thread(self._write, lines)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class Broadcast:
+    """Одна рассылка: шаблон, получатели, журнал статусов"""
+
+    def __init__(
+        self,
+        client: AsyncBotApiClient,
+        template: Template,
+        status_log: StatusLog,
+        chat_column: str = 'telegram_id',
+        filters: Iterable[Tuple[str, str]] = (),
+        concurrency: int = BROADCAST_CONCURRENCY,
+        checkpoint_interval: float = BROADCAST_CHECKPOINT_INTERVAL,
+        progress_every: int = 1000,
+    ):
+        self.client = client
+        self.template = template
+        self.status_log = status_log
+        self.chat_column = chat_column
+        self.filters = list(filters)
+        self.concurrency = concurrency
+        self.checkpoint_interval = checkpoint_interval
+        self.progress_every = progress_every
+        self.stats = BroadcastStats()
+
+    def _matches(self, row: Dict[str, Any]) -> bool:
+        return all(str(row.get(column, '')) == value for column, value in self.filters)
+
+    def _check_fields(self, row: Dict[str, Any]):
+        missing = self.template.fields - row.keys()
+        if missing:
+            raise ValueError(f"В выгрузке нет полей шаблона: {', '.join(sorted(missing))}")
+
+    async def _send(self, chat_id: str, row: Dict[str, Any]):
+        start = time.monotonic()
+        try:
+            message = await self.client.call(
+                'sendMessage',
+                chat_id=int(chat_id),
+                text=self.template.render(**row),
+                parse_mode='HTML',
+                priority=PRIORITY_NOTICE,
+            )
+        except BotApiError as e:
+            self.stats.failed += 1
+            self.stats.errors[e.status] = self.stats.errors.get(e.status, 0) + 1
+            self.status_log.record(chat_id, 'failed', code=e.status, error=e.description)
+            BROADCAST_MESSAGES.labels('failed').inc()
+        except Exception as e:
+            # Сетевая ошибка после всех повторов: получатель останется для следующего запуска
+            self.stats.failed += 1
+            self.status_log.record(chat_id, 'failed', code=0, error=str(e))
+            BROADCAST_MESSAGES.labels('failed').inc()
+        else:
+            self.stats.sent += 1
+            message_id = message.get('message_id') if isinstance(message, dict) else None
+            self.status_log.record(chat_id, 'sent', message_id=message_id)
+            BROADCAST_MESSAGES.labels('sent').inc()
+        BROADCAST_SEND_SECONDS.observe(time.monotonic() - start)
+        done = self.stats.sent + self.stats.failed
+        if self.progress_every and done % self.progress_every == 0:
+            logger.info(f"📣 Рассылка: отправлено {self.stats.sent}, ошибок {self.stats.failed}")
+
+    async def _checkpoints(self):
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            await self.status_log.checkpoint()
+
+    async def run(self, recipients: Iterable[Dict[str, Any]], start_at: Optional[float] = None) -> BroadcastStats:
+        """Рассылка по строкам выгрузки; start_at - время начала (unix)"""
+        if start_at is not None and start_at > time.time():
+            logger.info(f"⏰ Рассылка начнется {datetime.fromtimestamp(start_at):%Y-%m-%d %H:%M:%S}")
+            await asyncio.sleep(start_at - time.time())
+
+        # Один получатель - одно сообщение, даже если он записан на курс дважды
+        finished = await asyncio.to_thread(self.status_log.load)
+        seen: Set[str] = set()
+        window = asyncio.Semaphore(self.concurrency)
+        in_flight: Set[asyncio.Task] = set()
+        checked = False
+
+        def _done(task: asyncio.Task):
+            in_flight.discard(task)
+            window.release()
+
+        started = time.monotonic()
+        checkpoints = asyncio.create_task(self._checkpoints(), name='broadcast-checkpoints')
+        try:
+            for row in recipients:
+                if not self._matches(row):
+                    continue
+                if not checked:
+                    self._check_fields(row)
+                    checked = True
+                chat_id = str(row.get(self.chat_column) or '').strip()
+                if not chat_id.lstrip('-').isdigit():
+                    self.stats.skipped += 1
+                    continue
+                if chat_id in seen:
+                    self.stats.duplicates += 1
+                    continue
+                seen.add(chat_id)
+                if chat_id in finished:
+                    self.stats.resumed += 1
+                    continue
+                # Окно: следующая строка читается, только когда освободилось место
+                await window.acquire()
+                task = asyncio.create_task(self._send(chat_id, row))
+                in_flight.add(task)
+                task.add_done_callback(_done)
+            await asyncio.gather(*in_flight)
+        finally:
+            if in_flight:
+                # Прервано (ошибка выгрузки, отмена): начатые отправки доводим до статуса
+                await asyncio.gather(*in_flight, return_exceptions=True)
+            checkpoints.cancel()
+            await asyncio.gather(checkpoints, return_exceptions=True)
+            await self.status_log.checkpoint()
+            self.status_log.close()
+            self.stats.elapsed = time.monotonic() - started
+        return self.stats
+
+
+def parse_start_at(value: Optional[str]) -> Optional[float]:
+    """--at в ISO-формате (местное время, если без часового пояса)"""
+    if not value:
+        return None
+    return datetime.fromisoformat(value).timestamp()
+
+
+async def run_broadcast(args) -> BroadcastStats:
+    if args.template_file:
+        with open(args.template_file, encoding='utf-8') as f:
+            source = f.read()
+    else:
+        source = args.template
+    shared = SharedLimits(args.limits_db, SEND_TOTAL_RATE, args.chat_rate) if args.limits_db else None
+    scheduler = SendScheduler(args.rate, args.chat_rate, shared=shared)
+    client = AsyncBotApiClient(
+        os.getenv('TELEGRAM_BOT_TOKEN', ''),
+        base_url=os.getenv('BOT_API_BASE_URL', 'https://api.telegram.org'),
+        pool_size=args.concurrency,
+        scheduler=scheduler,
+    )
+    broadcast = Broadcast(
+        client,
+        Template(source),
+        StatusLog(args.status),
+        chat_column=args.chat_column,
+        filters=parse_filters(args.where),
+        concurrency=args.concurrency,
+    )
+    await scheduler.start()
+    try:
+        return await broadcast.run(read_recipients(args.export), parse_start_at(args.at))
+    finally:
+        await scheduler.stop()
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Рассылка по когорте')
+    parser.add_argument('--export', required=True, help='выгрузка получателей (.csv или .jsonl)')
+    template = parser.add_mutually_exclusive_group(required=True)
+    template.add_argument('--template', help='HTML-шаблон с полями {колонка}')
+    template.add_argument('--template-file')
+    parser.add_argument('--status', required=True, help='журнал статусов (продолжение после сбоя)')
+    parser.add_argument('--chat-column', default='telegram_id')
+    parser.add_argument('--where', action='append', default=[], help='фильтр колонка=значение')
+    parser.add_argument('--at', help='время начала, например 2026-10-20T10:00')
+    parser.add_argument('--rate', type=float, default=BROADCAST_RATE, help='сообщений/с на бота')
+    parser.add_argument('--chat-rate', type=float, default=1.0)
+    parser.add_argument('--limits-db', default=SEND_LIMITS_DB, help='общие с ботом ведра лимитов (пусто - свои)')
+    parser.add_argument('--concurrency', type=int, default=BROADCAST_CONCURRENCY)
+    args = parser.parse_args()
+
+    from log_config import setup_logging
+
+    setup_logging()
+    stats = asyncio.run(run_broadcast(args))
+    logger.info(
+        f"📣 Рассылка завершена за {stats.elapsed:.1f} с: отправлено {stats.sent} ({stats.rate:.1f}/с), "
+        f"ошибок {stats.failed} {stats.errors or ''}, пропущено {stats.skipped}, "
+        f"уже было {stats.resumed}, повторов в выгрузке {stats.duplicates}"
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+# dedup.py - Идемпотентность: повторные апдейты, двойные нажатия и отправки
+#
+# Недавно обработанные ключи хранит RecentKeys - несколько поколений
+# фильтров Блума, каждое отвечает за свой отрезок времени. Память
+# ограничена: поколение рассчитано на capacity ключей и при переполнении
+# сменяется раньше срока. Ложное срабатывание (ключ считается виденным)
+# возможно с вероятностью error_rate на проверку, пропусков нет.
+#
+# Работа, которая еще идет, хранится точно (словарь ключ -> future):
+# дубликат присоединяется к исходной работе и получает ее результат.
+# Завершенная работа помнится коротко (done_window): это ловит двойные
+# нажатия, но осознанный повтор той же отправки проходит заново.
+# Несколько процессов (воркеры сервера WebApp) дополнительно делят ключи
+# через SharedClaims - таблицу в файле SQLite.
+import abc
+import asyncio
+import concurrent.futures
+import hashlib
+import logging
+import math
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DUPLICATES = metrics.Counter(
+    'dedup_duplicates_total', 'Отброшенные повторы (in_flight - присоединены к идущей работе)', ['kind', 'state'],
+)
+
+
+def answer_digest(text: str) -> str:
+    """Короткий отпечаток ответа для ключа (пользователь, задание, ответ)"""
+    return hashlib.blake2b(text.strip().encode(), digest_size=12).hexdigest()
+
+
+def submission_key(user_id: int, task_id: Optional[str], user_answer: Optional[str],
+                   upload_id: Optional[str] = None) -> tuple:
+    """Ключ идемпотентности отправки задания (бот и сервер WebApp).
+
+    Для загруженного файла upload_id - sha256 содержимого, хешировать его
+    повторно не нужно.
+    """
+    return ('submit', user_id, task_id or '', answer_digest(user_answer or ''), upload_id or '')
+
+
+class BloomFilter:
+    """Фильтр Блума на bytearray с двойным хешированием"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, key: Hashable) -> List[int]:
+        """Номера битов ключа (одинаковы у фильтров с теми же параметрами)"""
+        digest = hashlib.blake2b(repr(key).encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add_positions(self, positions: List[int]):
+        bits = self.bits
+        for position in positions:
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def has_positions(self, positions: List[int]) -> bool:
+        bits = self.bits
+        for position in positions:
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, key: Hashable):
+        self.add_positions(self.positions(key))
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.has_positions(self.positions(key))
+
+
+class RecentKeys:
+    """Ключи за последние window секунд (не меньше) в generations фильтрах Блума.
+
+    Поколение живет window / (generations - 1) секунд, проверка идет по
+    всем поколениям, запись - в текущее. Память: generations фильтров по
+    capacity ключей.
+    """
+
+    def __init__(self, window: float, capacity: int = 100_000, error_rate: float = 1e-6,
+                 generations: int = 4, clock: Callable[[], float] = time.monotonic):
+        self.window = window
+        self.capacity = capacity
+        # Каждое поколение проверяется отдельно: делим допустимую ошибку
+        self.error_rate = error_rate / generations
+        self.generations = generations
+        self.span = window / (generations - 1)
+        self.clock = clock
+        self._filters: List[BloomFilter] = [self._new_filter()]
+        self._started = clock()
+        self.rotations = 0
+
+    def _new_filter(self) -> BloomFilter:
+        return BloomFilter(self.capacity, self.error_rate)
+
+    def _rotate(self):
+        now = self.clock()
+        current = self._filters[-1]
+        if now - self._started < self.span and current.count < self.capacity:
+            return
+        # Простой дольше нескольких поколений - все ключи устарели
+        if now - self._started >= self.span * self.generations:
+            self._filters = []
+        self._filters.append(self._new_filter())
+        del self._filters[:-self.generations]
+        self._started = now
+        self.rotations += 1
+
+    def add(self, key: Hashable):
+        self._rotate()
+        self._filters[-1].add(key)
+
+    def __contains__(self, key: Hashable) -> bool:
+        self._rotate()
+        positions = self._filters[-1].positions(key)
+        return any(bloom.has_positions(positions) for bloom in reversed(self._filters))
+
+    def check_and_add(self, key: Hashable) -> bool:
+        """Проверка и запись с одним хешированием: True - ключ уже был"""
+        self._rotate()
+        positions = self._filters[-1].positions(key)
+        if any(bloom.has_positions(positions) for bloom in reversed(self._filters)):
+            return True
+        self._filters[-1].add_positions(positions)
+        return False
+
+    def memory_bytes(self) -> int:
+        return sum(len(bloom.bits) for bloom in self._filters)
+
+
+class SharedClaims:
+    """Ключи идемпотентности, общие для процессов: таблица в файле SQLite.
+
+    Ключ занят, пока работа идет в любом из процессов, и еще done_window
+    секунд после успеха; после ошибки освобождается. Работа упавшего
+    процесса освобождается сама через window секунд. Запросы блокирующие
+    (ждут блокировку файла до секунды): из asyncio их вызывают в потоке.
+    """
+
+    def __init__(self, path: str, window: float, done_window: Optional[float] = None):
+        self.path = path
+        self.window = window
+        self.done_window = window if done_window is None else done_window
+        self._conn = sqlite3.connect(path, timeout=1.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS claims (key TEXT PRIMARY KEY, expires REAL NOT NULL)')
+        self._claims = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(key: Hashable) -> str:
+        return hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+
+    def claim(self, key: Hashable) -> bool:
+        """True - ключ уже занят (работа идет или недавно завершена)"""
+        digest = self._digest(key)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._conn.execute('DELETE FROM claims WHERE key = ? AND expires < ?', (digest, now))
+            inserted = self._conn.execute(
+                'INSERT OR IGNORE INTO claims (key, expires) VALUES (?, ?)', (digest, now + self.window),
+            ).rowcount
+            self._claims += 1
+            if self._claims % 1000 == 0:
+                self._conn.execute('DELETE FROM claims WHERE expires < ?', (now,))
+        return not inserted
+
+    def release(self, key: Hashable, succeeded: bool):
+        """Успех - ключ помнится еще done_window секунд; ошибка - освобождается"""
+        digest = self._digest(key)
+        with self._lock, self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            if succeeded:
+                self._conn.execute('UPDATE claims SET expires = ? WHERE key = ?', (time.time() + self.done_window, digest))
+            else:
+                self._conn.execute('DELETE FROM claims WHERE key = ?', (digest,))
+
+    def close(self):
+        self._conn.close()
+
+
+class _Deduplicator(abc.ABC):
+    """Общая часть: недавние ключи + точный словарь идущей работы"""
+
+    def __init__(self, window: float, capacity: int = 100_000, error_rate: float = 1e-6,
+                 shared: Optional[SharedClaims] = None, done_window: Optional[float] = None):
+        # recent - ключи seen() (update_id), finished - завершенная работа claim()
+        self.recent = RecentKeys(window, capacity, error_rate)
+        self.finished = RecentKeys(window if done_window is None else done_window, capacity, error_rate)
+        self.shared = shared
+        self._in_flight: Dict[Hashable, Any] = {}
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def _new_future(self):
+        """Future для ожидающих дубликатов (asyncio или concurrent.futures)"""
+
+    @staticmethod
+    def _count(key: Hashable, state: str):
+        kind = key[0] if isinstance(key, tuple) and key else 'key'
+        DUPLICATES.labels(kind, state).inc()
+
+    def seen(self, key: Hashable) -> bool:
+        """Проверка и запоминание ключа (update_id, id нажатия): True - повтор"""
+        with self._lock:
+            duplicate = self.recent.check_and_add(key)
+        if duplicate:
+            self._count(key, 'recent')
+        return duplicate
+
+    def claim(self, key: Hashable):
+        """None - работа за вызывающим (до release); иначе future, к которому присоединиться.
+
+        Для работы, завершенной в пределах done_window, future уже готов и
+        содержит None: результат после завершения не хранится.
+        """
+        future = self._claim_local(key)
+        if future is None and self.shared is not None and self.shared.claim(key):
+            return self._taken_elsewhere(key)
+        return future
+
+    def release(self, key: Hashable, result: Any = None, error: Optional[BaseException] = None):
+        """Завершение работы: ожидающие дубликаты получают результат или ошибку.
+
+        После ошибки ключ не запоминается - повторная отправка пройдет.
+        """
+        if self.shared is not None:
+            self.shared.release(key, error is None)
+        self._release_local(key, result, error)
+
+    def _claim_local(self, key: Hashable):
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._count(key, 'in_flight')
+                return future
+            if key in self.finished:
+                self._count(key, 'recent')
+                future = self._new_future()
+                future.set_result(None)
+                return future
+            self._in_flight[key] = self._new_future()
+            return None
+
+    def _taken_elsewhere(self, key: Hashable):
+        """Работу делает или уже сделал другой процесс: присоединившиеся получают None"""
+        self._count(key, 'shared')
+        with self._lock:
+            future = self._in_flight.pop(key, None)
+        if future is None or future.done():
+            future = self._new_future()
+        future.set_result(None)
+        return future
+
+    def _release_local(self, key: Hashable, result: Any = None, error: Optional[BaseException] = None):
+        with self._lock:
+            future = self._in_flight.pop(key, None)
+            if error is None:
+                self.finished.add(key)
+        if future is None or future.done():
+            return
+        if error is None:
+            future.set_result(result)
+        elif isinstance(error, (asyncio.CancelledError, concurrent.futures.CancelledError)):
+            future.cancel()
+        else:
+            future.set_exception(error)
+            # Дубликатов могло не быть: не предупреждаем о необработанной ошибке
+            future.exception()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    def memory_bytes(self) -> int:
+        return self.recent.memory_bytes() + self.finished.memory_bytes()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'in_flight': len(self._in_flight),
+            'rotations': self.recent.rotations + self.finished.rotations,
+            'memory_bytes': self.memory_bytes(),
+        }
+
+
+class Deduplicator(_Deduplicator):
+    """Идемпотентность в asyncio (бот, aiohttp-сервер).
+
+    claim()/release() работают только с памятью процесса и не блокируют
+    цикл событий; общие ключи SharedClaims учитывают aclaim()/arelease(),
+    которые ходят в SQLite в потоке.
+    """
+
+    def _new_future(self) -> asyncio.Future:
+        return asyncio.get_running_loop().create_future()
+
+    def claim(self, key: Hashable):
+        return self._claim_local(key)
+
+    def release(self, key: Hashable, result: Any = None, error: Optional[BaseException] = None):
+        self._release_local(key, result, error)
+
+    async def aclaim(self, key: Hashable):
+        """claim() с учетом других процессов"""
+        future = self._claim_local(key)
+        if future is not None or self.shared is None:
+            return future
+        try:
+            taken = await asyncio.to_thread(self.shared.claim, key)
+        except BaseException as e:
+            # Общий ключ, если успел заняться, освободится сам через window
+            self._release_local(key, error=e)
+            raise
+        return self._taken_elsewhere(key) if taken else None
+
+    async def arelease(self, key: Hashable, result: Any = None, error: Optional[BaseException] = None):
+        """release() с учетом других процессов: свои дубликаты получают результат сразу"""
+        self._release_local(key, result, error)
+        if self.shared is not None:
+            await asyncio.to_thread(self.shared.release, key, error is None)
+
+    async def once(self, key: Hashable, work: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """(результат, повтор ли): дубликат ждет исходную работу, а не делает свою"""
+        future = await self.aclaim(key)
+        if future is not None:
+            return await asyncio.shield(future), True
+        try:
+            result = await work()
+        except BaseException as e:
+            await self.arelease(key, error=e)
+            raise
+        await self.arelease(key, result)
+        return result, False
+
+
+class SyncDeduplicator(_Deduplicator):
+    """Идемпотентность для потоков (Flask)"""
+
+    def _new_future(self) -> concurrent.futures.Future:
+        return concurrent.futures.Future()
+
+    def once(self, key: Hashable, work: Callable[[], Any], timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        future = self.claim(key)
+        if future is not None:
+            return future.result(timeout), True
+        try:
+            result = work()
+        except BaseException as e:
+            self.release(key, error=e)
+            raise
+        self.release(key, result)
+        return result, False
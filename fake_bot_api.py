@@ -0,0 +1,332 @@
+# fake_bot_api.py - Локальный фейковый Telegram Bot API для тестов и нагрузки
+#
+# Запуск: python fake_bot_api.py --port 8081 --latency 0.05 --rate-limit-every 50
+#         python fake_bot_api.py --latency 0.03 --jitter 0.04 --rate-limit-prob 0.01
+# Затем укажите BOT_API_BASE_URL=http://127.0.0.1:8081 для бота и сервера.
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Служебные методы: без искусственной задержки и 429
+SERVICE_METHODS = {'getMe', 'getUpdates', 'setWebhook', 'deleteWebhook', 'getWebhookInfo'}
+
+
+def make_message_update(update_id: int, user_id: int, text: str) -> Dict[str, Any]:
+    """Update с текстовым сообщением (команды начинаются с /)"""
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private', 'first_name': f'User{user_id}'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        command = text.split()[0]
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+    return {'update_id': update_id, 'message': message}
+
+
+def make_web_app_data_update(update_id: int, user_id: int, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Update с данными WebApp (sendData)"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': f'User{user_id}'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+            'web_app_data': {'data': json.dumps(data, ensure_ascii=False), 'button_text': '🚀 Открыть тренажер'},
+        },
+    }
+
+
+def make_callback_update(update_id: int, user_id: int, data: str) -> Dict[str, Any]:
+    """Update с нажатием inline-кнопки"""
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': f'cb{update_id}',
+            'chat_instance': str(user_id),
+            'data': data,
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private', 'first_name': f'User{user_id}'},
+                'text': 'результат',
+            },
+        },
+    }
+
+
+class FakeBotApi:
+    """Фейковый Bot API: принимает /bot<token>/<method> и отвечает как Telegram.
+
+    latency добавляет задержку к каждому ответу (плюс равномерная
+    случайная до jitter), 429 с retry_after возвращается на каждый N-й
+    вызов (rate_limit_every) или с вероятностью rate_limit_probability.
+    Входящие апдейты добавляются через push_update(): они отдаются через
+    getUpdates или, если бот вызвал setWebhook, отправляются POST-запросом
+    на webhook. Время добавления каждого апдейта хранится в pushed_at.
+    """
+
+    def __init__(self, latency: float = 0.0, rate_limit_every: int = 0, retry_after: int = 1,
+                 webhook_connections: int = 40, jitter: float = 0.0, rate_limit_probability: float = 0.0,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_every = rate_limit_every
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after = retry_after
+        self.webhook_connections = webhook_connections
+        self._random = random.Random(seed)
+
+        self.calls: List[Dict[str, Any]] = []
+        self.method_counts: Counter = Counter()
+        self.rate_limited = 0
+        self._call_counter = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+        # Входящие апдейты
+        self._updates: List[Dict[str, Any]] = []
+        self.pushed_at: Dict[int, float] = {}
+        self._updates_changed: Optional[asyncio.Condition] = None
+        self.webhook_url = ''
+        self.webhook_secret = ''
+        self._webhook_queue: Optional[asyncio.Queue] = None
+        self._webhook_tasks: List[asyncio.Task] = []
+        self._webhook_session: Optional[aiohttp.ClientSession] = None
+        self.allowed_updates: Optional[List[str]] = None
+
+        self._runner: Optional[web.AppRunner] = None
+        self.url = ''
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        app.router.add_get('/bot{token}/{method}', self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = await self._read_params(request)
+
+        if method in SERVICE_METHODS:
+            return web.json_response({'ok': True, 'result': await self.service_result(method, params)})
+
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+
+        number = next(self._call_counter)
+        if self._should_rate_limit(number):
+            self.rate_limited += 1
+            return web.json_response({
+                'ok': False,
+                'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after},
+            }, status=429)
+
+        self.calls.append({'method': method, 'params': params, 'at': time.monotonic()})
+        self.method_counts[method] += 1
+        return web.json_response({'ok': True, 'result': self.result_for(method, params)})
+
+    def _should_rate_limit(self, number: int) -> bool:
+        if self.rate_limit_every and number % self.rate_limit_every == 0:
+            return True
+        return bool(self.rate_limit_probability) and self._random.random() < self.rate_limit_probability
+
+    @staticmethod
+    async def _read_params(request: web.Request) -> Dict[str, Any]:
+        if request.content_type == 'application/json':
+            return await request.json()
+        # python-telegram-bot шлет form-data, вложенные значения - строками JSON
+        params: Dict[str, Any] = dict(request.query)
+        params.update(await request.post())
+        for key in ('chat_id', 'message_id', 'offset', 'limit', 'timeout'):
+            if key in params:
+                try:
+                    params[key] = int(params[key])
+                except (TypeError, ValueError):
+                    pass
+        for key in ('allowed_updates', 'reply_markup'):
+            if isinstance(params.get(key), str):
+                try:
+                    params[key] = json.loads(params[key])
+                except ValueError:
+                    pass
+        return params
+
+    def result_for(self, method: str, params: Dict[str, Any]) -> Any:
+        if method in ('sendMessage', 'editMessageText'):
+            return {
+                'message_id': params.get('message_id') or next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': params.get('chat_id'), 'type': 'private'},
+                'text': params.get('text', ''),
+            }
+        if method == 'answerWebAppQuery':
+            return {'inline_message_id': f"fake-{params.get('web_app_query_id')}"}
+        # deleteMessage, answerCallbackQuery, sendChatAction и прочие
+        return True
+
+    async def service_result(self, method: str, params: Dict[str, Any]) -> Any:
+        if method == 'getMe':
+            return {
+                'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot',
+                'can_join_groups': True, 'can_read_all_group_messages': False,
+                'supports_inline_queries': False,
+            }
+        if method == 'getUpdates':
+            return await self._get_updates(params)
+        if method == 'setWebhook':
+            self.webhook_url = params.get('url', '')
+            self.webhook_secret = params.get('secret_token', '')
+            self.allowed_updates = params.get('allowed_updates')
+            self._start_webhook_delivery()
+            return True
+        if method == 'deleteWebhook':
+            self.webhook_url = ''
+            await self._stop_webhook_delivery()
+            return True
+        if method == 'getWebhookInfo':
+            return {'url': self.webhook_url, 'has_custom_certificate': False, 'pending_update_count': 0}
+        return True
+
+    # ------------------------------------------------------------------
+    # Входящие апдейты
+
+    def push_update(self, update: Dict[str, Any]):
+        """Добавляет входящий апдейт (getUpdates или webhook)"""
+        self.pushed_at[update['update_id']] = time.monotonic()
+        if self.webhook_url and self._webhook_queue is not None:
+            self._webhook_queue.put_nowait(update)
+            return
+        self._updates.append(update)
+        if self._updates_changed is not None:
+            asyncio.get_running_loop().create_task(self._notify_updates())
+
+    async def _notify_updates(self):
+        async with self._updates_changed:
+            self._updates_changed.notify_all()
+
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+        if params.get('allowed_updates') is not None:
+            self.allowed_updates = params.get('allowed_updates')
+
+        # Подтвержденные апдейты (id < offset) удаляем, как Telegram
+        if offset:
+            self._updates = [u for u in self._updates if u['update_id'] >= offset]
+        if not self._updates and timeout:
+            async with self._updates_changed:
+                try:
+                    await asyncio.wait_for(self._updates_changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        return self._updates[:limit]
+
+    def _start_webhook_delivery(self):
+        if self._webhook_queue is not None:
+            return
+        self._webhook_queue = asyncio.Queue()
+        # Переносим накопленные апдейты в очередь webhook
+        for update in self._updates:
+            self._webhook_queue.put_nowait(update)
+        self._updates = []
+        self._webhook_session = aiohttp.ClientSession()
+        self._webhook_tasks = [
+            asyncio.create_task(self._deliver_webhooks())
+            for _ in range(self.webhook_connections)
+        ]
+
+    async def _stop_webhook_delivery(self):
+        for task in self._webhook_tasks:
+            task.cancel()
+        await asyncio.gather(*self._webhook_tasks, return_exceptions=True)
+        self._webhook_tasks = []
+        self._webhook_queue = None
+        if self._webhook_session is not None:
+            await self._webhook_session.close()
+            self._webhook_session = None
+
+    async def _deliver_webhooks(self):
+        headers = {}
+        if self.webhook_secret:
+            headers['X-Telegram-Bot-Api-Secret-Token'] = self.webhook_secret
+        while True:
+            update = await self._webhook_queue.get()
+            try:
+                async with self._webhook_session.post(self.webhook_url, json=update, headers=headers) as response:
+                    await response.read()
+            except aiohttp.ClientError as e:
+                logger.warning(f"Webhook не доставлен: {e}")
+
+    # ------------------------------------------------------------------
+    # Запуск
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Запуск сервера, возвращает базовый URL для BOT_API_BASE_URL"""
+        self._updates_changed = asyncio.Condition()
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        sockets = site._server.sockets
+        bound_port = sockets[0].getsockname()[1] if sockets else port
+        self.url = f"http://{host}:{bound_port}"
+        logger.info(f"🧪 Фейковый Bot API запущен на {self.url}")
+        return self.url
+
+    async def stop(self):
+        await self._stop_webhook_delivery()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Фейковый Telegram Bot API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0, help='случайная добавка к задержке, до N с')
+    parser.add_argument('--rate-limit-every', type=int, default=0)
+    parser.add_argument('--rate-limit-prob', type=float, default=0.0, help='вероятность ответа 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    fake = FakeBotApi(
+        args.latency, args.rate_limit_every, args.retry_after,
+        jitter=args.jitter, rate_limit_probability=args.rate_limit_prob, seed=args.seed,
+    )
+
+    async def on_startup(app):
+        fake._updates_changed = asyncio.Condition()
+
+    app = fake.make_app()
+    app.on_startup.append(on_startup)
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,538 @@
+# grading.py - Очередь проверки домашних заданий с пулом асинхронных воркеров
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Protocol, Set
+
+from log_config import log_fields
+from metrics import Histogram
+from uploads import StoredUpload
+
+logger = logging.getLogger(__name__)
+
+GRADING_WAIT_SECONDS = Histogram('grading_queue_wait_seconds', 'Ожидание задания в очереди до начала проверки')
+GRADING_SECONDS = Histogram('grading_seconds', 'Длительность проверки задания', ['outcome'])
+
+
+@dataclass
+class Submission:
+    """Домашнее задание, принятое на проверку"""
+    user_id: int
+    task_id: str
+    user_answer: str
+    context: Dict[str, Any] = field(default_factory=dict)
+    enqueued_at: float = field(default_factory=time.monotonic)
+    # Большой ответ или вложение, загруженное через /api/upload-homework
+    attachment: Optional[StoredUpload] = None
+
+
+# Сколько байт вложения попадает в запрос к модели
+ATTACHMENT_PROMPT_BYTES = 48 * 1024
+
+
+def _answer_with_attachment(submission: Submission, limit: int) -> str:
+    attachment = submission.attachment
+    content = attachment.read_text(limit)
+    if attachment.size > limit:
+        content += f"\n[... показано {limit} из {attachment.size} байт ...]"
+    return f"{submission.user_answer}\n\nФайл ответа:\n{content}".lstrip()
+
+
+async def prompt_answer(submission: Submission, limit: int = ATTACHMENT_PROMPT_BYTES) -> str:
+    """Ответ для запроса к модели: текст и начало вложения.
+
+    Вложение читается через mmap в потоке и не больше limit байт: размер
+    файла не влияет ни на память воркера, ни на цикл событий.
+    """
+    if submission.attachment is None:
+        return submission.user_answer
+    return await asyncio.to_thread(_answer_with_attachment, submission, limit)
+
+
+@dataclass
+class GradingResult:
+    """Результат проверки задания"""
+    score: int
+    feedback: str
+    recommendations: List[str] = field(default_factory=list)
+    achievement: Optional[str] = None
+    # False - в тексте проверяющего нет строки "Оценка: N/100", score условный
+    parsed: bool = True
+
+
+# Получает весь накопленный на данный момент текст обратной связи
+ProgressCallback = Callable[[str], Awaitable[None]]
+
+
+class Grader(Protocol):
+    """Интерфейс проверяющего: получает задание, возвращает оценку.
+
+    Потоковые проверяющие вызывают on_progress по мере генерации текста.
+    """
+
+    async def grade(self, submission: Submission, on_progress: Optional[ProgressCallback] = None) -> GradingResult:
+        ...
+
+
+STUB_FEEDBACK = (
+    "Отличная работа! Вы правильно определили основные метрики "
+    "для когортного анализа."
+)
+STUB_RECOMMENDATIONS = [
+    "Добавьте анализ Retention Rate по месяцам",
+    "Используйте визуализацию для наглядности",
+    "Попробуйте сегментировать клиентов по LTV",
+]
+STUB_ACHIEVEMENT = '"Первое задание" - вы успешно сдали свою первую домашнюю работу!'
+
+
+class StubGrader:
+    """Локальная заглушка проверки (в реальном проекте здесь вызов OpenAI)"""
+
+    def __init__(self, delay: float = 2.0, score: int = 85):
+        self.delay = delay
+        self.score = score
+
+    async def grade(self, submission: Submission, on_progress: Optional[ProgressCallback] = None) -> GradingResult:
+        await asyncio.sleep(self.delay)
+        return GradingResult(
+            score=self.score,
+            feedback=STUB_FEEDBACK,
+            recommendations=list(STUB_RECOMMENDATIONS),
+            achievement=STUB_ACHIEVEMENT,
+        )
+
+
+_SCORE_RE = re.compile(r'Оценка\s*:?\s*(\d{1,3})\s*/\s*100')
+
+
+def parse_feedback(text: str) -> GradingResult:
+    """Разбор текста проверяющего: строка "Оценка: N/100", отзыв, пункты "•" """
+    match = _SCORE_RE.search(text)
+    score = min(100, int(match.group(1))) if match else 0
+    feedback_lines = []
+    recommendations = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped or _SCORE_RE.search(stripped):
+            continue
+        if stripped[0] in '•-*':
+            recommendations.append(stripped.lstrip('•-* ').strip())
+        elif not stripped.endswith(':'):
+            feedback_lines.append(stripped)
+    return GradingResult(
+        score=score,
+        feedback='\n'.join(feedback_lines),
+        recommendations=recommendations,
+        parsed=match is not None,
+    )
+
+
+def render_stub_feedback(score: int) -> str:
+    recommendations = '\n'.join(f"• {item}" for item in STUB_RECOMMENDATIONS)
+    return f"Оценка: {score}/100\n{STUB_FEEDBACK}\nРекомендации:\n{recommendations}"
+
+
+class FakeStreamingGrader:
+    """Локальный потоковый проверяющий: отдает текст порциями с задержкой.
+
+    first_token_delay моделирует время до первого токена LLM,
+    token_delay - паузу между токенами.
+    """
+
+    def __init__(self, first_token_delay: float = 0.3, token_delay: float = 0.05, score: int = 85):
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.score = score
+
+    async def grade(self, submission: Submission, on_progress: Optional[ProgressCallback] = None) -> GradingResult:
+        text = render_stub_feedback(self.score)
+        await asyncio.sleep(self.first_token_delay)
+        streamed = ''
+        for token in re.findall(r'\S+\s*', text):
+            streamed += token
+            if on_progress is not None:
+                await on_progress(streamed)
+            await asyncio.sleep(self.token_delay)
+        result = parse_feedback(streamed)
+        result.achievement = STUB_ACHIEVEMENT
+        return result
+
+
+GRADING_PROMPT = """Ты - преподаватель курса по работе с ИИ и анализу данных.
+Проверь домашнее задание студента.
+Первой строкой напиши "Оценка: N/100".
+Затем 2-4 предложения обратной связи.
+Затем строку "Рекомендации:" и 2-4 пункта, каждый с новой строки и с символа "•".
+Пиши по-русски, без Markdown."""
+
+
+class OpenAIGrader:
+    """Проверка через OpenAI Chat Completions с потоковой выдачей токенов"""
+
+    def __init__(self, api_key: str, model: str = 'gpt-4o-mini', timeout: float = 60.0):
+        self.api_key = api_key
+        self.timeout = timeout
+        self.model = model
+        self._client = None
+
+    @property
+    def client(self):
+        """Клиент создается при первой проверке: импорт openai не замедляет запуск"""
+        if self._client is None:
+            from openai import AsyncOpenAI
+
+            self._client = AsyncOpenAI(api_key=self.api_key, timeout=self.timeout)
+        return self._client
+
+    async def grade(self, submission: Submission, on_progress: Optional[ProgressCallback] = None) -> GradingResult:
+        answer = await prompt_answer(submission)
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            stream=True,
+            messages=[
+                {'role': 'system', 'content': GRADING_PROMPT},
+                {'role': 'user', 'content': (
+                    f"Задание: {submission.task_id}\n\nОтвет студента:\n{answer}"
+                )},
+            ],
+        )
+        text = ''
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            text += delta
+            if on_progress is not None:
+                await on_progress(text)
+        return parse_feedback(text)
+
+
+class ProgressiveEditor:
+    """Пакетирует промежуточные правки сообщения под лимиты Telegram.
+
+    update() не ждет отправки: запоминает последний текст, а фоновая
+    задача редактирует сообщение не чаще min_interval и только если текст
+    вырос на min_chars. Первая правка уходит сразу - пользователь видит
+    начало отзыва через время до первого токена.
+    """
+
+    def __init__(self, edit_fn: Callable[[str], Awaitable[Any]], min_interval: float = 1.5, min_chars: int = 40):
+        self.edit_fn = edit_fn
+        self.min_interval = min_interval
+        self.min_chars = min_chars
+
+        self._latest = ''
+        self._sent = ''
+        self._last_edit = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        self._editing = False
+        self.edits = 0
+
+    async def update(self, text: str):
+        if self._closed:
+            return
+        self._latest = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while not self._closed and self._latest != self._sent:
+            wait = self._last_edit + self.min_interval - time.monotonic()
+            if self._sent and wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            if self._sent and len(self._latest) - len(self._sent) < self.min_chars:
+                # Мало нового текста: ждем следующую порцию
+                return
+            text = self._latest
+            self._last_edit = time.monotonic()
+            self._editing = True
+            try:
+                await self.edit_fn(text)
+                self.edits += 1
+            except Exception as e:
+                logger.warning(f"Не удалось обновить промежуточный отзыв: {e}")
+            finally:
+                self._editing = False
+            self._sent = text
+
+    async def close(self):
+        """Останавливает правки и дожидается уже отправленной.
+
+        Отменяется только ожидание следующей правки: правка в очереди
+        SendScheduler делит future с итоговой (тот же coalesce_key), ее
+        отмена оборвала бы доставку результата.
+        """
+        self._closed = True
+        if self._task is not None:
+            if not self._task.done() and not self._editing:
+                self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+class QueueFullError(Exception):
+    """Очередь проверки переполнена (общий лимит или лимит пользователя)"""
+
+
+ResultCallback = Callable[[Submission, Optional[GradingResult], Optional[BaseException]], Awaitable[None]]
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+@dataclass
+class _Job:
+    submission: Submission
+    on_result: ResultCallback
+    on_position: Optional[PositionCallback] = None
+    on_progress: Optional[ProgressCallback] = None
+    last_position: int = 0
+
+
+class GradingQueue:
+    """Ограниченная очередь проверки с честным распределением по пользователям.
+
+    Задания каждого пользователя хранятся в отдельной очереди, воркеры
+    забирают их по кругу (round-robin), поэтому один студент с пачкой
+    отправок не задерживает остальных. Позиции в очереди пересчитываются
+    периодически и отдаются через on_position (не чаще position_interval);
+    обновления разных заданий уходят параллельно, не дожидаясь друг друга.
+    """
+
+    def __init__(
+        self,
+        grader: Grader,
+        workers: int = 4,
+        max_size: int = 1000,
+        max_per_user: int = 3,
+        position_interval: float = 3.0,
+    ):
+        self.grader = grader
+        self.workers = workers
+        self.max_size = max_size
+        self.max_per_user = max_per_user
+        self.position_interval = position_interval
+
+        self._pending: "OrderedDict[int, Deque[_Job]]" = OrderedDict()
+        self._size = 0
+        self._busy = 0
+        self._available: Optional[asyncio.Semaphore] = None
+        self._tasks: List[asyncio.Task] = []
+        self._notifier: Optional[asyncio.Task] = None
+        self._deliveries: set = set()
+        self._position_updates: set = set()
+        # Незавершенные задания по пользователям: от submit до конца доставки
+        self._active: Dict[int, int] = {}
+
+    # ------------------------------------------------------------------
+    # Публичный интерфейс
+
+    @property
+    def size(self) -> int:
+        """Количество заданий, ожидающих проверки"""
+        return self._size
+
+    @property
+    def idle_workers(self) -> int:
+        """Количество свободных воркеров"""
+        return self.workers - self._busy
+
+    def active_users(self) -> Set[int]:
+        """Пользователи, чьи задания ждут проверки, проверяются или доставляются"""
+        return set(self._active)
+
+    def submit(
+        self,
+        submission: Submission,
+        on_result: ResultCallback,
+        on_position: Optional[PositionCallback] = None,
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> int:
+        """Ставит задание в очередь, возвращает его позицию (с 1)"""
+        if self._available is None:
+            raise RuntimeError("GradingQueue не запущена, вызовите start()")
+        if self._size >= self.max_size:
+            raise QueueFullError("Очередь проверки переполнена")
+
+        user_jobs = self._pending.get(submission.user_id)
+        if user_jobs is not None and len(user_jobs) >= self.max_per_user:
+            raise QueueFullError("Слишком много заданий от пользователя")
+
+        job = _Job(submission, on_result, on_position, on_progress)
+        if user_jobs is None:
+            user_jobs = self._pending[submission.user_id] = deque()
+        user_jobs.append(job)
+        self._size += 1
+        self._active[submission.user_id] = self._active.get(submission.user_id, 0) + 1
+
+        position = self._position_of(submission.user_id, len(user_jobs) - 1)
+        job.last_position = position
+        self._available.release()
+        return position
+
+    async def start(self):
+        """Запуск воркеров и уведомлений о позиции"""
+        if self._available is not None:
+            return
+        self._available = asyncio.Semaphore(0)
+        self._tasks = [
+            asyncio.create_task(self._worker(i), name=f"grading-worker-{i}")
+            for i in range(self.workers)
+        ]
+        self._notifier = asyncio.create_task(self._notify_positions(), name="grading-notifier")
+        logger.info(f"🧮 Очередь проверки запущена: {self.workers} воркеров")
+
+    async def stop(self, drain: bool = True, timeout: float = 30.0):
+        """Остановка воркеров (по умолчанию дожидаемся пустой очереди)"""
+        if self._available is None:
+            return
+        if drain:
+            deadline = time.monotonic() + timeout
+            while (self._size or self._busy or self._deliveries) and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+
+        tasks = list(self._tasks) + list(self._position_updates)
+        if self._notifier:
+            tasks.append(self._notifier)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        self._tasks = []
+        self._notifier = None
+        self._available = None
+        logger.info("🛑 Очередь проверки остановлена")
+
+    # ------------------------------------------------------------------
+    # Внутренняя логика
+
+    def _pop_next(self) -> _Job:
+        user_id, user_jobs = next(iter(self._pending.items()))
+        job = user_jobs.popleft()
+        if user_jobs:
+            self._pending.move_to_end(user_id)
+        else:
+            del self._pending[user_id]
+        self._size -= 1
+        return job
+
+    def _positions(self) -> Dict[int, int]:
+        """Позиции всех ожидающих заданий в порядке round-robin обхода"""
+        positions: Dict[int, int] = {}
+        queues = list(self._pending.values())
+        position = 0
+        depth = 0
+        while queues:
+            remaining = []
+            for user_jobs in queues:
+                position += 1
+                positions[id(user_jobs[depth])] = position
+                if len(user_jobs) > depth + 1:
+                    remaining.append(user_jobs)
+            queues = remaining
+            depth += 1
+        return positions
+
+    def _position_of(self, user_id: int, depth: int) -> int:
+        """Позиция задания user_id на глубине depth без обхода всех заданий"""
+        if depth == 0:
+            # Первое задание нового пользователя - в конце круга
+            return len(self._pending)
+        position = 0
+        before = True
+        for other_id, user_jobs in self._pending.items():
+            if other_id == user_id:
+                before = False
+                position += depth + 1
+            else:
+                # Пользователи раньше по кругу успевают и на глубине depth
+                position += min(len(user_jobs), depth + 1 if before else depth)
+        return position
+
+    async def _worker(self, index: int):
+        while True:
+            await self._available.acquire()
+            job = self._pop_next()
+            self._busy += 1
+            submission = job.submission
+            started = time.monotonic()
+            GRADING_WAIT_SECONDS.observe(started - submission.enqueued_at)
+            try:
+                result = await self.grader.grade(submission, job.on_progress)
+            except asyncio.CancelledError:
+                self._release_user(submission.user_id)
+                raise
+            except Exception as e:
+                GRADING_SECONDS.labels('error').observe(time.monotonic() - started)
+                logger.error(f"Ошибка проверки задания пользователя {submission.user_id}: {e}")
+                self._deliver(job, None, e)
+            else:
+                now = time.monotonic()
+                GRADING_SECONDS.labels('ok').observe(now - started)
+                waited = now - submission.enqueued_at
+                logger.info(
+                    f"✅ Задание пользователя {submission.user_id} проверено "
+                    f"(воркер {index}, {waited:.2f} с с момента отправки)",
+                    extra=log_fields(user_id=submission.user_id, task_id=submission.task_id,
+                                     worker=index, seconds=round(waited, 3)),
+                )
+                self._deliver(job, result, None)
+            finally:
+                self._busy -= 1
+
+    def _deliver(self, job: _Job, result: Optional[GradingResult], error: Optional[BaseException]):
+        """Доставка результата отдельной задачей: воркер не ждет отправку в Telegram"""
+        task = asyncio.create_task(self._run_delivery(job, result, error))
+        self._deliveries.add(task)
+        task.add_done_callback(self._deliveries.discard)
+
+    async def _run_delivery(self, job: _Job, result: Optional[GradingResult], error: Optional[BaseException]):
+        try:
+            await job.on_result(job.submission, result, error)
+        except asyncio.CancelledError:
+            # on_result сам освобождает свои ресурсы (ключ повтора) и при отмене
+            logger.warning(f"Доставка результата пользователю {job.submission.user_id} прервана")
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка доставки результата проверки: {e}")
+        finally:
+            self._release_user(job.submission.user_id)
+
+    def _release_user(self, user_id: int):
+        left = self._active.get(user_id, 0) - 1
+        if left > 0:
+            self._active[user_id] = left
+        else:
+            self._active.pop(user_id, None)
+
+    async def _notify_positions(self):
+        while True:
+            await asyncio.sleep(self.position_interval)
+            if not self._size:
+                continue
+            positions = self._positions()
+            for user_jobs in list(self._pending.values()):
+                for job in list(user_jobs):
+                    position = positions.get(id(job))
+                    if job.on_position is None or position is None:
+                        continue
+                    if position == job.last_position:
+                        continue
+                    job.last_position = position
+                    # Не ждем: правки одного сообщения склеивает планировщик
+                    # отправки, уходит только последняя позиция
+                    task = asyncio.create_task(self._run_position_update(job.on_position, position))
+                    self._position_updates.add(task)
+                    task.add_done_callback(self._position_updates.discard)
+
+    @staticmethod
+    async def _run_position_update(on_position: PositionCallback, position: int):
+        try:
+            await on_position(position)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить позицию в очереди: {e}")
@@ -0,0 +1,323 @@
+# grading_cache.py - Кэш результатов проверки по содержимому ответа
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import asdict
+from typing import Any, Dict, Optional, Set, Tuple
+
+from grading import GradingResult, ProgressCallback, Submission
+from log_config import log_fields
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, str, str]
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def normalize_answer(text: str) -> str:
+    """Нормализация ответа: регистр и пробелы не влияют на ключ"""
+    return ' '.join(text.lower().split())
+
+
+def answer_hash(text: str) -> str:
+    return hashlib.sha256(normalize_answer(text).encode()).hexdigest()
+
+
+class MinHasher:
+    """MinHash по словесным шинглам для оценки сходства Жаккара"""
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 3, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        params = hashlib.sha256(f"minhash-{seed}".encode()).digest()
+        generator = hashlib.shake_256(params).digest(16 * num_perm)
+        self._perms = [
+            (
+                struct.unpack_from('<Q', generator, 16 * i)[0] % (_MERSENNE_PRIME - 1) + 1,
+                struct.unpack_from('<Q', generator, 16 * i + 8)[0] % _MERSENNE_PRIME,
+            )
+            for i in range(num_perm)
+        ]
+
+    def shingles(self, text: str) -> Set[int]:
+        words = _WORD_RE.findall(text.lower())
+        size = self.shingle_size
+        if len(words) < size:
+            return set()
+        return {
+            int.from_bytes(hashlib.blake2b(' '.join(words[i:i + size]).encode(), digest_size=8).digest(), 'little')
+            for i in range(len(words) - size + 1)
+        }
+
+    def signature(self, text: str) -> Optional[Tuple[int, ...]]:
+        """Подпись ответа; None - ответ слишком короткий для шинглов"""
+        shingles = self.shingles(text)
+        if not shingles:
+            return None
+        prime = _MERSENNE_PRIME
+        return tuple(
+            min((a * value + b) % prime for value in shingles)
+            for a, b in self._perms
+        )
+
+    @staticmethod
+    def similarity(left: Tuple[int, ...], right: Tuple[int, ...]) -> float:
+        return sum(1 for a, b in zip(left, right) if a == b) / len(left)
+
+
+class GradingCache:
+    """LRU+TTL кэш результатов проверки с необязательным SQLite-уровнем.
+
+    Ключ - (task_id, версия рубрики, хэш нормализованного ответа). Для
+    почти совпадающих ответов используется MinHash с LSH-индексом по
+    полосам подписи: кандидат переиспользуется, если оценка сходства
+    не ниже near_threshold.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10_000,
+        ttl: Optional[float] = 7 * 86400,
+        disk_path: Optional[str] = None,
+        near_threshold: float = 0.9,
+        num_perm: int = 64,
+        bands: int = 16,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.near_threshold = near_threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.minhasher = MinHasher(num_perm=num_perm) if near_threshold < 1 else None
+
+        # key -> (result, grade_seconds, expires_at, signature)
+        self._entries: "OrderedDict[CacheKey, Tuple[GradingResult, float, float, Optional[Tuple[int, ...]]]]" = OrderedDict()
+        self._bands: Dict[Tuple[str, str, int, Tuple[int, ...]], Set[CacheKey]] = defaultdict(set)
+        # Подписи промахов get(): put() того же ответа не считает MinHash повторно
+        self._pending_signatures: "OrderedDict[CacheKey, Optional[Tuple[int, ...]]]" = OrderedDict()
+
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS grading_cache ('
+                'key TEXT PRIMARY KEY, result TEXT NOT NULL, grade_seconds REAL NOT NULL, expires_at REAL NOT NULL)'
+            )
+            self._db.commit()
+
+        # Метрики
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # Сэкономленное время проверки по виду попадания
+        self.saved_by_kind: Dict[str, float] = {'exact': 0.0, 'near': 0.0, 'disk': 0.0}
+
+    # ------------------------------------------------------------------
+    # Публичный интерфейс
+
+    def make_key(self, task_id: str, rubric_version: str, answer: str) -> CacheKey:
+        return task_id, rubric_version, answer_hash(answer)
+
+    async def get(self, task_id: str, rubric_version: str, answer: str) -> Optional[GradingResult]:
+        key = self.make_key(task_id, rubric_version, answer)
+        now = time.time()
+
+        entry = self._memory_get(key, now)
+        if entry is not None:
+            self.exact_hits += 1
+            self.saved_by_kind['exact'] += entry[1]
+            return entry[0]
+
+        if self._db is not None:
+            stored = await asyncio.to_thread(self._disk_get, key, now)
+            if stored is not None:
+                result, grade_seconds = stored
+                self.disk_hits += 1
+                self.saved_by_kind['disk'] += grade_seconds
+                self._memory_put(key, result, grade_seconds, now, await self._signature(answer))
+                return result
+
+        if self.minhasher is not None:
+            signature = await self._signature(answer)
+            near = self._near_get(task_id, rubric_version, signature, now) if signature else None
+            if near is not None:
+                self.near_hits += 1
+                self.saved_by_kind['near'] += near[1]
+                return near[0]
+            self._pending_signatures[key] = signature
+            while len(self._pending_signatures) > 1024:
+                self._pending_signatures.popitem(last=False)
+
+        self.misses += 1
+        return None
+
+    async def put(self, task_id: str, rubric_version: str, answer: str, result: GradingResult, grade_seconds: float):
+        key = self.make_key(task_id, rubric_version, answer)
+        now = time.time()
+        if key in self._pending_signatures:
+            signature = self._pending_signatures.pop(key)
+        else:
+            signature = await self._signature(answer)
+        self._memory_put(key, result, grade_seconds, now, signature)
+        if self._db is not None:
+            await asyncio.to_thread(self._disk_put, key, result, grade_seconds, now)
+
+    @property
+    def saved_seconds(self) -> float:
+        return sum(self.saved_by_kind.values())
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.exact_hits + self.near_hits + self.disk_hits + self.misses
+        hits = lookups - self.misses
+        return {
+            'entries': len(self._entries),
+            'exact_hits': self.exact_hits,
+            'near_hits': self.near_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'saved_seconds': self.saved_seconds,
+            'saved_by_kind': dict(self.saved_by_kind),
+        }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    # ------------------------------------------------------------------
+    # Память
+
+    async def _signature(self, answer: str) -> Optional[Tuple[int, ...]]:
+        """MinHash длинного ответа - миллисекунды CPU: считается в потоке"""
+        if self.minhasher is None:
+            return None
+        return await asyncio.to_thread(self.minhasher.signature, answer)
+
+    def _band_keys(self, task_id: str, rubric_version: str, signature: Tuple[int, ...]):
+        rows = self.rows
+        for band in range(self.bands):
+            yield task_id, rubric_version, band, signature[band * rows:(band + 1) * rows]
+
+    def _memory_get(self, key: CacheKey, now: float):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[2] < now:
+            self._memory_remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _memory_put(self, key: CacheKey, result: GradingResult, grade_seconds: float, now: float,
+                    signature: Optional[Tuple[int, ...]]):
+        if key in self._entries:
+            self._memory_remove(key)
+        expires_at = now + self.ttl if self.ttl is not None else float('inf')
+        self._entries[key] = (result, grade_seconds, expires_at, signature)
+        if signature is not None:
+            for band_key in self._band_keys(key[0], key[1], signature):
+                self._bands[band_key].add(key)
+        while len(self._entries) > self.max_entries:
+            self._memory_remove(next(iter(self._entries)))
+
+    def _memory_remove(self, key: CacheKey):
+        _, _, _, signature = self._entries.pop(key)
+        if signature is not None:
+            for band_key in self._band_keys(key[0], key[1], signature):
+                bucket = self._bands.get(band_key)
+                if bucket is not None:
+                    bucket.discard(key)
+                    if not bucket:
+                        del self._bands[band_key]
+
+    def _near_get(self, task_id: str, rubric_version: str, signature: Tuple[int, ...], now: float):
+        candidates: Set[CacheKey] = set()
+        for band_key in self._band_keys(task_id, rubric_version, signature):
+            candidates.update(self._bands.get(band_key, ()))
+        best = None
+        best_similarity = self.near_threshold
+        for key in candidates:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] < now or entry[3] is None:
+                continue
+            similarity = MinHasher.similarity(signature, entry[3])
+            if similarity >= best_similarity:
+                best, best_similarity = key, similarity
+        if best is None:
+            return None
+        self._entries.move_to_end(best)
+        return self._entries[best]
+
+    # ------------------------------------------------------------------
+    # Диск
+
+    @staticmethod
+    def _disk_key(key: CacheKey) -> str:
+        return '|'.join(key)
+
+    def _disk_get(self, key: CacheKey, now: float):
+        with self._db_lock:
+            row = self._db.execute(
+                'SELECT result, grade_seconds, expires_at FROM grading_cache WHERE key = ?',
+                (self._disk_key(key),),
+            ).fetchone()
+        if row is None or row[2] < now:
+            return None
+        return GradingResult(**json.loads(row[0])), row[1]
+
+    def _disk_put(self, key: CacheKey, result: GradingResult, grade_seconds: float, now: float):
+        expires_at = now + self.ttl if self.ttl is not None else float('inf')
+        with self._db_lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO grading_cache (key, result, grade_seconds, expires_at) VALUES (?, ?, ?, ?)',
+                (self._disk_key(key), json.dumps(asdict(result), ensure_ascii=False), grade_seconds, expires_at),
+            )
+
+
+class CachingGrader:
+    """Обертка над проверяющим: повторные и почти повторные ответы берутся из кэша"""
+
+    def __init__(self, grader, cache: GradingCache, rubric_version: str = '1'):
+        self.grader = grader
+        self.cache = cache
+        self.rubric_version = rubric_version
+
+    async def grade(self, submission: Submission, on_progress: Optional[ProgressCallback] = None) -> GradingResult:
+        # Ответ с вложением кэшируется в пределах своего файла (id - sha256 содержимого)
+        scope = submission.task_id
+        if submission.attachment is not None:
+            scope = f"{scope}@{submission.attachment.id}"
+        cached = await self.cache.get(scope, self.rubric_version, submission.user_answer)
+        if cached is not None:
+            logger.info(
+                f"♻️ Результат проверки для пользователя {submission.user_id} взят из кэша",
+                extra=log_fields(user_id=submission.user_id, task_id=submission.task_id),
+            )
+            return cached
+
+        start = time.monotonic()
+        result = await self.grader.grade(submission, on_progress)
+        if not result.parsed:
+            # Оборванный или нестандартный ответ проверяющего: следующая сдача проверится заново
+            return result
+        await self.cache.put(
+            scope,
+            self.rubric_version,
+            submission.user_answer,
+            result,
+            time.monotonic() - start,
+        )
+        return result
@@ -0,0 +1,65 @@
+# keyboards.py - Клавиатуры бота, собранные один раз и переиспользуемые
+#
+# Объекты telegram в PTB 20 неизменяемы, поэтому одну и ту же разметку
+# можно безопасно отдавать во все ответы.
+from functools import lru_cache
+
+from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    KeyboardButton,
+    ReplyKeyboardMarkup,
+    WebAppInfo,
+)
+
+
+@lru_cache(maxsize=None)
+def main_menu(app_url: str) -> ReplyKeyboardMarkup:
+    """Нижняя клавиатура /start: KeyboardButton нужен для sendData"""
+    return ReplyKeyboardMarkup(
+        [
+            [KeyboardButton("🚀 Открыть тренажер", web_app=WebAppInfo(url=app_url))],
+            [KeyboardButton("📊 Мои результаты"), KeyboardButton("❓ Помощь")],
+        ],
+        resize_keyboard=True,
+        input_field_placeholder="Выберите действие...",
+    )
+
+
+@lru_cache(maxsize=None)
+def back_to_app_button(app_url: str) -> InlineKeyboardButton:
+    return InlineKeyboardButton("🔙 Вернуться в тренажер", web_app=WebAppInfo(url=app_url))
+
+
+@lru_cache(maxsize=1024)
+def download_table(table_filename: str, table_url: str, app_url: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"📊 Скачать {table_filename}", url=table_url)],
+        [back_to_app_button(app_url)],
+    ])
+
+
+@lru_cache(maxsize=1024)
+def open_course(course_url: str, app_url: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🎓 Открыть курс SQL", url=course_url)],
+        [back_to_app_button(app_url)],
+    ])
+
+
+@lru_cache(maxsize=None)
+def homework_result(app_url: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("📊 Следующее задание", callback_data="next_task"),
+            InlineKeyboardButton("🔄 Попробовать снова", callback_data="retry"),
+        ],
+        [InlineKeyboardButton("🏠 В главное меню", web_app=WebAppInfo(url=app_url))],
+    ])
+
+
+@lru_cache(maxsize=1024)
+def retry_task(task_url: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔄 Открыть задание", web_app=WebAppInfo(url=task_url))],
+    ])
@@ -0,0 +1,109 @@
+# log_config.py - Неблокирующее логирование: QueueHandler, JSON-формат и выборка
+#
+# Обработчики только кладут запись в очередь, в stderr пишет отдельный поток
+# QueueListener, поэтому под нагрузкой они не выстраиваются в очередь за
+# вводом-выводом. Строки "на каждый апдейт" помечаются через log_fields() и
+# проходят с вероятностью LOG_SAMPLE_RATE; WARNING и выше пишутся всегда.
+#
+#   LOG_LEVEL=INFO  LOG_FORMAT=text|json  LOG_SAMPLE_RATE=0.1
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from typing import Any, Dict, Optional
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def log_fields(sampled: bool = True, **fields) -> Dict[str, Any]:
+    """extra= для записи с полями; sampled - строка на каждый апдейт/запрос"""
+    return {'sampled': sampled, 'fields': fields}
+
+
+class SampledFilter(logging.Filter):
+    """Пропускает долю помеченных записей, остальные - без изменений"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not getattr(record, 'sampled', False):
+            return True
+        return self.rate >= 1.0 or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON с полями из log_fields()"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler без форматирования в потоке вызывающего.
+
+    Стандартный prepare() форматирует запись сразу; здесь только склеиваются
+    аргументы сообщения, а формат применяет поток QueueListener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(
+    level: Optional[str] = None,
+    fmt: Optional[str] = None,
+    sample_rate: Optional[float] = None,
+) -> logging.handlers.QueueListener:
+    """Настройка корневого логгера процесса (повторный вызов ничего не меняет)"""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    level = level or os.environ.get('LOG_LEVEL', 'INFO')
+    fmt = fmt or os.environ.get('LOG_FORMAT', 'text')
+    if sample_rate is None:
+        sample_rate = float(os.environ.get('LOG_SAMPLE_RATE', '0.1'))
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    handler = _QueueHandler(records)
+    handler.addFilter(SampledFilter(sample_rate))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
@@ -0,0 +1,425 @@
+# materials_catalog.py - Каталог материалов заданий: индекс в памяти из выгрузки Supabase/CSV
+import csv
+import gzip
+import json
+import logging
+import os
+import re
+import tempfile
+from dataclasses import astuple, dataclass, fields, replace
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 1
+EXPORT_TABLES = ('courses', 'course_modules', 'course_lessons', 'assignments', 'documents')
+
+_MODULE_RE = re.compile(r'Модуль\s+(\d+)\.?(?:\s*Вариант\s+(\d+))?')
+
+
+@dataclass(frozen=True)
+class Material:
+    """Материалы задания: таблица для скачивания и ссылка на урок курса"""
+    task_id: str
+    title: str = ''
+    description: str = ''
+    table_url: Optional[str] = None
+    table_filename: Optional[str] = None
+    course_url: Optional[str] = None
+    module_id: Optional[str] = None
+    lesson_id: Optional[str] = None
+    updated_at: str = ''
+
+
+@dataclass(frozen=True)
+class Module:
+    """Модуль курса (из course_modules или учебного плана tmp/course.csv)"""
+    module_id: str
+    title: str
+    course_id: str = ''
+    week: str = ''
+    homework: str = ''
+    tools: str = ''
+    order_index: int = 0
+    updated_at: str = ''
+
+
+# Материал по умолчанию, пока выгрузка не настроена
+DEFAULT_MATERIALS = (
+    Material(
+        task_id='cohort-analysis-sql',
+        title='Когортный анализ на SQL',
+        description='Таблица с данными для когортного анализа',
+        table_url='https://docs.google.com/spreadsheets/d/1example123/export?format=xlsx',
+        table_filename='cohort_analysis_data.xlsx',
+        course_url='https://sqlcourse.example.com/cohort-analysis',
+    ),
+)
+
+
+class MaterialsCatalog:
+    """Индекс материалов по task_id, модулю и уроку.
+
+    Все поиски - обращения к словарям, без запросов к БД. apply()
+    заменяет только изменившиеся записи, поэтому каталог обновляется
+    на лету без перезапуска бота.
+    """
+
+    def __init__(self, materials: Iterable[Material] = (), modules: Iterable[Module] = ()):
+        self._materials: Dict[str, Material] = {}
+        self._modules: Dict[str, Module] = {}
+        self._by_lesson: Dict[str, str] = {}
+        self._by_module: Dict[str, Dict[str, None]] = {}
+        self.watermark = ''
+        self.upsert(materials)
+        self.upsert_modules(modules)
+
+    # ------------------------------------------------------------------
+    # Поиск
+
+    def get(self, task_id: str) -> Optional[Material]:
+        return self._materials.get(task_id)
+
+    def by_lesson(self, lesson_id: str) -> Optional[Material]:
+        task_id = self._by_lesson.get(lesson_id)
+        return self._materials.get(task_id) if task_id is not None else None
+
+    def by_module(self, module_id: str) -> List[Material]:
+        return [self._materials[task_id] for task_id in self._by_module.get(module_id, ())]
+
+    def module(self, module_id: str) -> Optional[Module]:
+        return self._modules.get(module_id)
+
+    @property
+    def modules(self) -> List[Module]:
+        return sorted(self._modules.values(), key=lambda module: module.order_index)
+
+    def __contains__(self, task_id: str) -> bool:
+        return task_id in self._materials
+
+    def __len__(self) -> int:
+        return len(self._materials)
+
+    # ------------------------------------------------------------------
+    # Изменение
+
+    def upsert(self, materials: Iterable[Material]) -> int:
+        changed = 0
+        for material in materials:
+            previous = self._materials.get(material.task_id)
+            if previous == material:
+                continue
+            if previous is not None:
+                self._unindex(previous)
+            self._materials[material.task_id] = material
+            if material.lesson_id:
+                self._by_lesson[material.lesson_id] = material.task_id
+            if material.module_id:
+                self._by_module.setdefault(material.module_id, {})[material.task_id] = None
+            self.watermark = max(self.watermark, material.updated_at)
+            changed += 1
+        return changed
+
+    def upsert_modules(self, modules: Iterable[Module]) -> int:
+        changed = 0
+        for module in modules:
+            if self._modules.get(module.module_id) != module:
+                self._modules[module.module_id] = module
+                self.watermark = max(self.watermark, module.updated_at)
+                changed += 1
+        return changed
+
+    def remove(self, task_ids: Iterable[str]) -> int:
+        removed = 0
+        for task_id in task_ids:
+            material = self._materials.pop(task_id, None)
+            if material is not None:
+                self._unindex(material)
+                removed += 1
+        return removed
+
+    def _unindex(self, material: Material):
+        if material.lesson_id and self._by_lesson.get(material.lesson_id) == material.task_id:
+            del self._by_lesson[material.lesson_id]
+        if material.module_id:
+            tasks = self._by_module.get(material.module_id)
+            if tasks is not None:
+                tasks.pop(material.task_id, None)
+                if not tasks:
+                    del self._by_module[material.module_id]
+
+    def apply(self, materials: List[Material], modules: List[Module]) -> int:
+        """Синхронизация с полной выгрузкой: upsert изменившихся, удаление пропавших"""
+        present = {material.task_id for material in materials}
+        changed = self.remove([task_id for task_id in self._materials if task_id not in present])
+        changed += self.upsert(materials)
+        present_modules = {module.module_id for module in modules}
+        for module_id in [module_id for module_id in self._modules if module_id not in present_modules]:
+            del self._modules[module_id]
+            changed += 1
+        changed += self.upsert_modules(modules)
+        return changed
+
+    # ------------------------------------------------------------------
+    # Снимок
+
+    def save_snapshot(self, path: str):
+        """Компактный снимок: строки-кортежи вместо словарей, gzip по расширению .gz"""
+        payload = {
+            'format': SNAPSHOT_FORMAT,
+            'watermark': self.watermark,
+            'materials': {
+                'fields': [field.name for field in fields(Material)],
+                'rows': [astuple(material) for material in self._materials.values()],
+            },
+            'modules': {
+                'fields': [field.name for field in fields(Module)],
+                'rows': [astuple(module) for module in self._modules.values()],
+            },
+        }
+        data = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode()
+        # Уникальный временный файл рядом со снимком: параллельные записи
+        # (воркеры кластера) не смешиваются, os.replace атомарен
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(gzip.compress(data) if path.endswith('.gz') else data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load_snapshot(cls, path: str) -> 'MaterialsCatalog':
+        with open(path, 'rb') as f:
+            data = f.read()
+        if path.endswith('.gz'):
+            data = gzip.decompress(data)
+        payload = json.loads(data)
+        if payload.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError(f"Неподдерживаемый формат снимка: {payload.get('format')}")
+        catalog = cls(
+            _rows(Material, payload['materials']),
+            _rows(Module, payload['modules']),
+        )
+        catalog.watermark = max(catalog.watermark, payload.get('watermark', ''))
+        return catalog
+
+
+def _rows(cls, table: Dict[str, Any]):
+    names = table['fields']
+    for row in table['rows']:
+        yield cls(**dict(zip(names, row)))
+
+
+# ----------------------------------------------------------------------
+# Источники данных
+
+def read_table(directory: str, name: str) -> List[Dict[str, Any]]:
+    """Строки таблицы из выгрузки: name.json (массив объектов) или name.csv"""
+    json_path = os.path.join(directory, f"{name}.json")
+    if os.path.exists(json_path):
+        with open(json_path, encoding='utf-8') as f:
+            return json.load(f)
+    csv_path = os.path.join(directory, f"{name}.csv")
+    if os.path.exists(csv_path):
+        with open(csv_path, encoding='utf-8-sig', newline='') as f:
+            return list(csv.DictReader(f))
+    return []
+
+
+def module_key(title: str) -> Optional[str]:
+    """Ключ модуля по названию: "Модуль 7. Вариант 2. ..." -> module-7-2.
+
+    Один ключ у модуля из учебного плана и из course_modules: по нему бот
+    ищет модуль и материалы модуля.
+    """
+    match = _MODULE_RE.search(title.replace('**', ''))
+    if match is None:
+        return None
+    key = f"module-{match.group(1)}"
+    if match.group(2):
+        key += f"-{match.group(2)}"
+    return key
+
+
+def load_course_plan(path: str) -> List[Module]:
+    """Модули из учебного плана (tmp/course.csv): неделя, модуль, домашка, инструменты"""
+    modules: List[Module] = []
+    updated_at = _mtime_iso(path)
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        rows = csv.reader(f)
+        for row in rows:
+            if len(row) >= 2 and row[1] == 'Модуль':
+                break
+        week = ''
+        for row in rows:
+            row = [cell.strip() for cell in row] + [''] * (6 - len(row))
+            if row[0] and row[0] != '—':
+                week = row[0]
+            title = row[1].replace('**', '')
+            module_id = module_key(title)
+            if module_id is None:
+                continue
+            modules.append(Module(
+                module_id=module_id,
+                title=title,
+                week=week,
+                homework=row[4],
+                tools=row[5],
+                order_index=len(modules),
+                updated_at=updated_at,
+            ))
+    return modules
+
+
+def _mtime_iso(path: str) -> str:
+    return datetime.fromtimestamp(os.path.getmtime(path), timezone.utc).isoformat()
+
+
+class MaterialsSource:
+    """Выгрузка таблиц Supabase (JSON/CSV) и учебный план в виде CSV.
+
+    load() читает файлы целиком и собирает материалы; changed() по
+    mtime файлов позволяет не перечитывать неизменившуюся выгрузку.
+    """
+
+    def __init__(
+        self,
+        export_dir: Optional[str] = None,
+        course_plan: Optional[str] = None,
+        storage_url: str = '',
+        app_url: str = '',
+    ):
+        self.export_dir = export_dir
+        self.course_plan = course_plan
+        self.storage_url = storage_url.rstrip('/')
+        self.app_url = app_url.rstrip('/')
+        self._signature: Optional[Tuple] = None
+
+    def _paths(self) -> List[str]:
+        paths = []
+        if self.export_dir:
+            for name in EXPORT_TABLES:
+                for ext in ('json', 'csv'):
+                    paths.append(os.path.join(self.export_dir, f"{name}.{ext}"))
+        if self.course_plan:
+            paths.append(self.course_plan)
+        return paths
+
+    def _current_signature(self) -> Tuple:
+        return tuple(
+            (path, os.path.getmtime(path), os.path.getsize(path))
+            for path in self._paths() if os.path.exists(path)
+        )
+
+    def changed(self) -> bool:
+        return self._current_signature() != self._signature
+
+    def load(self) -> Tuple[List[Material], List[Module]]:
+        signature = self._current_signature()
+        materials: List[Material] = []
+        modules: List[Module] = []
+        if self.export_dir:
+            materials, modules = self._load_export()
+        if self.course_plan and os.path.exists(self.course_plan):
+            exported = {module.module_id: index for index, module in enumerate(modules)}
+            for planned in load_course_plan(self.course_plan):
+                index = exported.get(planned.module_id)
+                if index is None:
+                    modules.append(planned)
+                    continue
+                # Модуль есть в выгрузке: план добавляет неделю, домашку и инструменты
+                module = modules[index]
+                modules[index] = replace(
+                    module, week=planned.week, homework=planned.homework, tools=planned.tools,
+                    updated_at=max(module.updated_at, planned.updated_at),
+                )
+        self._signature = signature
+        return materials, modules
+
+    def _load_export(self) -> Tuple[List[Material], List[Module]]:
+        tables = {name: read_table(self.export_dir, name) for name in EXPORT_TABLES}
+        courses = {row['id']: row for row in tables['courses']}
+        # Модули - по тому же ключу, что и в учебном плане (module-N), уроки
+        # ссылаются на них по id строки course_modules
+        modules_by_id: Dict[str, Module] = {}
+        for row in tables['course_modules']:
+            title = row.get('title') or ''
+            modules_by_id[row['id']] = Module(
+                module_id=module_key(title) or row['id'],
+                title=title,
+                course_id=row.get('course_id') or '',
+                order_index=int(row.get('order_index') or 0),
+                updated_at=row.get('updated_at') or '',
+            )
+        modules = list(modules_by_id.values())
+        lessons_by_assignment = {
+            row['trainer_assignment_id']: row
+            for row in tables['course_lessons'] if row.get('trainer_assignment_id')
+        }
+        # documents.task_type хранит assignments.task_id (например,
+        # document-analysis), и документов у задания может быть несколько:
+        # для скачивания берется первый по created_at, как в приложении
+        documents_by_task: Dict[str, Dict[str, Any]] = {}
+        for row in sorted(tables['documents'], key=lambda row: row.get('created_at') or ''):
+            documents_by_task.setdefault(row['task_type'], row)
+
+        materials = []
+        for assignment in tables['assignments']:
+            task_id = assignment.get('task_id')
+            if not task_id:
+                continue
+            document = documents_by_task.get(task_id)
+            lesson = lessons_by_assignment.get(assignment['id'])
+            module = modules_by_id.get(lesson['module_id']) if lesson else None
+            course = courses.get(module.course_id) if module else None
+
+            if lesson and course:
+                course_url = f"{self.app_url}/course/{course['slug']}/lesson/{lesson['id']}"
+            else:
+                course_url = f"{self.app_url}/task/{task_id}"
+            updated_at = max(
+                (row.get('updated_at') or '' for row in (assignment, document, lesson, course) if row),
+                default='',
+            )
+            materials.append(Material(
+                task_id=task_id,
+                title=assignment.get('title') or '',
+                description=(document or {}).get('description') or assignment.get('title') or '',
+                table_url=f"{self.storage_url}/storage/v1/object/public/documents/{document['file_path']}" if document else None,
+                table_filename=os.path.basename(document['file_path']) if document else None,
+                course_url=course_url,
+                module_id=module.module_id if module else None,
+                lesson_id=lesson['id'] if lesson else None,
+                updated_at=updated_at,
+            ))
+        return materials, modules
+
+
+def create_materials_catalog(source: Optional[MaterialsSource], snapshot_path: Optional[str] = None,
+                             write_snapshot: bool = True) -> MaterialsCatalog:
+    """Каталог для старта: снимок (быстро), иначе выгрузка, иначе материалы по умолчанию.
+
+    write_snapshot=False - снимок только читается (его пишет другой процесс).
+    """
+    if snapshot_path and os.path.exists(snapshot_path):
+        try:
+            catalog = MaterialsCatalog.load_snapshot(snapshot_path)
+            logger.info(f"📚 Каталог материалов из снимка: {len(catalog)} заданий")
+            return catalog
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Снимок каталога не прочитан, загружаем выгрузку: {e}")
+
+    if source is None:
+        return MaterialsCatalog(DEFAULT_MATERIALS)
+
+    materials, modules = source.load()
+    catalog = MaterialsCatalog(materials or DEFAULT_MATERIALS, modules)
+    if snapshot_path and write_snapshot:
+        catalog.save_snapshot(snapshot_path)
+    logger.info(f"📚 Каталог материалов из выгрузки: {len(catalog)} заданий, {len(catalog.modules)} модулей")
+    return catalog
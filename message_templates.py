@@ -0,0 +1,263 @@
+# message_templates.py - Предкомпилированные HTML-шаблоны сообщений бота
+import html
+from string import Formatter
+from typing import Any, Iterable, List, Optional, Tuple
+
+# Предел длины текста сообщения Telegram. Считаем по готовому HTML: это
+# строже, чем по тексту после разбора разметки, и не требует ее разбора
+MAX_MESSAGE_LENGTH = 4096
+
+# html.escape(quote=False) заменяет только эти символы
+_ESCAPED_LENGTH = {'&': 5, '<': 4, '>': 4}
+
+
+class Markup(str):
+    """Уже готовый HTML: при подстановке в шаблон не экранируется"""
+
+    __slots__ = ()
+
+
+def escape(value: Any) -> str:
+    """Экранирование значения слота для parse_mode=HTML"""
+    if isinstance(value, Markup):
+        return value
+    return html.escape(str(value), quote=False)
+
+
+class Template:
+    """Шаблон с именованными слотами {name}, разобранный один раз.
+
+    render() склеивает заранее нарезанные литералы и экранированные
+    значения слотов; шаблон без слотов отдает готовую строку.
+    """
+
+    __slots__ = ('source', 'fields', '_parts', '_static')
+
+    def __init__(self, source: str):
+        self.source = source
+        parts = []
+        for literal, field, spec, conversion in Formatter().parse(source):
+            if spec or conversion:
+                raise ValueError(f"Форматирование в слотах не поддерживается: {field}")
+            if field == '' or (field is not None and not field.isidentifier()):
+                raise ValueError(f"Слот шаблона должен быть именем: {field!r}")
+            parts.append((literal, field))
+        self._parts: Tuple[Tuple[str, Optional[str]], ...] = tuple(parts)
+        self.fields = frozenset(field for _, field in parts if field is not None)
+        self._static = ''.join(literal for literal, _ in parts) if not self.fields else None
+
+    def render(self, **values: Any) -> str:
+        if self._static is not None:
+            return self._static
+        out = []
+        for literal, field in self._parts:
+            out.append(literal)
+            if field is not None:
+                out.append(escape(values[field]))
+        return ''.join(out)
+
+
+def bullet_list(items: Iterable[str]) -> Markup:
+    """Список "• пункт" с экранированием каждого пункта"""
+    return Markup('\n'.join(f"• {escape(item)}" for item in items))
+
+
+def truncate(text: str, limit: int) -> str:
+    """Обрезка пользовательского текста до экранирования (не режет сущности)"""
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+def escaped_head(text: str, limit: int) -> Markup:
+    """Начало текста, которое после экранирования (с "…") не длиннее limit"""
+    escaped = escape(text)
+    if len(escaped) <= limit:
+        return Markup(escaped)
+    size, end = 0, 0
+    while end < len(text) and size + _ESCAPED_LENGTH.get(text[end], 1) <= limit - 1:
+        size += _ESCAPED_LENGTH.get(text[end], 1)
+        end += 1
+    return Markup(escape(text[:end]) + '…') if limit > 0 else Markup('')
+
+
+def escaped_tail(text: str, limit: int) -> Markup:
+    """Конец текста, который после экранирования не длиннее limit"""
+    size, start = 0, len(text)
+    while start > 0 and size + _ESCAPED_LENGTH.get(text[start - 1], 1) <= limit:
+        size += _ESCAPED_LENGTH.get(text[start - 1], 1)
+        start -= 1
+    return Markup(escape(text[start:]))
+
+
+WELCOME = Template("""\
+🎯 <b>Добро пожаловать в AI Тренажер, {first_name}!</b>
+
+Это интерактивная система обучения работе с ИИ-инструментами.
+
+<b>🔥 Возможности:</b>
+• Практические задания по анализу данных
+• Автоматическая проверка домашних заданий
+• Персональная обратная связь от ИИ
+• Отслеживание прогресса
+
+<b>📱 Как начать:</b>
+Нажмите кнопку <b>"🚀 Открыть тренажер"</b> внизу экрана.
+
+<i>💡 Подсказка: WebApp откроется прямо в Telegram!</i>""")
+
+HELP = Template("""\
+❓ <b>Помощь по AI Тренажеру</b>
+
+<b>Основные команды:</b>
+/start - Главное меню
+/help - Эта справка
+
+<b>Как пользоваться:</b>
+1. Нажмите "🚀 Открыть тренажер"
+2. Выберите задание
+3. Изучите материалы
+4. Выполните задание
+5. Нажмите "Сдать домашку"
+
+<b>Важно:</b>
+• Приложение работает прямо в Telegram
+• Все данные сохраняются автоматически
+• Можно вернуться к заданию в любой момент
+
+<b>Проблемы?</b>
+Напишите @your_support_bot""")
+
+TEST_ACTION = Template("""\
+✅ <b>Тестовое сообщение получено!</b>
+
+Данные: <code>{data}</code>""")
+
+DOWNLOAD_TABLE = Template("""\
+📊 <b>Материалы для задания готовы!</b>
+
+<b>Файл:</b> {table_filename}
+<b>Описание:</b> {description}
+
+<b>Инструкция:</b>
+1. Нажмите кнопку "Скачать" ниже
+2. Откройте файл в Excel или Google Sheets
+3. Изучите структуру данных
+4. Вернитесь в тренажер для выполнения задания
+
+<i>💡 Совет: Обратите внимание на столбцы с датами и суммами транзакций</i>""")
+
+OPEN_COURSE = Template("""\
+🎓 <b>Обучающий курс готов!</b>
+
+<b>В курсе вы изучите:</b>
+• Основы SQL запросов
+• Работа с агрегатными функциями
+• Когортный анализ на практике
+• Использование GPT для генерации SQL
+
+<b>Длительность:</b> ~30 минут
+
+Нажмите кнопку ниже для начала обучения 👇""")
+
+STATS_EMPTY = Template("""\
+📊 <b>Ваша статистика:</b>
+
+Выполнено заданий: 0
+Средний балл: -
+Лучший результат: -
+
+Начните с первого задания в тренажере!""")
+
+STATS = Template("""\
+📊 <b>Ваша статистика:</b>
+
+Выполнено заданий: {tasks_done}
+Средний балл: {mean_score}
+Лучший результат: {best_score}
+Дней подряд: {streak} 🔥""")
+
+PROCESSING = Template("""\
+🔄 <b>Проверяю ваше задание...</b>
+
+Это займет несколько секунд ⏳""")
+
+QUEUE_POSITION = Template("""\
+🔄 <b>Проверяю ваше задание...</b>
+
+Вы #{position} в очереди ⏳""")
+
+FEEDBACK_PROGRESS = Template("""\
+🔄 <b>Проверяю ваше задание...</b>
+
+{text} ▌""")
+
+# Длина FEEDBACK_PROGRESS без текста отзыва
+_FEEDBACK_PROGRESS_FRAME = len(FEEDBACK_PROGRESS.render(text=''))
+
+QUEUE_FULL = Template("""\
+⚠️ <b>Сейчас на проверке слишком много заданий</b>
+
+Попробуйте отправить задание через пару минут""")
+
+DUPLICATE_IN_PROGRESS = Template("⏳ Этот ответ уже проверяется, результат придет в сообщение выше")
+
+DUPLICATE_DONE = Template("✅ Этот ответ только что проверен, результат - в сообщении выше")
+
+GRADING_FAILED = Template("❌ Не удалось проверить задание, попробуйте еще раз")
+
+HOMEWORK_RECEIVED = Template("""\
+📝 <b>Получено домашнее задание!</b>
+
+<b>Задание:</b> {task_id}
+<b>Ваш ответ:</b>
+{answer}
+
+⏳ Проверка займет несколько секунд...""")
+
+HOMEWORK_RESULT = Template("""\
+🎉 <b>Задание проверено!</b>
+
+🎯 <b>Оценка: {score}/100</b>
+
+<b>📝 Ваш ответ:</b>
+<i>{answer}</i>
+
+<b>✅ Обратная связь:</b>
+{feedback}
+
+<b>💡 Рекомендации:</b>
+{recommendations}{achievement}""")
+
+ACHIEVEMENT = Template("""
+
+<b>🏆 Достижение разблокировано:</b>
+{achievement}""")
+
+
+def render_feedback_progress(text: str) -> str:
+    """Промежуточный отзыв: виден конец текста, сообщение не длиннее MAX_MESSAGE_LENGTH"""
+    return FEEDBACK_PROGRESS.render(text=escaped_tail(text, MAX_MESSAGE_LENGTH - _FEEDBACK_PROGRESS_FRAME))
+
+
+def render_homework_result(score: int, user_answer: str, feedback: str, recommendations: Iterable[str],
+                           achievement: Optional[str] = None) -> str:
+    """Итог проверки: ответ студента и отзыв экранируются.
+
+    Длинный результат сокращается до MAX_MESSAGE_LENGTH: сначала отзыв,
+    затем (если его не хватило) список рекомендаций с конца.
+    """
+    items: List[str] = list(recommendations)
+    values = {
+        'score': score,
+        'answer': truncate(user_answer, 200),
+        'achievement': Markup(ACHIEVEMENT.render(achievement=achievement)) if achievement else Markup(''),
+    }
+    text = HOMEWORK_RESULT.render(feedback=feedback, recommendations=bullet_list(items), **values)
+    overflow = len(text) - MAX_MESSAGE_LENGTH
+    if overflow <= 0:
+        return text
+    feedback = escaped_head(feedback, max(0, len(escape(feedback)) - overflow))
+    text = HOMEWORK_RESULT.render(feedback=feedback, recommendations=bullet_list(items), **values)
+    while len(text) > MAX_MESSAGE_LENGTH and items:
+        items.pop()
+        text = HOMEWORK_RESULT.render(feedback=feedback, recommendations=bullet_list(items), **values)
+    return text
@@ -0,0 +1,558 @@
+# send_scheduler.py - Планировщик исходящих сообщений с лимитами Telegram
+import asyncio
+import heapq
+import itertools
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета: меньше - раньше
+PRIORITY_RESULT = 0
+PRIORITY_NORMAL = 1
+PRIORITY_NOTICE = 2
+
+# Лимиты Telegram: ~30 сообщений/с на бота и 1 сообщение/с в один чат
+DEFAULT_GLOBAL_RATE = 30.0
+DEFAULT_CHAT_RATE = 1.0
+
+
+class TokenBucket:
+    """Классическое ведро токенов; rate=None - без ограничений"""
+
+    def __init__(self, rate: Optional[float], capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate or 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Сколько ждать до появления токена (0 - можно сейчас)"""
+        if self.rate is None:
+            return 0.0
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> float:
+        """Забирает токен; если его нет - возвращает время ожидания"""
+        wait = self.wait_time(now)
+        if not wait and self.rate is not None:
+            self.tokens -= 1
+        return wait
+
+    def pause(self, seconds: float, now: float):
+        """Блокирует ведро на seconds (ответ 429 с retry_after)"""
+        if self.rate is None:
+            return
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+    def is_full(self, now: float) -> bool:
+        if self.rate is None:
+            return True
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+def _retry_after_seconds(error: BaseException) -> Optional[float]:
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is None:
+        return None
+    if hasattr(retry_after, 'total_seconds'):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+def _chain(source: asyncio.Future, target: asyncio.Future):
+    """target завершается так же, как source"""
+    def copy(done: asyncio.Future):
+        if target.done():
+            return
+        if done.cancelled():
+            target.cancel()
+        elif done.exception() is not None:
+            target.set_exception(done.exception())
+        else:
+            target.set_result(done.result())
+    source.add_done_callback(copy)
+
+
+@dataclass
+class _Job:
+    chat_id: Hashable
+    send_fn: Callable[[], Awaitable[Any]]
+    priority: int
+    seq: int
+    future: asyncio.Future
+    coalesce_key: Optional[Hashable] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+
+
+@dataclass
+class _Chat:
+    bucket: TokenBucket
+    jobs: List[Tuple[int, int, _Job]] = field(default_factory=list)
+    state: str = 'idle'  # idle | ready | waiting | reserving
+
+
+class SharedLimits:
+    """Ведра токенов в файле SQLite: одни лимиты на все процессы бота.
+
+    Бот, воркеры кластера, серверы WebApp и рассылка шлют от имени одного
+    токена, поэтому общий лимит (~30/с) и 1 сообщение/с в чат действуют на
+    них вместе. Каждый процесс перед отправкой резервирует токены здесь.
+    Транзакция может ждать блокировку файла (до timeout), поэтому
+    SendScheduler вызывает reserve() и pause() в потоке, а не в цикле
+    событий. Пока файл заблокирован, отправка откладывается, а не идет мимо
+    лимитов.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        global_rate: float = DEFAULT_GLOBAL_RATE,
+        chat_rate: Optional[float] = DEFAULT_CHAT_RATE,
+        chat_burst: float = 1.0,
+    ):
+        self.path = path
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=0.1, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # Ведра не переживают сбой питания - и не должны
+        self._conn.execute('PRAGMA synchronous=OFF')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)'
+        )
+        self._reservations = 0
+
+    def _tokens(self, key: str, rate: float, capacity: float, now: float) -> float:
+        row = self._conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return capacity
+        tokens, updated = row
+        return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+    def _store(self, key: str, tokens: float, now: float):
+        self._conn.execute(
+            'INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+            (key, tokens, now),
+        )
+
+    def reserve(self, chat_id: Optional[Hashable]) -> Tuple[float, float]:
+        """Забирает токены общего ведра и ведра чата.
+
+        Возвращает (ожидание общего ведра, ожидание чата); (0, 0) - токены
+        взяты, можно отправлять.
+        """
+        chat_key = f'chat:{chat_id}' if chat_id is not None and self.chat_rate else None
+        with self._lock:
+            now = time.time()
+            try:
+                self._conn.execute('BEGIN IMMEDIATE')
+            except sqlite3.OperationalError:
+                return 0.05, 0.0
+            try:
+                global_capacity = max(1.0, self.global_rate)
+                global_tokens = self._tokens('global', self.global_rate, global_capacity, now)
+                global_wait = 0.0 if global_tokens >= 1 else (1 - global_tokens) / self.global_rate
+                chat_wait = 0.0
+                if chat_key is not None:
+                    chat_tokens = self._tokens(chat_key, self.chat_rate, self.chat_burst, now)
+                    chat_wait = 0.0 if chat_tokens >= 1 else (1 - chat_tokens) / self.chat_rate
+                if not global_wait and not chat_wait:
+                    self._store('global', global_tokens - 1, now)
+                    if chat_key is not None:
+                        self._store(chat_key, chat_tokens - 1, now)
+                    self._reservations += 1
+                    if self._reservations % 1000 == 0:
+                        self._prune(now)
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return global_wait, chat_wait
+
+    def pause(self, chat_id: Optional[Hashable], seconds: float):
+        """429 с retry_after: чат блокируется для всех процессов"""
+        if chat_id is None or not self.chat_rate:
+            return
+        key = f'chat:{chat_id}'
+        with self._lock:
+            now = time.time()
+            try:
+                self._conn.execute('BEGIN IMMEDIATE')
+            except sqlite3.OperationalError:
+                return
+            try:
+                tokens = self._tokens(key, self.chat_rate, self.chat_burst, now)
+                self._store(key, min(tokens, 0.0) - seconds * self.chat_rate, now)
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def _prune(self, now: float):
+        """Ведра чатов, давно полные, удаляются"""
+        idle = max(60.0, self.chat_burst / self.chat_rate) if self.chat_rate else 60.0
+        self._conn.execute("DELETE FROM buckets WHERE key != 'global' AND updated < ?", (now - idle,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SendScheduler:
+    """Единая точка отправки: ведра токенов (общее и на чат), приоритеты, склейка.
+
+    Задания одного чата идут строго по (приоритет, порядок постановки);
+    чат попадает в очередь готовых, когда его ведро позволяет отправку,
+    а общее ведро ограничивает суммарный темп. Задание с тем же
+    coalesce_key, что и ожидающее, заменяет его (например, результат
+    проверки заменяет еще не отправленное "Вы #N в очереди").
+
+    С shared (SharedLimits) лимиты общие с другими процессами бота, а
+    global_rate остается потолком этого процесса.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = DEFAULT_GLOBAL_RATE,
+        chat_rate: Optional[float] = DEFAULT_CHAT_RATE,
+        chat_burst: float = 1.0,
+        max_retries: int = 3,
+        shared: Optional[SharedLimits] = None,
+    ):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.shared = shared
+
+        self._global = TokenBucket(global_rate)
+        self._chats: Dict[Hashable, _Chat] = {}
+        self._ready: List[Tuple[int, int, Hashable]] = []
+        self._waiting: List[Tuple[float, Hashable]] = []
+        self._by_key: Dict[Hashable, _Job] = {}
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._in_flight: set = set()
+        self._last_sweep = time.monotonic()
+
+        # Метрики
+        self.pending = 0
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    # ------------------------------------------------------------------
+    # Публичный интерфейс
+
+    def set_global_rate(self, rate: float):
+        """Новый общий лимит (например, при изменении числа воркеров бота)"""
+        self._global.rate = rate
+        self._global.capacity = max(1.0, rate)
+        self._global.tokens = min(self._global.tokens, self._global.capacity)
+
+    async def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="send-scheduler")
+
+    async def stop(self, drain: bool = True, timeout: float = 10.0):
+        if self._task is None:
+            return
+        if drain:
+            deadline = time.monotonic() + timeout
+            while (self.pending or self._in_flight) and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def submit(
+        self,
+        chat_id: Optional[Hashable],
+        send_fn: Callable[[], Awaitable[Any]],
+        priority: int = PRIORITY_NORMAL,
+        coalesce_key: Optional[Hashable] = None,
+    ) -> asyncio.Future:
+        """Ставит отправку в очередь, возвращает future с ответом Bot API"""
+        if self._task is None:
+            raise RuntimeError("SendScheduler не запущен, вызовите start()")
+
+        if coalesce_key is not None and coalesce_key in self._by_key:
+            job = self._by_key[coalesce_key]
+            job.send_fn = send_fn
+            if job.future.cancelled():
+                # Прежний отправитель отменил ожидание: новому - свой future
+                job.future = asyncio.get_running_loop().create_future()
+            self.coalesced += 1
+            if priority < job.priority:
+                job.priority = priority
+                chat = self._chats[job.chat_id]
+                chat.jobs = [(j.priority, j.seq, j) for _, _, j in chat.jobs]
+                heapq.heapify(chat.jobs)
+                self._schedule(job.chat_id, chat, time.monotonic())
+            return job.future
+
+        job = _Job(
+            chat_id=chat_id,
+            send_fn=send_fn,
+            priority=priority,
+            seq=next(self._seq),
+            future=asyncio.get_running_loop().create_future(),
+            coalesce_key=coalesce_key,
+        )
+        if coalesce_key is not None:
+            self._by_key[coalesce_key] = job
+        self._enqueue(job)
+        return job.future
+
+    async def send(self, chat_id, send_fn, priority: int = PRIORITY_NORMAL, coalesce_key=None) -> Any:
+        """submit() с ожиданием результата"""
+        return await self.submit(chat_id, send_fn, priority, coalesce_key)
+
+    def stats(self) -> Dict[str, Any]:
+        """Метрики очереди отправки"""
+        dispatched = self.sent + self.failed
+        return {
+            'queue_depth': self.pending,
+            'in_flight': len(self._in_flight),
+            'chats': len(self._chats),
+            'sent': self.sent,
+            'failed': self.failed,
+            'coalesced': self.coalesced,
+            'rate_limited': self.rate_limited,
+            'wait_avg': self.wait_total / dispatched if dispatched else 0.0,
+            'wait_max': self.wait_max,
+        }
+
+    # ------------------------------------------------------------------
+    # Внутренняя логика
+
+    def _enqueue(self, job: _Job):
+        chat = self._chats.get(job.chat_id)
+        if chat is None:
+            rate = self.chat_rate if job.chat_id is not None else None
+            chat = self._chats[job.chat_id] = _Chat(TokenBucket(rate, self.chat_burst))
+        heapq.heappush(chat.jobs, (job.priority, job.seq, job))
+        self.pending += 1
+        self._schedule(job.chat_id, chat, time.monotonic())
+
+    def _schedule(self, chat_id: Hashable, chat: _Chat, now: float):
+        """Ставит чат в очередь готовых или ожидающих ведра"""
+        if not chat.jobs:
+            chat.state = 'idle'
+            return
+        if chat.state in ('waiting', 'reserving'):
+            return
+        wait = chat.bucket.wait_time(now)
+        if wait:
+            chat.state = 'waiting'
+            heapq.heappush(self._waiting, (now + wait, chat_id))
+        else:
+            chat.state = 'ready'
+            priority, seq, _ = chat.jobs[0]
+            heapq.heappush(self._ready, (priority, seq, chat_id))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _forget(self, job: _Job):
+        """Задание покинуло очередь"""
+        self.pending -= 1
+        if job.coalesce_key is not None and self._by_key.get(job.coalesce_key) is job:
+            del self._by_key[job.coalesce_key]
+
+    def _promote_due(self, now: float):
+        while self._waiting and self._waiting[0][0] <= now:
+            _, chat_id = heapq.heappop(self._waiting)
+            chat = self._chats.get(chat_id)
+            if chat is not None and chat.state == 'waiting':
+                chat.state = 'idle'
+                self._schedule(chat_id, chat, now)
+
+    def _peek_ready(self) -> Optional[Hashable]:
+        """Первый актуальный чат в очереди готовых (устаревшие записи выбрасываются)"""
+        while self._ready:
+            priority, seq, chat_id = self._ready[0]
+            chat = self._chats.get(chat_id)
+            if chat is not None and chat.state == 'ready' and chat.jobs and chat.jobs[0][:2] == (priority, seq):
+                return chat_id
+            heapq.heappop(self._ready)
+        return None
+
+    def _sweep(self, now: float):
+        """Удаляем простаивающие чаты с полным ведром"""
+        idle = [
+            chat_id for chat_id, chat in self._chats.items()
+            if chat.state == 'idle' and not chat.jobs and chat.bucket.is_full(now)
+        ]
+        for chat_id in idle:
+            del self._chats[chat_id]
+        self._last_sweep = now
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            self._promote_due(now)
+            if now - self._last_sweep > 60:
+                self._sweep(now)
+
+            chat_id = self._peek_ready()
+            if chat_id is None:
+                timeout = self._waiting[0][0] - now if self._waiting else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            chat = self._chats[chat_id]
+            if chat.jobs[0][2].future.cancelled():
+                # Ожидавший отменил отправку: задание выбрасывается, лимиты не тратятся
+                heapq.heappop(self._ready)
+                self._forget(heapq.heappop(chat.jobs)[2])
+                chat.state = 'idle'
+                self._schedule(chat_id, chat, now)
+                continue
+
+            wait = self._global.wait_time(now)
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+            heapq.heappop(self._ready)
+            if self.shared is not None:
+                # Пока транзакция идет в потоке, чат снят с очереди готовых;
+                # новые задания чата ждут в его куче
+                chat.state = 'reserving'
+                try:
+                    global_wait, chat_wait = await asyncio.to_thread(self.shared.reserve, chat_id)
+                except BaseException:
+                    chat.state = 'idle'
+                    self._schedule(chat_id, chat, time.monotonic())
+                    raise
+                now = time.monotonic()
+                if chat_wait:
+                    # В чат недавно писал другой процесс: ждет только этот чат
+                    chat.state = 'waiting'
+                    heapq.heappush(self._waiting, (now + chat_wait, chat_id))
+                    continue
+                if global_wait:
+                    chat.state = 'idle'
+                    self._schedule(chat_id, chat, now)
+                    await asyncio.sleep(global_wait)
+                    continue
+                while chat.jobs and chat.jobs[0][2].future.cancelled():
+                    # Отменено во время резервирования: токен уже потрачен
+                    self._forget(heapq.heappop(chat.jobs)[2])
+                if not chat.jobs:
+                    chat.state = 'idle'
+                    continue
+            self._global.take(now)
+
+            _, _, job = heapq.heappop(chat.jobs)
+            chat.bucket.take(now)
+            chat.state = 'idle'
+            self._schedule(chat_id, chat, now)
+            self._forget(job)
+
+            waited = now - job.enqueued_at
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+            task = asyncio.create_task(self._execute(job))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _execute(self, job: _Job):
+        try:
+            result = await job.send_fn()
+        except Exception as e:
+            retry_after = _retry_after_seconds(e)
+            if retry_after is not None and job.attempts < self.max_retries:
+                self.rate_limited += 1
+                job.attempts += 1
+                now = time.monotonic()
+                chat = self._chats.get(job.chat_id)
+                if chat is not None:
+                    chat.bucket.pause(retry_after, now)
+                if self.shared is not None:
+                    await asyncio.to_thread(self.shared.pause, job.chat_id, retry_after)
+                logger.warning(f"⏳ 429 для чата {job.chat_id}, повтор через {retry_after} с")
+                if job.coalesce_key is not None:
+                    newer = self._by_key.get(job.coalesce_key)
+                    if newer is not None:
+                        # Пока ждали ответа, поставлена более свежая версия: повтор не нужен
+                        self.coalesced += 1
+                        _chain(newer.future, job.future)
+                        return
+                    self._by_key[job.coalesce_key] = job
+                job.seq = next(self._seq)
+                job.enqueued_at = now
+                self._enqueue(job)
+                return
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+
+
+class SyncRateLimiter:
+    """Блокирующий вариант тех же лимитов для синхронных процессов (Flask)"""
+
+    def __init__(
+        self,
+        global_rate: float = DEFAULT_GLOBAL_RATE,
+        chat_rate: Optional[float] = DEFAULT_CHAT_RATE,
+        shared: Optional[SharedLimits] = None,
+    ):
+        self.chat_rate = chat_rate
+        self.shared = shared
+        self._global = TokenBucket(global_rate)
+        self._chats: Dict[Hashable, TokenBucket] = {}
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    def acquire(self, chat_id: Optional[Hashable] = None):
+        """Ждет, пока отправка в чат станет разрешена обоими ведрами"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                bucket = None
+                if chat_id is not None and self.chat_rate is not None:
+                    bucket = self._chats.get(chat_id)
+                    if bucket is None:
+                        bucket = self._chats[chat_id] = TokenBucket(self.chat_rate)
+                wait = max(self._global.wait_time(now), bucket.wait_time(now) if bucket else 0.0)
+                if not wait and self.shared is not None:
+                    wait = max(self.shared.reserve(chat_id))
+                if not wait:
+                    self._global.take(now)
+                    if bucket is not None:
+                        bucket.take(now)
+                    if len(self._chats) > 10000:
+                        self._chats = {k: b for k, b in self._chats.items() if not b.is_full(now)}
+                    return
+            self.waited += wait
+            time.sleep(wait)
@@ -0,0 +1,374 @@
+# session_store.py - Хранилище пользовательских сессий: LRU+TTL в памяти и SQLite на диске
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Protocol, Tuple
+
+logger = logging.getLogger(__name__)
+
+Session = Dict[str, Any]
+
+
+class SessionStore(Protocol):
+    """Интерфейс хранилища сессий (ключ - user_id)"""
+
+    async def get(self, user_id: int) -> Optional[Session]:
+        ...
+
+    async def set(self, user_id: int, session: Session):
+        ...
+
+    async def delete(self, user_id: int):
+        ...
+
+    def user_ids(self) -> List[int]:
+        """Пользователи, чьи сессии лежат в памяти процесса"""
+        ...
+
+    async def forget(self, user_ids: Iterable[int]):
+        """Убирает сессии из памяти процесса (передача пользователей другому воркеру)"""
+        ...
+
+    async def start(self):
+        ...
+
+    async def close(self):
+        ...
+
+    def stats(self) -> Dict[str, Any]:
+        ...
+
+
+def _encode(session: Session) -> str:
+    return json.dumps(session, ensure_ascii=False, separators=(',', ':'))
+
+
+class MemorySessionStore:
+    """LRU-кэш сессий с TTL и ограничением по числу записей и объему.
+
+    Объем считается по длине сериализованной сессии - это оценка, а не
+    точный размер объектов в памяти, но ее хватает для ограничения роста.
+    """
+
+    def __init__(self, max_entries: int = 100_000, max_bytes: int = 64 * 1024 * 1024, ttl: Optional[float] = 7 * 86400):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self._data: "OrderedDict[int, Tuple[Session, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get_nowait(self, user_id: int) -> Optional[Session]:
+        entry = self._data.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        session, expires_at, size = entry
+        if expires_at < time.monotonic():
+            self._remove(user_id)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(user_id)
+        self.hits += 1
+        return session
+
+    def set_nowait(self, user_id: int, session: Session, size: Optional[int] = None):
+        if size is None:
+            size = len(_encode(session))
+        if user_id in self._data:
+            self._remove(user_id)
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else float('inf')
+        self._data[user_id] = (session, expires_at, size)
+        self._bytes += size
+        while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+            evicted_id, _ = next(iter(self._data.items()))
+            self._remove(evicted_id)
+            self.evictions += 1
+
+    def delete_nowait(self, user_id: int):
+        if user_id in self._data:
+            self._remove(user_id)
+
+    def _remove(self, user_id: int):
+        _, _, size = self._data.pop(user_id)
+        self._bytes -= size
+
+    async def get(self, user_id: int) -> Optional[Session]:
+        return self.get_nowait(user_id)
+
+    async def set(self, user_id: int, session: Session):
+        self.set_nowait(user_id, session)
+
+    async def delete(self, user_id: int):
+        self.delete_nowait(user_id)
+
+    def user_ids(self) -> List[int]:
+        return list(self._data)
+
+    async def forget(self, user_ids: Iterable[int]):
+        for user_id in user_ids:
+            self.delete_nowait(user_id)
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'entries': len(self._data),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+class SqliteSessionStore:
+    """Сессии в SQLite (WAL): переживают рестарт и доступны нескольким процессам.
+
+    Все обращения к соединению идут из одного выделенного потока, поэтому
+    event loop не блокируется на диске.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='session-sqlite')
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            'user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)'
+        )
+        conn.commit()
+        self._conn = conn
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def read(self, user_id: int) -> Optional[Session]:
+        row = self._conn.execute('SELECT data FROM sessions WHERE user_id = ?', (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def write_many(self, items: Iterable[Tuple[int, Optional[str]]]):
+        """Пакетная запись: data=None удаляет сессию"""
+        now = time.time()
+        upserts: List[Tuple[int, str, float]] = []
+        deletes: List[Tuple[int]] = []
+        for user_id, data in items:
+            if data is None:
+                deletes.append((user_id,))
+            else:
+                upserts.append((user_id, data, now))
+        with self._conn:
+            if upserts:
+                self._conn.executemany(
+                    'INSERT INTO sessions (user_id, data, updated_at) VALUES (?, ?, ?) '
+                    'ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at',
+                    upserts,
+                )
+            if deletes:
+                self._conn.executemany('DELETE FROM sessions WHERE user_id = ?', deletes)
+
+    async def get(self, user_id: int) -> Optional[Session]:
+        return await self._run(self.read, user_id)
+
+    async def write_batch(self, items: List[Tuple[int, Optional[str]]]):
+        await self._run(self.write_many, items)
+
+    async def set(self, user_id: int, session: Session):
+        await self._run(self.write_many, [(user_id, _encode(session))])
+
+    async def delete(self, user_id: int):
+        await self._run(self.write_many, [(user_id, None)])
+
+    def user_ids(self) -> List[int]:
+        # Без кэша в памяти передавать нечего: база общая для всех процессов
+        return []
+
+    async def forget(self, user_ids: Iterable[int]):
+        pass
+
+    async def start(self):
+        if self._conn is None:
+            await self._run(self._connect)
+
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'path': self.path}
+
+
+class WriteBehindSessionStore:
+    """Кэш в памяти перед дисковым хранилищем с отложенной записью.
+
+    set() меняет только кэш и помечает запись грязной; фоновая задача раз
+    в flush_interval (или при накоплении max_dirty записей) пишет пачку
+    на диск. Грязные записи не теряются при вытеснении из LRU - они
+    живут в _dirty до сброса.
+    """
+
+    def __init__(
+        self,
+        cache: MemorySessionStore,
+        backend: SqliteSessionStore,
+        flush_interval: float = 1.0,
+        max_dirty: int = 1000,
+    ):
+        self.cache = cache
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.max_dirty = max_dirty
+
+        self._dirty: Dict[int, Optional[str]] = {}
+        self._flushing: Dict[int, Optional[str]] = {}
+        # Чтения с диска в процессе: user_id -> [число читающих, число записей за время чтения]
+        self._reads: Dict[int, List[int]] = {}
+        # Периодический сброс и forget() не должны подменять _flushing друг другу
+        self._flush_lock = asyncio.Lock()
+        self._flush_requested: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.flushed_records = 0
+        self.backend_reads = 0
+
+    async def get(self, user_id: int) -> Optional[Session]:
+        session = self.cache.get_nowait(user_id)
+        if session is not None:
+            return session
+        for pending in (self._dirty, self._flushing):
+            if user_id in pending:
+                data = pending[user_id]
+                return json.loads(data) if data is not None else None
+        self.backend_reads += 1
+        state = self._reads.setdefault(user_id, [0, 0])
+        state[0] += 1
+        writes = state[1]
+        try:
+            session = await self.backend.get(user_id)
+        finally:
+            state[0] -= 1
+            if not state[0]:
+                del self._reads[user_id]
+        if state[1] != writes:
+            # Пока читали диск, сессию изменили: прочитанное могло устареть
+            return await self.get(user_id)
+        if session is not None:
+            self.cache.set_nowait(user_id, session)
+        return session
+
+    async def set(self, user_id: int, session: Session):
+        data = _encode(session)
+        self.cache.set_nowait(user_id, session, len(data))
+        self._mark_dirty(user_id, data)
+
+    async def delete(self, user_id: int):
+        self.cache.delete_nowait(user_id)
+        self._mark_dirty(user_id, None)
+
+    def user_ids(self) -> List[int]:
+        return list(set(self.cache.user_ids()) | set(self._dirty))
+
+    async def forget(self, user_ids: Iterable[int]):
+        # Сначала на диск: иначе поздний сброс затрет изменения нового владельца
+        await self.flush()
+        await self.cache.forget(user_ids)
+
+    def _mark_dirty(self, user_id: int, data: Optional[str]):
+        self._dirty[user_id] = data
+        state = self._reads.get(user_id)
+        if state is not None:
+            state[1] += 1
+        if len(self._dirty) >= self.max_dirty and self._flush_requested is not None:
+            self._flush_requested.set()
+
+    async def flush(self):
+        """Сброс накопленных изменений на диск"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            batch, self._dirty = self._dirty, {}
+            self._flushing = batch
+            try:
+                await self.backend.write_batch(list(batch.items()))
+            except Exception as e:
+                logger.error(f"Ошибка записи сессий на диск: {e}")
+                # Возвращаем неуспевшие записи, не затирая более свежие
+                for user_id, data in batch.items():
+                    self._dirty.setdefault(user_id, data)
+                return
+            finally:
+                self._flushing = {}
+            self.flushes += 1
+            self.flushed_records += len(batch)
+
+    async def _flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            await self.flush()
+
+    async def start(self):
+        await self.backend.start()
+        if self._task is None:
+            self._flush_requested = asyncio.Event()
+            self._task = asyncio.create_task(self._flusher(), name='session-flusher')
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        await self.backend.close()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.cache.stats()
+        stats.update({
+            'dirty': len(self._dirty),
+            'flushes': self.flushes,
+            'flushed_records': self.flushed_records,
+            'backend_reads': self.backend_reads,
+        })
+        return stats
+
+
+def create_session_store(
+    backend: str = 'memory',
+    path: str = 'sessions.db',
+    max_entries: int = 100_000,
+    max_bytes: int = 64 * 1024 * 1024,
+    ttl: Optional[float] = 7 * 86400,
+):
+    """Фабрика хранилища по имени бэкенда: memory или sqlite"""
+    cache = MemorySessionStore(max_entries=max_entries, max_bytes=max_bytes, ttl=ttl)
+    if backend == 'memory':
+        return cache
+    if backend == 'sqlite':
+        return WriteBehindSessionStore(cache, SqliteSessionStore(path))
+    raise ValueError(f"Неизвестный бэкенд сессий: {backend}")
@@ -0,0 +1,132 @@
+# startup.py - Отчет о времени запуска: этапы и импорты по пакетам
+#
+# install() вызывается в самом начале точки входа. С STARTUP_REPORT=1 он
+# подменяет builtins.__import__ и суммирует время импортов верхнего уровня
+# по корневым пакетам (вложенные импорты входят во время пакета, который
+# их вызвал). mark() отмечает этапы, first_request() - первый обработанный
+# апдейт или запрос; после него отчет пишется в лог, а подмена снимается.
+import builtins
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+STARTUP_REPORT = os.environ.get('STARTUP_REPORT', '') not in ('', '0')
+# Сколько самых медленных пакетов показывать в отчете
+REPORT_TOP = int(os.environ.get('STARTUP_REPORT_TOP', '12'))
+
+_original_import = builtins.__import__
+_main_thread = threading.get_ident()
+_depth = 0
+_imports: Dict[str, float] = defaultdict(float)
+_installed = False
+_marks: List[Tuple[str, float]] = []
+_first_request_done = False
+
+
+def _process_started_at() -> float:
+    """Момент старта процесса по часам perf_counter (Linux: /proc, иначе - сейчас)"""
+    now = time.perf_counter()
+    try:
+        with open('/proc/self/stat') as f:
+            # Имя процесса в скобках может содержать пробелы: считаем поля после ')'
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        started_ticks = int(fields[19])
+        age = uptime - started_ticks / os.sysconf('SC_CLK_TCK')
+        return now - max(age, 0.0)
+    except (OSError, ValueError, IndexError):
+        return now
+
+
+_started_at = _process_started_at()
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    global _depth
+    if _depth or level or name in sys.modules or threading.get_ident() != _main_thread:
+        return _original_import(name, globals, locals, fromlist, level)
+    _depth += 1
+    start = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        _depth -= 1
+        _imports[name.partition('.')[0]] += time.perf_counter() - start
+
+
+def install():
+    """Начало учета импортов (без STARTUP_REPORT ничего не подменяет)"""
+    global _installed
+    if STARTUP_REPORT and not _installed:
+        builtins.__import__ = _timed_import
+        _installed = True
+
+
+def uninstall():
+    global _installed
+    if _installed:
+        builtins.__import__ = _original_import
+        _installed = False
+
+
+def mark(phase: str):
+    """Отметка завершения этапа запуска"""
+    _marks.append((phase, time.perf_counter()))
+
+
+# Первый этап - запуск интерпретатора до импорта этого модуля
+mark('интерпретатор')
+
+
+def elapsed() -> float:
+    """Секунды с момента старта процесса"""
+    return time.perf_counter() - _started_at
+
+
+def ready():
+    """Процесс готов принимать апдейты/запросы"""
+    mark('готов к работе')
+    logger.info(f"⏱ Готов к работе через {elapsed():.2f} с после старта процесса")
+
+
+def first_request():
+    """Вызывается на каждом апдейте/запросе; отчет - только после первого"""
+    global _first_request_done
+    if _first_request_done:
+        return
+    _first_request_done = True
+    mark('первый запрос')
+    uninstall()
+    logger.info(report())
+
+
+def phases() -> List[Tuple[str, float]]:
+    """(этап, длительность с предыдущей отметки) начиная со старта процесса"""
+    result = []
+    previous = _started_at
+    for phase, at in _marks:
+        result.append((phase, at - previous))
+        previous = at
+    return result
+
+
+def import_times(top: Optional[int] = None) -> List[Tuple[str, float]]:
+    ranked = sorted(_imports.items(), key=lambda item: item[1], reverse=True)
+    return ranked[:top] if top else ranked
+
+
+def report() -> str:
+    total = (_marks[-1][1] if _marks else time.perf_counter()) - _started_at
+    lines = [f"⏱ Запуск: {total:.2f} с от старта процесса"]
+    lines.extend(f"   {phase:<24} {seconds:>7.3f} с" for phase, seconds in phases())
+    if _imports:
+        lines.append(f"   импорты (всего {sum(_imports.values()):.3f} с):")
+        lines.extend(f"     {package:<22} {seconds:>7.3f} с" for package, seconds in import_times(REPORT_TOP))
+    return '\n'.join(lines)
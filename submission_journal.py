@@ -0,0 +1,390 @@
+# submission_journal.py - Журнал принятых заданий с групповым fsync (group commit)
+#
+# Каждая запись - строка JSON в файле, который только дописывается:
+#   {"op": "accept", "id": ..., "user_id": ..., "task_id": ..., "answer": ...}
+#   {"op": "message", "id": ..., "chat_id": ..., "message_id": ...}
+#   {"op": "graded", "id": ..., "result": {...}}
+#   {"op": "done", "id": ..., "status": "delivered" | "failed" | "rejected"}
+#
+# Записи, накопившиеся пока идет fsync предыдущей пачки, пишутся и
+# синхронизируются одним вызовом, поэтому цена fsync делится на всю пачку.
+# При открытии журнал читается, незавершенные задания возвращаются для
+# повторной обработки, а файл переписывается только с ними. Журналы,
+# оставшиеся без владельца (воркеров стало меньше), открывающий процесс
+# забирает себе: их задания переписываются в его журнал, файлы удаляются.
+import asyncio
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class JournalError(RuntimeError):
+    """Запись в журнал не удалась (диск недоступен или журнал закрыт)"""
+
+
+@dataclass
+class JournalEntry:
+    """Незавершенное задание, восстановленное из журнала"""
+    id: str
+    source: str
+    user_id: int
+    task_id: str
+    answer: str
+    accepted_at: float
+    chat_id: Optional[int] = None
+    message_id: Optional[int] = None
+    result: Optional[Dict[str, Any]] = None
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+
+def new_entry_id() -> str:
+    return uuid.uuid4().hex
+
+
+def _encode(record: Dict[str, Any]) -> bytes:
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode() + b'\n'
+
+
+def accept_record(entry_id: str, source: str, user_id: int, task_id: str, answer: str, **extra) -> Dict[str, Any]:
+    record = {
+        'op': 'accept',
+        'id': entry_id,
+        'source': source,
+        'user_id': user_id,
+        'task_id': task_id,
+        'answer': answer,
+        'ts': time.time(),
+    }
+    if extra:
+        record['extra'] = extra
+    return record
+
+
+def read_journal(path: str) -> List[JournalEntry]:
+    """Незавершенные задания в порядке приема.
+
+    Оборванная последняя строка (сбой посреди записи) пропускается: такая
+    запись не была подтверждена вызывающему коду.
+    """
+    entries: Dict[str, JournalEntry] = {}
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        for line_no, line in enumerate(f, 1):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.warning(f"Журнал {path}: пропущена поврежденная строка {line_no}")
+                continue
+            op = record.get('op')
+            entry_id = record.get('id')
+            if op == 'accept':
+                entries[entry_id] = JournalEntry(
+                    id=entry_id,
+                    source=record.get('source', ''),
+                    user_id=record['user_id'],
+                    task_id=record.get('task_id') or '',
+                    answer=record.get('answer') or '',
+                    accepted_at=record.get('ts', 0.0),
+                    extra=record.get('extra') or {},
+                )
+                continue
+            entry = entries.get(entry_id)
+            if entry is None:
+                continue
+            if op == 'message':
+                entry.chat_id = record.get('chat_id')
+                entry.message_id = record.get('message_id')
+            elif op == 'graded':
+                entry.result = record.get('result')
+            elif op == 'done':
+                del entries[entry_id]
+    return list(entries.values())
+
+
+def _entry_records(entry: JournalEntry) -> List[Dict[str, Any]]:
+    record = accept_record(entry.id, entry.source, entry.user_id, entry.task_id, entry.answer, **entry.extra)
+    record['ts'] = entry.accepted_at
+    records = [record]
+    if entry.chat_id is not None:
+        records.append({'op': 'message', 'id': entry.id, 'chat_id': entry.chat_id, 'message_id': entry.message_id})
+    if entry.result is not None:
+        records.append({'op': 'graded', 'id': entry.id, 'result': entry.result})
+    return records
+
+
+def _fsync_dir(path: str):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def compact_journal(path: str, entries: List[JournalEntry]):
+    """Атомарная перезапись журнала только с незавершенными заданиями"""
+    tmp_path = f"{path}.compact"
+    with open(tmp_path, 'wb') as f:
+        f.write(b''.join(_encode(record) for entry in entries for record in _entry_records(entry)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(path)
+
+
+def orphan_journals(path: str, owned: Iterable[str]) -> List[str]:
+    """Журналы семейства path (path и path.N), не принадлежащие ни одному процессу из owned"""
+    owned = set(owned)
+    family = [path] + [
+        candidate for candidate in glob.glob(f"{glob.escape(path)}.*")
+        if candidate[len(path) + 1:].isdigit()
+    ]
+    return sorted(candidate for candidate in family if candidate not in owned and os.path.exists(candidate))
+
+
+def _open_journal(path: str, adopt: Iterable[str]) -> List[JournalEntry]:
+    """Незавершенные задания журнала и забранных журналов; на диске остается один path"""
+    pending = {entry.id: entry for entry in read_journal(path)}
+    adopted = [other for other in adopt if other != path and os.path.exists(other)]
+    for other in adopted:
+        # Сбой до удаления other повторит его задания: те же id склеятся
+        for entry in read_journal(other):
+            pending.setdefault(entry.id, entry)
+    entries = sorted(pending.values(), key=lambda entry: entry.accepted_at)
+    compact_journal(path, entries)
+    for other in adopted:
+        os.unlink(other)
+        logger.info(f"📒 Журнал {other} без владельца перенесен в {path}")
+    return entries
+
+
+class _JournalFile:
+    """Файл журнала: запись пачки строк одним write + fsync"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        self.commits = 0
+        self.records = 0
+
+    def write_batch(self, lines: List[bytes]):
+        data = b''.join(lines)
+        view = memoryview(data)
+        while view:
+            written = os.write(self._fd, view)
+            view = view[written:]
+        os.fsync(self._fd)
+        self.commits += 1
+        self.records += len(lines)
+
+    def close(self):
+        os.close(self._fd)
+
+
+class SubmissionJournal:
+    """Журнал для asyncio: append() завершается после fsync своей пачки.
+
+    commit_delay > 0 задерживает коммит, чтобы собрать пачку побольше
+    (меньше fsync ценой задержки подтверждения).
+    """
+
+    def __init__(self, path: str, commit_delay: float = 0.0):
+        self.path = path
+        self.commit_delay = commit_delay
+        self._file: Optional[_JournalFile] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._buffer: List[Tuple[bytes, asyncio.Future]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._committing = False
+
+    def open(self, adopt: Iterable[str] = ()) -> List[JournalEntry]:
+        """Чтение и сжатие журнала; возвращает задания для повторной обработки.
+
+        adopt - журналы без владельца (orphan_journals), их задания
+        переходят в этот журнал.
+        """
+        pending = _open_journal(self.path, adopt)
+        self._file = _JournalFile(self.path)
+        if pending:
+            logger.info(f"📒 Журнал {self.path}: {len(pending)} незавершенных заданий")
+        return pending
+
+    async def start(self):
+        if self._file is None:
+            raise JournalError("Журнал не открыт, вызовите open()")
+        if self._task is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='journal')
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._committer(), name='journal-committer')
+
+    def append(self, record: Dict[str, Any]) -> 'asyncio.Future[None]':
+        """Добавляет запись; future завершается, когда запись на диске"""
+        if self._task is None:
+            raise JournalError("Журнал не запущен")
+        future = asyncio.get_running_loop().create_future()
+        self._buffer.append((_encode(record), future))
+        self._wakeup.set()
+        return future
+
+    async def accept(self, entry_id: str, source: str, user_id: int, task_id: str, answer: str, **extra):
+        await self.append(accept_record(entry_id, source, user_id, task_id, answer, **extra))
+
+    def message(self, entry_id: str, chat_id: int, message_id: int) -> 'asyncio.Future[None]':
+        return self.append({'op': 'message', 'id': entry_id, 'chat_id': chat_id, 'message_id': message_id})
+
+    async def graded(self, entry_id: str, result: Dict[str, Any]):
+        await self.append({'op': 'graded', 'id': entry_id, 'result': result})
+
+    def done(self, entry_id: str, status: str = 'delivered') -> 'asyncio.Future[None]':
+        return self.append({'op': 'done', 'id': entry_id, 'status': status})
+
+    async def _committer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if self.commit_delay:
+                await asyncio.sleep(self.commit_delay)
+            batch, self._buffer = self._buffer, []
+            if not batch:
+                continue
+            self._committing = True
+            try:
+                await loop.run_in_executor(self._executor, self._file.write_batch, [line for line, _ in batch])
+            except Exception as e:
+                logger.error(f"Ошибка записи журнала заданий: {e}")
+                error = JournalError(str(e))
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            finally:
+                self._committing = False
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(None)
+
+    async def close(self):
+        if self._task is not None:
+            # Дописываем все, что уже принято
+            while self._buffer or self._committing:
+                await asyncio.sleep(0.001)
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            self._executor.shutdown(wait=True)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self) -> Dict[str, Any]:
+        if self._file is None:
+            return {'path': self.path}
+        return {'path': self.path, 'commits': self._file.commits, 'records': self._file.records}
+
+
+class SyncSubmissionJournal:
+    """Журнал для потоковых серверов (Flask): append() блокирует поток до fsync.
+
+    Один фоновый поток пишет пачку всего, что накопили потоки-обработчики,
+    пока шел предыдущий fsync.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file: Optional[_JournalFile] = None
+        self._cond = threading.Condition()
+        self._buffer: List[bytes] = []
+        self._appended = 0
+        self._committed = 0
+        self._failed: Dict[int, str] = {}
+        self._closing = False
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._file is not None
+
+    def open(self, adopt: Iterable[str] = ()) -> List[JournalEntry]:
+        with self._cond:
+            if self._file is not None:
+                return []
+            pending = _open_journal(self.path, adopt)
+            self._file = _JournalFile(self.path)
+            self._closing = False
+            self._thread = threading.Thread(target=self._committer, name='journal-committer', daemon=True)
+            self._thread.start()
+        if pending:
+            logger.info(f"📒 Журнал {self.path}: {len(pending)} незавершенных заданий")
+        return pending
+
+    def append(self, record: Dict[str, Any], wait: bool = True):
+        line = _encode(record)
+        with self._cond:
+            if self._file is None:
+                raise JournalError("Журнал не открыт, вызовите open()")
+            self._buffer.append(line)
+            self._appended += 1
+            seq = self._appended
+            self._cond.notify_all()
+            if not wait:
+                return
+            while self._committed < seq:
+                self._cond.wait()
+            error = self._failed.pop(seq, None)
+        if error is not None:
+            raise JournalError(error)
+
+    def accept(self, entry_id: str, source: str, user_id: int, task_id: str, answer: str, **extra):
+        self.append(accept_record(entry_id, source, user_id, task_id, answer, **extra))
+
+    def done(self, entry_id: str, status: str = 'delivered'):
+        self.append({'op': 'done', 'id': entry_id, 'status': status}, wait=False)
+
+    def _committer(self):
+        while True:
+            with self._cond:
+                while not self._buffer and not self._closing:
+                    self._cond.wait()
+                if not self._buffer:
+                    return
+                batch, self._buffer = self._buffer, []
+                upto = self._appended
+            error = None
+            try:
+                self._file.write_batch(batch)
+            except Exception as e:
+                logger.error(f"Ошибка записи журнала заданий: {e}")
+                error = str(e)
+            with self._cond:
+                if error is not None:
+                    for seq in range(upto - len(batch) + 1, upto + 1):
+                        self._failed[seq] = error
+                self._committed = upto
+                self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            if self._file is None:
+                return
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join()
+        with self._cond:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,128 @@
+# telegram_auth.py - Проверка подлинности initData от Telegram WebApp
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qsl
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class InitData:
+    """Разобранные и проверенные данные initData"""
+    user: Dict[str, Any]
+    auth_date: int
+    hash: str
+    fields: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def user_id(self) -> Optional[int]:
+        return self.user.get('id')
+
+    @property
+    def query_id(self) -> Optional[str]:
+        return self.fields.get('query_id')
+
+
+def parse_init_data(init_data: str) -> Tuple[Dict[str, str], str]:
+    """Разбор строки initData: поля без hash и сам hash"""
+    fields = dict(parse_qsl(init_data))
+    received_hash = fields.pop('hash', '')
+    return fields, received_hash
+
+
+class InitDataVerifier:
+    """Проверка initData с однократным вычислением секрета и кэшем результатов.
+
+    Секретный ключ HMAC("WebAppData", token) вычисляется один раз в
+    конструкторе. Успешно проверенные строки initData кэшируются в LRU до
+    истечения срока действия auth_date, поэтому повторные запросы из той же
+    сессии WebApp не пересчитывают HMAC.
+    """
+
+    def __init__(self, bot_token: str, max_age: Optional[int] = 86400, cache_size: int = 4096):
+        self.max_age = max_age
+        self.cache_size = cache_size
+        self._secret_key = hmac.new(
+            b"WebAppData",
+            bot_token.encode(),
+            hashlib.sha256
+        ).digest()
+        self._cache: "OrderedDict[str, Tuple[InitData, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def verify(self, init_data: str) -> Optional[InitData]:
+        """Возвращает InitData при успешной проверке, иначе None"""
+        if not init_data:
+            return None
+
+        now = time.time()
+        cached = self._cache_get(init_data, now)
+        if cached is not None:
+            return cached
+
+        try:
+            fields, received_hash = parse_init_data(init_data)
+            if not received_hash:
+                return None
+
+            data_check_string = '\n'.join(
+                f"{key}={fields[key]}" for key in sorted(fields)
+            )
+            calculated_hash = hmac.new(
+                self._secret_key,
+                data_check_string.encode(),
+                hashlib.sha256
+            ).hexdigest()
+            if not hmac.compare_digest(calculated_hash, received_hash):
+                return None
+
+            auth_date = int(fields.get('auth_date', 0))
+            if self.max_age is not None and now - auth_date > self.max_age:
+                return None
+
+            result = InitData(
+                user=json.loads(fields.get('user', '{}')),
+                auth_date=auth_date,
+                hash=received_hash,
+                fields=fields,
+            )
+        except Exception as e:
+            logger.error(f"Error verifying data: {e}")
+            return None
+
+        expires_at = auth_date + self.max_age if self.max_age is not None else float('inf')
+        self._cache_put(init_data, result, expires_at)
+        return result
+
+    def _cache_get(self, init_data: str, now: float) -> Optional[InitData]:
+        with self._lock:
+            entry = self._cache.get(init_data)
+            if entry is None:
+                self.misses += 1
+                return None
+            result, expires_at = entry
+            if now > expires_at:
+                del self._cache[init_data]
+                self.misses += 1
+                return None
+            self._cache.move_to_end(init_data)
+            self.hits += 1
+            return result
+
+    def _cache_put(self, init_data: str, result: InitData, expires_at: float):
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            self._cache[init_data] = (result, expires_at)
+            self._cache.move_to_end(init_data)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
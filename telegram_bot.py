@@ -1,40 +1,189 @@
 # telegram_bot.py - Рабочий бот с KeyboardButton для WebApp
+import startup
+startup.install()
+
 import os
 import sys
 import json
+import argparse
 import logging
 import asyncio
+import importlib
+import time
+from dataclasses import asdict
 from datetime import datetime
-from typing import Dict, Any
-
-from telegram import (
-    Update, 
-    KeyboardButton, 
-    ReplyKeyboardMarkup, 
-    WebAppInfo,
-    InlineKeyboardButton,
-    InlineKeyboardMarkup
-)
+from functools import partial, wraps
+from typing import Callable, Dict, Any, List, Optional
+
+from telegram import Chat, Message, Update
+from telegram.error import RetryAfter, TelegramError
 from telegram.ext import (
     Application, 
     CommandHandler, 
     MessageHandler, 
     ContextTypes, 
     filters,
-    CallbackQueryHandler
+    CallbackQueryHandler,
+    ApplicationHandlerStop,
+    BaseRateLimiter,
+    ChatJoinRequestHandler,
+    ChatMemberHandler,
+    ChosenInlineResultHandler,
+    InlineQueryHandler,
+    PollAnswerHandler,
+    PollHandler,
+    PreCheckoutQueryHandler,
+    ShippingQueryHandler,
+    TypeHandler
 )
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+from action_router import ActionRouter, Field, PayloadError, TruncatedPayload
+from dedup import Deduplicator, submission_key
+from grading import (
+    FakeStreamingGrader,
+    GradingQueue,
+    GradingResult,
+    OpenAIGrader,
+    ProgressiveEditor,
+    QueueFullError,
+    StubGrader,
+    Submission
 )
+from grading_batch import BatchingGrader, FakeBatchGrader, OpenAIBatchGrader
+from grading_cache import CachingGrader, GradingCache
+import keyboards
+import message_templates
+import metrics
+from log_config import log_fields, setup_logging
+from materials_catalog import (
+    DEFAULT_MATERIALS,
+    MaterialsCatalog,
+    MaterialsSource,
+    create_materials_catalog
+)
+from session_store import SessionStore, create_session_store
+from submission_journal import JournalEntry, SubmissionJournal, new_entry_id
+from uploads import UploadStore
+from user_stats import SqliteStatsBackend, UserStatsEngine, day_of
+from send_scheduler import PRIORITY_NORMAL, PRIORITY_NOTICE, PRIORITY_RESULT, SendScheduler, SharedLimits
+
+startup.mark('импорты')
+
+# Настройка логирования: запись из обработчиков не ждет вывода в stderr
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Конфигурация из переменных окружения
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
 MINI_APP_URL = os.environ.get('MINI_APP_URL', 'https://tap-tile-tango.onrender.com')
+GRADING_WORKERS = int(os.environ.get('GRADING_WORKERS', '4'))
+GRADING_QUEUE_SIZE = int(os.environ.get('GRADING_QUEUE_SIZE', '1000'))
+GRADING_MAX_PER_USER = int(os.environ.get('GRADING_MAX_PER_USER', '3'))
+# Проверяющий: openai (потоковый), fake-stream (локальный потоковый) или stub
+GRADER = os.environ.get('GRADER', 'openai' if OPENAI_API_KEY else 'stub')
+OPENAI_MODEL = os.environ.get('OPENAI_MODEL', 'gpt-4o-mini')
+# Не чаще одной промежуточной правки отзыва за столько секунд
+FEEDBACK_EDIT_INTERVAL = float(os.environ.get('FEEDBACK_EDIT_INTERVAL', '1.5'))
+# Кэш результатов проверки: при смене критериев оценки поднимаем версию рубрики
+GRADING_CACHE_SIZE = int(os.environ.get('GRADING_CACHE_SIZE', '10000'))
+GRADING_CACHE_TTL = float(os.environ.get('GRADING_CACHE_TTL', str(7 * 86400)))
+GRADING_CACHE_PATH = os.environ.get('GRADING_CACHE_PATH')
+GRADING_RUBRIC_VERSION = os.environ.get('GRADING_RUBRIC_VERSION', '1')
+# Порог сходства MinHash для почти повторных ответов (1 - только точные совпадения)
+GRADING_NEAR_DUP_THRESHOLD = float(os.environ.get('GRADING_NEAR_DUP_THRESHOLD', '0.9'))
+# Пакетная проверка: до GRADING_BATCH_SIZE ответов на одно задание за вызов
+# (1 - без пакетов), пачка ждет добора не дольше GRADING_BATCH_WAIT секунд
+GRADING_BATCH_SIZE = int(os.environ.get('GRADING_BATCH_SIZE', '1'))
+GRADING_BATCH_WAIT = float(os.environ.get('GRADING_BATCH_WAIT', '0.5'))
+GRADING_BATCH_CALLS = int(os.environ.get('GRADING_BATCH_CALLS', str(GRADING_WORKERS)))
+# Лимиты Telegram общие для бота, его воркеров, серверов WebApp и рассылки:
+# ведра SEND_TOTAL_RATE сообщений/с и SEND_CHAT_RATE в чат лежат в файле
+# SEND_LIMITS_DB (пустой путь - только лимиты процесса). SEND_GLOBAL_RATE -
+# потолок бота (в кластере делится между воркерами), остаток - webapp_server
+SEND_LIMITS_DB = os.environ.get('SEND_LIMITS_DB', 'send_limits.db')
+SEND_TOTAL_RATE = float(os.environ.get('SEND_TOTAL_RATE', '30'))
+SEND_GLOBAL_RATE = float(os.environ.get('SEND_GLOBAL_RATE', '20'))
+SEND_CHAT_RATE = float(os.environ.get('SEND_CHAT_RATE', '1'))
+WEBAPP_MAX_PAYLOAD_BYTES = int(os.environ.get('WEBAPP_MAX_PAYLOAD_BYTES', '4096'))
+# Хранилище сессий: memory (LRU+TTL) или sqlite (WAL + отложенная запись)
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'memory')
+SESSION_DB_PATH = os.environ.get('SESSION_DB_PATH', 'sessions.db')
+SESSION_MAX_ENTRIES = int(os.environ.get('SESSION_MAX_ENTRIES', '100000'))
+SESSION_MAX_BYTES = int(os.environ.get('SESSION_MAX_BYTES', str(64 * 1024 * 1024)))
+SESSION_TTL = float(os.environ.get('SESSION_TTL', str(7 * 86400)))
+# Статистика "📊 Мои результаты": пустой путь - только в памяти процесса
+STATS_DB_PATH = os.environ.get('STATS_DB_PATH', 'user_stats.db')
+# Журнал принятых заданий: незавершенные проверки доигрываются после рестарта
+SUBMISSION_JOURNAL = os.environ.get('SUBMISSION_JOURNAL', 'submissions.journal')
+JOURNAL_COMMIT_DELAY = float(os.environ.get('JOURNAL_COMMIT_DELAY', '0'))
+# Каталог материалов: выгрузка таблиц Supabase (JSON/CSV), учебный план и снимок
+MATERIALS_EXPORT_DIR = os.environ.get('MATERIALS_EXPORT_DIR')
+COURSE_PLAN_CSV = os.environ.get('COURSE_PLAN_CSV', 'tmp/course.csv')
+MATERIALS_SNAPSHOT = os.environ.get('MATERIALS_SNAPSHOT', 'materials.snapshot.json.gz')
+# Снимок пишет один процесс (в кластере - воркер 0), остальные только читают
+MATERIALS_SNAPSHOT_WRITER = True
+MATERIALS_REFRESH_INTERVAL = float(os.environ.get('MATERIALS_REFRESH_INTERVAL', '300'))
+SUPABASE_URL = os.environ.get('SUPABASE_URL', os.environ.get('VITE_SUPABASE_URL', ''))
+
+# Повторный update_id в пределах окна не обрабатывается
+DEDUP_WINDOW = float(os.environ.get('DEDUP_WINDOW', '300'))
+# Завершенная отправка или нажатие помнится недолго: двойное нажатие
+# отбрасывается, а осознанная повторная отправка проверяется заново
+DEDUP_DONE_WINDOW = float(os.environ.get('DEDUP_DONE_WINDOW', '10'))
+DEDUP_CAPACITY = int(os.environ.get('DEDUP_CAPACITY', '100000'))
+DEDUP_ERROR_RATE = float(os.environ.get('DEDUP_ERROR_RATE', '1e-6'))
+# Каталог файлов, загруженных через /api/upload-homework сервера WebApp
+UPLOAD_DIR = os.environ.get('UPLOAD_DIR', 'uploads')
+
+# Режим получения апдейтов
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+BOT_CONCURRENT_UPDATES = int(os.environ.get('BOT_CONCURRENT_UPDATES', '32'))
+# Число процессов-воркеров (1 - один процесс, см. bot_cluster.py)
+BOT_WORKERS = int(os.environ.get('BOT_WORKERS', '1'))
+BOT_API_BASE_URL = os.environ.get('BOT_API_BASE_URL')
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.environ.get('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', os.environ.get('PORT', '8443')))
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+# Метрики Prometheus: http://METRICS_ADDR:METRICS_PORT/metrics (0 - выключены)
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '9101'))
+METRICS_ADDR = os.environ.get('METRICS_ADDR', '127.0.0.1')
+
+UPDATE_SECONDS = metrics.Histogram('bot_update_seconds', 'Обработка апдейта хендлером', ['handler'])
+UPDATE_ERRORS = metrics.Counter('bot_update_errors_total', 'Исключения в хендлерах', ['handler'])
+WEBAPP_ACTION_SECONDS = metrics.Histogram(
+    'bot_webapp_action_seconds', 'Обработка действия WebApp (sendData)', ['action'],
+)
+_metrics_server = None
+
+# Какие типы апдейтов нужны каждому виду хендлеров (для allowed_updates)
+HANDLER_UPDATE_TYPES = [
+    (CommandHandler, ['message']),
+    (MessageHandler, ['message']),
+    (CallbackQueryHandler, ['callback_query']),
+    (InlineQueryHandler, ['inline_query']),
+    (ChosenInlineResultHandler, ['chosen_inline_result']),
+    (ShippingQueryHandler, ['shipping_query']),
+    (PreCheckoutQueryHandler, ['pre_checkout_query']),
+    (PollHandler, ['poll']),
+    (PollAnswerHandler, ['poll_answer']),
+    (ChatMemberHandler, ['my_chat_member', 'chat_member']),
+    (ChatJoinRequestHandler, ['chat_join_request']),
+    # Фильтр повторов видит все апдейты, но сам новых типов не требует
+    (TypeHandler, []),
+]
+
+# Методы Bot API, на которые распространяются лимиты отправки
+RATE_LIMITED_ENDPOINTS = {
+    'sendMessage',
+    'editMessageText',
+    'editMessageReplyMarkup',
+    'deleteMessage',
+    'sendDocument',
+    'sendPhoto',
+}
 
 if not TELEGRAM_BOT_TOKEN:
     logger.error("❌ TELEGRAM_BOT_TOKEN не установлен!")
@@ -43,64 +192,360 @@ if not TELEGRAM_BOT_TOKEN:
 logger.info(f"✅ Бот инициализирован")
 logger.info(f"📱 Mini App URL: {MINI_APP_URL}")
 
+class SchedulerRateLimiter(BaseRateLimiter[Dict[str, Any]]):
+    """Все отправки бота проходят через SendScheduler.
+
+    Через rate_limit_args можно передать priority и coalesce_key.
+    """
+
+    def __init__(self, scheduler: SendScheduler):
+        self.scheduler = scheduler
+
+    async def initialize(self):
+        await self.scheduler.start()
+
+    async def shutdown(self):
+        await self.scheduler.stop()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        request = partial(_timed_request, endpoint, callback, args, kwargs)
+        if endpoint not in RATE_LIMITED_ENDPOINTS:
+            return await request()
+        rate_limit_args = rate_limit_args or {}
+        return await self.scheduler.send(
+            data.get('chat_id'),
+            request,
+            rate_limit_args.get('priority', PRIORITY_NORMAL),
+            rate_limit_args.get('coalesce_key'),
+        )
+
+async def _timed_request(endpoint: str, callback, args, kwargs):
+    """Одна попытка вызова Bot API с учетом в метриках (повтор 429 - отдельная попытка)"""
+    start = time.perf_counter()
+    try:
+        return await callback(*args, **kwargs)
+    except RetryAfter:
+        metrics.BOT_API_RATE_LIMITED.labels(endpoint).inc()
+        raise
+    except TelegramError:
+        metrics.BOT_API_ERRORS.labels(endpoint).inc()
+        raise
+    finally:
+        metrics.BOT_API_SECONDS.labels(endpoint).observe(time.perf_counter() - start)
+
+def _instrumented(name: str, callback):
+    """Хендлер с замером длительности и учетом исключений"""
+    histogram = UPDATE_SECONDS.labels(name)
+    
+    @wraps(callback)
+    async def wrapper(update, context):
+        startup.first_request()
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            UPDATE_ERRORS.labels(name).inc()
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - start)
+    
+    return wrapper
+
+def start_metrics_server():
+    """HTTP /metrics в отдельном потоке (один на процесс)"""
+    global _metrics_server
+    if _metrics_server is not None or not METRICS_PORT:
+        return
+    try:
+        _metrics_server = metrics.start_http_server(METRICS_PORT, METRICS_ADDR)
+    except OSError as e:
+        logger.warning(f"Метрики не запущены на {METRICS_ADDR}:{METRICS_PORT}: {e}")
+
+def create_grader():
+    """Проверяющий по настройке GRADER"""
+    if GRADING_BATCH_SIZE > 1:
+        if GRADER == 'openai':
+            batch_grader = OpenAIBatchGrader(OPENAI_API_KEY, model=OPENAI_MODEL)
+        else:
+            batch_grader = FakeBatchGrader()
+        return BatchingGrader(
+            batch_grader,
+            max_batch_size=GRADING_BATCH_SIZE,
+            max_wait=GRADING_BATCH_WAIT,
+            max_concurrent_calls=GRADING_BATCH_CALLS,
+            rubric_version=GRADING_RUBRIC_VERSION,
+        )
+    if GRADER == 'openai':
+        return OpenAIGrader(OPENAI_API_KEY, model=OPENAI_MODEL)
+    if GRADER == 'fake-stream':
+        return FakeStreamingGrader()
+    return StubGrader()
+
+def answer_preview(submission: Submission) -> str:
+    """Ответ для сообщения с результатом: вложение - строкой о файле"""
+    if submission.attachment is None:
+        return submission.user_answer
+    note = f"📎 Файл ответа, {submission.attachment.size / 1024:.0f} КБ"
+    return f"{submission.user_answer}\n{note}".lstrip()
+
+def journal_key(entry: JournalEntry) -> tuple:
+    """Ключ идемпотентности задания из журнала"""
+    return submission_key(entry.user_id, entry.task_id, entry.answer, entry.extra.get('upload_id'))
+
+def create_grading_cache() -> Optional[GradingCache]:
+    """Кэш результатов проверки; GRADING_CACHE_SIZE=0 отключает его"""
+    if GRADING_CACHE_SIZE <= 0:
+        return None
+    return GradingCache(
+        max_entries=GRADING_CACHE_SIZE,
+        ttl=GRADING_CACHE_TTL,
+        disk_path=GRADING_CACHE_PATH,
+        near_threshold=GRADING_NEAR_DUP_THRESHOLD,
+    )
+
+def create_materials_source() -> Optional[MaterialsSource]:
+    """Источник каталога, если настроена выгрузка или есть учебный план"""
+    course_plan = COURSE_PLAN_CSV if COURSE_PLAN_CSV and os.path.exists(COURSE_PLAN_CSV) else None
+    if not MATERIALS_EXPORT_DIR and course_plan is None:
+        return None
+    return MaterialsSource(
+        export_dir=MATERIALS_EXPORT_DIR,
+        course_plan=course_plan,
+        storage_url=SUPABASE_URL,
+        app_url=MINI_APP_URL,
+    )
+
 class TrainingBot:
     def __init__(self):
-        self.user_sessions: Dict[int, Dict[str, Any]] = {}
+        self.user_sessions: SessionStore = create_session_store(
+            SESSION_BACKEND,
+            path=SESSION_DB_PATH,
+            max_entries=SESSION_MAX_ENTRIES,
+            max_bytes=SESSION_MAX_BYTES,
+            ttl=SESSION_TTL,
+        )
         
-        # Материалы для заданий
-        self.materials = {
-            'cohort-analysis-sql': {
-                'table_url': 'https://docs.google.com/spreadsheets/d/1example123/export?format=xlsx',
-                'table_filename': 'cohort_analysis_data.xlsx',
-                'course_url': 'https://sqlcourse.example.com/cohort-analysis',
-                'description': 'Таблица с данными для когортного анализа'
-            }
-        }
-
-    async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработка команды /start"""
-        user = update.effective_user
+        # Журнал принятых заданий (открывается в post_init)
+        self.journal = SubmissionJournal(SUBMISSION_JOURNAL, commit_delay=JOURNAL_COMMIT_DELAY)
+        self._replay_task: Optional[asyncio.Task] = None
         
-        # ВАЖНО: Используем KeyboardButton для поддержки sendData
-        keyboard = [
-            # Основная кнопка для открытия WebApp
-            [KeyboardButton(
-                "🚀 Открыть тренажер", 
-                web_app=WebAppInfo(url=MINI_APP_URL)
-            )],
-            # Дополнительные кнопки для быстрого доступа
-            [
-                KeyboardButton("📊 Мои результаты"),
-                KeyboardButton("❓ Помощь")
-            ]
-        ]
+        # Повторные апдейты, двойные нажатия и отправки того же ответа
+        self.dedup = Deduplicator(DEDUP_WINDOW, DEDUP_CAPACITY, DEDUP_ERROR_RATE, done_window=DEDUP_DONE_WINDOW)
         
-        reply_markup = ReplyKeyboardMarkup(
-            keyboard, 
-            resize_keyboard=True,
-            input_field_placeholder="Выберите действие..."
+        # Большие ответы приходят файлом: WebApp передает только id загрузки
+        self.uploads = UploadStore(UPLOAD_DIR)
+        
+        # Агрегаты для "📊 Мои результаты" обновляются при каждой проверке
+        self.user_stats = UserStatsEngine(SqliteStatsBackend(STATS_DB_PATH) if STATS_DB_PATH else None)
+        
+        # Материалы для заданий: индекс в памяти из снимка или выгрузки.
+        # Загружается в фоне с post_init, первый запрос материалов его дожидается
+        self.materials_source = create_materials_source()
+        self.materials: Optional[MaterialsCatalog] = None
+        self._materials_loading: Optional[asyncio.Future] = None
+        self._materials_task: Optional[asyncio.Task] = None
+        self._preload_task: Optional[asyncio.Task] = None
+
+        # Очередь проверки домашних заданий; повторные ответы (кнопка
+        # "Попробовать снова") берутся из кэша без вызова проверяющего
+        grader = self.grader = create_grader()
+        self.grading_cache = create_grading_cache()
+        if self.grading_cache is not None:
+            grader = CachingGrader(grader, self.grading_cache, GRADING_RUBRIC_VERSION)
+        # В пакетном режиме воркер ждет пачку, а не вызов LLM: воркеров
+        # нужно столько, чтобы заполнить все параллельные пачки
+        workers = GRADING_WORKERS
+        if isinstance(self.grader, BatchingGrader):
+            workers = max(workers, GRADING_BATCH_SIZE * GRADING_BATCH_CALLS)
+        self.grading_queue = GradingQueue(
+            grader,
+            workers=workers,
+            max_size=GRADING_QUEUE_SIZE,
+            max_per_user=GRADING_MAX_PER_USER,
         )
         
-        welcome_text = f"""
-🎯 <b>Добро пожаловать в AI Тренажер, {user.first_name}!</b>
+        # Маршрутизация действий WebApp: action -> обработчик + схема данных
+        self.action_router = ActionRouter(WEBAPP_MAX_PAYLOAD_BYTES)
+        self.action_router.register('test', self.handle_test_action)
+        self.action_router.register('download_table', self.handle_download_table, {
+            'taskId': Field(str, max_length=128, default='cohort-analysis-sql'),
+        })
+        self.action_router.register('open_course', self.handle_open_course, {
+            'taskId': Field(str, max_length=128, default='cohort-analysis-sql'),
+        })
+        self.action_router.register('submit_homework', self.handle_submit_homework, {
+            'taskId': Field(str, max_length=128),
+            'userAnswer': Field(str, default=''),
+            'uploadId': Field(str, max_length=64, default=''),
+        })
+        
+        # Планировщик исходящих сообщений (лимиты Telegram, приоритеты)
+        shared = SharedLimits(SEND_LIMITS_DB, SEND_TOTAL_RATE, SEND_CHAT_RATE) if SEND_LIMITS_DB else None
+        self.send_scheduler = SendScheduler(SEND_GLOBAL_RATE, SEND_CHAT_RATE, shared=shared)
+        
+        self._register_metrics()
 
-Это интерактивная система обучения работе с ИИ-инструментами.
+    def _register_metrics(self):
+        """Метрики подсистем снимаются из их счетчиков в момент запроса /metrics"""
+        queue = self.grading_queue
+        metrics.CallbackMetric('grading_queue_depth', 'Задания, ожидающие проверки', lambda: queue.size)
+        metrics.CallbackMetric(
+            'grading_workers_busy', 'Занятые воркеры проверки', lambda: queue.workers - queue.idle_workers,
+        )
+        scheduler = self.send_scheduler
+        metrics.CallbackMetric('send_queue_pending', 'Сообщения в очереди отправки', lambda: scheduler.pending)
+        metrics.CallbackMetric(
+            'send_total', 'Результаты отправок планировщика',
+            lambda: [(('sent',), scheduler.sent), (('failed',), scheduler.failed),
+                     (('coalesced',), scheduler.coalesced), (('rate_limited',), scheduler.rate_limited)],
+            labelnames=['result'], kind='counter',
+        )
+        cache = self.grading_cache
+        if cache is not None:
+            metrics.CallbackMetric(
+                'grading_cache_lookups_total', 'Обращения к кэшу проверки (exact, near, disk - попадания)',
+                lambda: [(('exact',), cache.exact_hits), (('near',), cache.near_hits),
+                         (('disk',), cache.disk_hits), (('miss',), cache.misses)],
+                labelnames=['result'], kind='counter',
+            )
+            metrics.CallbackMetric(
+                'grading_cache_saved_seconds_total', 'Время проверки, сэкономленное попаданиями кэша',
+                lambda: [((kind,), seconds) for kind, seconds in cache.saved_by_kind.items()],
+                labelnames=['result'], kind='counter',
+            )
+            metrics.CallbackMetric('grading_cache_hit_rate', 'Доля попаданий кэша проверки',
+                                   lambda: cache.stats()['hit_rate'])
+        sessions = self.user_sessions
+        metrics.CallbackMetric(
+            'session_store_lookups_total', 'Обращения к сессиям в памяти',
+            lambda: [(('hit',), sessions.stats().get('hits')), (('miss',), sessions.stats().get('misses'))],
+            labelnames=['result'], kind='counter',
+        )
+        metrics.CallbackMetric('session_store_entries', 'Сессии в памяти', lambda: sessions.stats().get('entries'))
+        dedup = self.dedup
+        metrics.CallbackMetric('dedup_in_flight', 'Работа, к которой могут присоединиться повторы',
+                               lambda: dedup.in_flight)
+        metrics.CallbackMetric('dedup_filter_bytes', 'Память фильтров недавних ключей',
+                               lambda: dedup.memory_bytes())
+        user_stats = self.user_stats
+        metrics.CallbackMetric('user_stats_entries', 'Агрегаты статистики в памяти',
+                               lambda: user_stats.stats()['entries'])
 
-<b>🔥 Возможности:</b>
-• Практические задания по анализу данных
-• Автоматическая проверка домашних заданий  
-• Персональная обратная связь от ИИ
-• Отслеживание прогресса
+    async def post_init(self, application: Application):
+        """Запуск фоновых подсистем после инициализации приложения"""
+        start_metrics_server()
+        await self.user_sessions.start()
+        await self.user_stats.start()
+        await self.grading_queue.start()
+        pending = self.journal.open()
+        await self.journal.start()
+        for entry in pending:
+            # Telegram повторит апдейт, прерванный рестартом: он присоединится к доигрыванию
+            if entry.source == 'bot':
+                self.dedup.claim(journal_key(entry))
+        if pending:
+            self._replay_task = asyncio.create_task(self._replay_journal(application.bot, pending), name='journal-replay')
+        self._start_loading_materials()
+        if self.materials_source is not None and MATERIALS_REFRESH_INTERVAL > 0:
+            self._materials_task = asyncio.create_task(self._refresh_materials(), name='materials-refresh')
+        if GRADER == 'openai':
+            # Клиент OpenAI создается при первой проверке, а импорт - заранее в потоке
+            self._preload_task = asyncio.create_task(asyncio.to_thread(importlib.import_module, 'openai'))
+        startup.ready()
 
-<b>📱 Как начать:</b>
-Нажмите кнопку <b>"🚀 Открыть тренажер"</b> внизу экрана.
+    def _start_loading_materials(self):
+        if self._materials_loading is None:
+            self._materials_loading = asyncio.ensure_future(asyncio.to_thread(self._load_materials))
 
-<i>💡 Подсказка: WebApp откроется прямо в Telegram!</i>
+    def _load_materials(self) -> MaterialsCatalog:
+        try:
+            return create_materials_catalog(self.materials_source, MATERIALS_SNAPSHOT, MATERIALS_SNAPSHOT_WRITER)
+        except Exception as e:
+            # Каталог подтянет фоновое обновление, пока - материалы по умолчанию
+            logger.error(f"Каталог материалов не загружен: {e}")
+            return MaterialsCatalog(DEFAULT_MATERIALS)
+
+    async def get_materials(self) -> MaterialsCatalog:
+        """Каталог материалов (при первом обращении ждет фоновую загрузку)"""
+        if self.materials is None:
+            self._start_loading_materials()
+            self.materials = await asyncio.shield(self._materials_loading)
+        return self.materials
+
+    async def post_stop(self, application: Application):
+        """Остановка фоновых подсистем (до остановки планировщика отправки)"""
+        for task in (self._materials_loading, self._preload_task):
+            if task is not None:
+                await asyncio.gather(task, return_exceptions=True)
+        if self._materials_task is not None:
+            self._materials_task.cancel()
+            await asyncio.gather(self._materials_task, return_exceptions=True)
+            self._materials_task = None
+        if self._replay_task is not None:
+            await asyncio.gather(self._replay_task, return_exceptions=True)
+            self._replay_task = None
+        await self.grading_queue.stop()
+        await self.journal.close()
+        if isinstance(self.grader, BatchingGrader):
+            logger.info(f"Пакетная проверка: {self.grader.stats()}")
+        if self.grading_cache is not None:
+            logger.info(f"Кэш проверки: {self.grading_cache.stats()}")
+            self.grading_cache.close()
+        await self.user_stats.close()
+        await self.user_sessions.close()
+
+    async def export_user_state(self, keep: Callable[[int], bool]) -> Dict[str, Any]:
+        """Сессии и статистика пользователей, которые больше не принадлежат процессу.
+
+        Переданные записи убираются из памяти; keep(user_id) - оставить у себя.
         """
-        
+        sessions = {}
+        moved_sessions = [user_id for user_id in self.user_sessions.user_ids() if not keep(user_id)]
+        for user_id in moved_sessions:
+            session = await self.user_sessions.get(user_id)
+            if session is not None:
+                sessions[user_id] = session
+        await self.user_sessions.forget(moved_sessions)
+
+        stats = {}
+        # Ключи статистики - строки; нечисловые (UUID из выгрузки) не шардируются
+        moved_stats = [key for key in self.user_stats.user_ids() if key.isdigit() and not keep(int(key))]
+        for key in moved_stats:
+            user_stats = await self.user_stats.get(key)
+            if user_stats is not None:
+                stats[key] = user_stats.encode()
+        await self.user_stats.forget(moved_stats)
+        return {'sessions': sessions, 'stats': stats}
+
+    async def import_user_state(self, state: Dict[str, Any]):
+        """Прием состояния, переданного export_user_state() другого процесса"""
+        for user_id, session in state.get('sessions', {}).items():
+            await self.user_sessions.set(int(user_id), session)
+        for user_id, data in state.get('stats', {}).items():
+            self.user_stats.adopt(user_id, data)
+
+    async def _refresh_materials(self):
+        """Подхват изменений выгрузки без перезапуска: файлы читаются в потоке"""
+        await self.get_materials()
+        while True:
+            await asyncio.sleep(MATERIALS_REFRESH_INTERVAL)
+            try:
+                if not self.materials_source.changed():
+                    continue
+                materials, modules = await asyncio.to_thread(self.materials_source.load)
+                changed = self.materials.apply(materials or list(DEFAULT_MATERIALS), modules)
+                if changed and MATERIALS_SNAPSHOT and MATERIALS_SNAPSHOT_WRITER:
+                    await asyncio.to_thread(self.materials.save_snapshot, MATERIALS_SNAPSHOT)
+                if changed:
+                    logger.info(f"📚 Каталог материалов обновлен: {changed} изменений, {len(self.materials)} заданий")
+            except Exception as e:
+                logger.error(f"Ошибка обновления каталога материалов: {e}")
+
+    async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработка команды /start"""
         await update.message.reply_text(
-            welcome_text,
-            reply_markup=reply_markup,
+            message_templates.WELCOME.render(first_name=update.effective_user.first_name),
+            reply_markup=keyboards.main_menu(MINI_APP_URL),
             parse_mode='HTML'
         )
 
@@ -109,36 +554,24 @@ class TrainingBot:
         try:
             # Получаем данные от WebApp
             web_app_data = update.message.web_app_data.data
-            data = json.loads(web_app_data)
-            
             user_id = update.effective_user.id
-            action = data.get('action')
             
-            logger.info(f"📱 Получены данные от WebApp:")
-            logger.info(f"   Пользователь: {user_id}")
-            logger.info(f"   Действие: {action}")
-            logger.info(f"   Данные: {json.dumps(data, ensure_ascii=False)}")
+            try:
+                handler, data = self.action_router.parse(web_app_data)
+            except PayloadError as e:
+                logger.warning("Данные WebApp от %s отклонены: %s", user_id, e)
+                await update.message.reply_text(e.user_message)
+                return
             
-            # Обработка различных действий
-            if action == 'test':
-                await self.handle_test_action(update, data)
-            elif action == 'download_table':
-                await self.handle_download_table(update, data)
-            elif action == 'open_course':
-                await self.handle_open_course(update, data)
-            elif action == 'submit_homework':
-                await self.handle_submit_homework(update, data)
-            else:
-                logger.warning(f"Неизвестное действие: {action}")
-                await update.message.reply_text(
-                    f"Получено неизвестное действие: {action}"
-                )
+            # Одна строка на апдейт (с выборкой); сами данные - только в DEBUG и с обрезкой
+            action = data['action']
+            logger.info("📱 WebApp: пользователь %s, действие %s", user_id, action,
+                        extra=log_fields(user_id=user_id, action=action))
+            logger.debug("   Данные: %s", TruncatedPayload(web_app_data))
+            
+            with WEBAPP_ACTION_SECONDS.labels(action).time():
+                await handler(update, data)
                 
-        except json.JSONDecodeError as e:
-            logger.error(f"Ошибка парсинга JSON: {e}")
-            await update.message.reply_text(
-                "❌ Ошибка обработки данных от приложения"
-            )
         except Exception as e:
             logger.error(f"Ошибка обработки WebApp данных: {e}")
             await update.message.reply_text(
@@ -148,85 +581,37 @@ class TrainingBot:
     async def handle_test_action(self, update: Update, data: Dict[str, Any]):
         """Обработка тестового действия"""
         await update.message.reply_text(
-            f"✅ <b>Тестовое сообщение получено!</b>\n\n"
-            f"Данные: <code>{json.dumps(data, indent=2, ensure_ascii=False)}</code>",
+            message_templates.TEST_ACTION.render(data=json.dumps(data, indent=2, ensure_ascii=False)),
             parse_mode='HTML'
         )
 
     async def handle_download_table(self, update: Update, data: Dict[str, Any]):
         """Отправка ссылки на скачивание таблицы"""
         task_id = data.get('taskId', 'cohort-analysis-sql')
-        material = self.materials.get(task_id, {})
+        material = (await self.get_materials()).get(task_id)
         
-        if not material:
+        if material is None or not material.table_url:
             await update.message.reply_text("❌ Материалы не найдены")
             return
         
-        keyboard = [
-            [InlineKeyboardButton(
-                f"📊 Скачать {material['table_filename']}", 
-                url=material['table_url']
-            )],
-            [InlineKeyboardButton(
-                "🔙 Вернуться в тренажер", 
-                web_app=WebAppInfo(url=MINI_APP_URL)
-            )]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        message_text = f"""
-📊 <b>Материалы для задания готовы!</b>
-
-<b>Файл:</b> {material['table_filename']}
-<b>Описание:</b> {material['description']}
-
-<b>Инструкция:</b>
-1. Нажмите кнопку "Скачать" ниже
-2. Откройте файл в Excel или Google Sheets  
-3. Изучите структуру данных
-4. Вернитесь в тренажер для выполнения задания
-
-<i>💡 Совет: Обратите внимание на столбцы с датами и суммами транзакций</i>
-        """
-        
         await update.message.reply_text(
-            message_text,
-            reply_markup=reply_markup,
+            message_templates.DOWNLOAD_TABLE.render(
+                table_filename=material.table_filename,
+                description=material.description,
+            ),
+            reply_markup=keyboards.download_table(material.table_filename, material.table_url, MINI_APP_URL),
             parse_mode='HTML'
         )
 
     async def handle_open_course(self, update: Update, data: Dict[str, Any]):
         """Отправка ссылки на курс"""
         task_id = data.get('taskId', 'cohort-analysis-sql')
-        material = self.materials.get(task_id, {})
-        
-        keyboard = [
-            [InlineKeyboardButton(
-                "🎓 Открыть курс SQL", 
-                url=material.get('course_url', '#')
-            )],
-            [InlineKeyboardButton(
-                "🔙 Вернуться в тренажер", 
-                web_app=WebAppInfo(url=MINI_APP_URL)
-            )]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        material = (await self.get_materials()).get(task_id)
+        course_url = material.course_url if material is not None and material.course_url else '#'
         
         await update.message.reply_text(
-            """
-🎓 <b>Обучающий курс готов!</b>
-
-<b>В курсе вы изучите:</b>
-• Основы SQL запросов
-• Работа с агрегатными функциями  
-• Когортный анализ на практике
-• Использование GPT для генерации SQL
-
-<b>Длительность:</b> ~30 минут
-
-Нажмите кнопку ниже для начала обучения 👇
-            """,
-            reply_markup=reply_markup,
+            message_templates.OPEN_COURSE.render(),
+            reply_markup=keyboards.open_course(course_url, MINI_APP_URL),
             parse_mode='HTML'
         )
 
@@ -235,61 +620,257 @@ class TrainingBot:
         user_id = update.effective_user.id
         task_id = data.get('taskId', '')
         user_answer = data.get('userAnswer', '')
+        upload_id = data.get('uploadId', '')
         
-        logger.info(f"📝 Получено домашнее задание от пользователя {user_id}")
+        logger.info(f"📝 Получено домашнее задание от пользователя {user_id}",
+                    extra=log_fields(user_id=user_id, task_id=task_id))
         
-        # Отправляем подтверждение получения
-        processing_msg = await update.message.reply_text(
-            "🔄 <b>Проверяю ваше задание...</b>\n\n"
-            "Это займет несколько секунд ⏳",
-            parse_mode='HTML'
-        )
+        # Файл загружен заранее через сервер WebApp, здесь - только ссылка на него
+        attachment = None
+        if upload_id:
+            attachment = self.uploads.get(upload_id)
+            if attachment is None:
+                await update.message.reply_text("❌ Файл ответа не найден, загрузите его еще раз")
+                return
+        elif not user_answer:
+            await update.message.reply_text("❌ Ответ пустой")
+            return
         
-        # Имитация проверки (в реальном проекте здесь вызов OpenAI)
-        await asyncio.sleep(2)
+        # Двойное нажатие "Сдать": результат придет в уже созданное
+        # сообщение о проверке, вторая проверка не нужна
+        dedup_key = submission_key(user_id, task_id, user_answer, upload_id)
+        duplicate = self.dedup.claim(dedup_key)
+        if duplicate is not None:
+            logger.info(f"🔁 Повторная отправка задания {task_id} от пользователя {user_id} пропущена")
+            template = message_templates.DUPLICATE_DONE if duplicate.done() else message_templates.DUPLICATE_IN_PROGRESS
+            await update.message.reply_text(template.render(), parse_mode='HTML')
+            return
         
-        # Удаляем сообщение о загрузке
-        await processing_msg.delete()
+        entry_id = new_entry_id()
+        accepted = False
+        try:
+            session = await self.user_sessions.get(user_id) or {}
+            session['last_task_id'] = task_id
+            session['last_submitted_at'] = datetime.now().isoformat()
+            await self.user_sessions.set(user_id, session)
+            
+            # Сначала журнал: принятое задание переживет рестарт бота
+            extra = {'upload_id': upload_id} if attachment is not None else {}
+            await self.journal.accept(entry_id, 'bot', user_id, task_id, user_answer, **extra)
+            accepted = True
+            
+            # Отправляем подтверждение получения (низкий приоритет)
+            processing_msg = await update.get_bot().send_message(
+                chat_id=update.effective_chat.id,
+                text=message_templates.PROCESSING.render(),
+                parse_mode='HTML',
+                rate_limit_args={'priority': PRIORITY_NOTICE}
+            )
+            await self.journal.message(entry_id, processing_msg.chat_id, processing_msg.message_id)
+        except BaseException as e:
+            self.dedup.release(dedup_key, error=e)
+            if accepted:
+                # Пользователь получил ошибку, а не "Проверяем": после рестарта
+                # задание не доигрывается, повторная отправка пройдет заново
+                await self.journal.done(entry_id, 'failed')
+            raise
         
-        # Отправляем результат
-        await self.send_homework_result(update, user_answer)
+        submission = Submission(
+            user_id=user_id,
+            task_id=task_id,
+            user_answer=user_answer,
+            context={'journal_id': entry_id, 'dedup_key': dedup_key},
+            attachment=attachment,
+        )
+        await self._enqueue_homework(update, processing_msg, submission)
 
-    async def send_homework_result(self, update: Update, user_answer: str):
-        """Отправка результата проверки задания"""
-        # Имитация результата проверки
-        score = 85
+    async def _enqueue_homework(self, update: Optional[Update], processing_msg, submission: Submission):
+        """Постановка задания в очередь проверки, обработчик не ждет результата"""
+        editor = self._make_editor(processing_msg)
+        try:
+            position = self.grading_queue.submit(
+                submission,
+                on_result=partial(self._deliver_homework_result, update, processing_msg, editor),
+                on_position=partial(self._notify_queue_position, processing_msg),
+                on_progress=editor.update,
+            )
+        except QueueFullError as e:
+            logger.warning(f"Задание пользователя {submission.user_id} отклонено: {e}")
+            self._release_submission(submission, e)
+            await self.journal.done(submission.context['journal_id'], 'rejected')
+            await self._edit_processing_msg(
+                processing_msg,
+                message_templates.QUEUE_FULL.render(),
+                PRIORITY_RESULT
+            )
+            return
         
-        result_text = f"""
-🎉 <b>Задание проверено!</b>
+        if position > self.grading_queue.idle_workers:
+            await self._notify_queue_position(processing_msg, position)
 
-🎯 <b>Оценка: {score}/100</b>
+    def _make_editor(self, processing_msg) -> ProgressiveEditor:
+        return ProgressiveEditor(
+            partial(self._show_feedback_progress, processing_msg),
+            min_interval=FEEDBACK_EDIT_INTERVAL,
+        )
 
-<b>📝 Ваш ответ:</b>
-<i>{user_answer[:200]}...</i>
+    async def _replay_journal(self, bot, pending: List[JournalEntry]):
+        """Доигрывание заданий, не завершенных до рестарта"""
+        replayed = 0
+        for entry in pending:
+            if entry.source != 'bot':
+                continue
+            submission = Submission(
+                user_id=entry.user_id,
+                task_id=entry.task_id,
+                user_answer=entry.answer,
+                context={
+                    'journal_id': entry.id,
+                    'dedup_key': journal_key(entry),
+                    'graded': entry.result is not None,
+                },
+                attachment=self.uploads.get(entry.extra.get('upload_id')),
+            )
+            try:
+                processing_msg = await self._restore_processing_msg(bot, entry)
+                if entry.result is not None:
+                    # Проверено, но не доставлено: повторно не проверяем
+                    await self._deliver_homework_result(
+                        None, processing_msg, self._make_editor(processing_msg),
+                        submission, GradingResult(**entry.result), None,
+                    )
+                else:
+                    await self._enqueue_homework(None, processing_msg, submission)
+                replayed += 1
+            except Exception as e:
+                self.dedup.release(submission.context['dedup_key'], error=e)
+                logger.error(f"Не удалось восстановить задание {entry.id} из журнала: {e}")
+        logger.info(f"📒 Восстановлено из журнала заданий: {replayed}")
 
-<b>✅ Обратная связь:</b>
-Отличная работа! Вы правильно определили основные метрики для когортного анализа. 
+    async def _restore_processing_msg(self, bot, entry: JournalEntry):
+        """Сообщение о проверке из журнала или новое, если его не успели отправить"""
+        if entry.message_id is not None:
+            message = Message(
+                message_id=entry.message_id,
+                date=datetime.now(),
+                chat=Chat(id=entry.chat_id, type=Chat.PRIVATE),
+            )
+            message.set_bot(bot)
+            return message
+        # WebApp-данные приходят из личного чата: chat_id совпадает с user_id
+        message = await bot.send_message(
+            chat_id=entry.user_id,
+            text=message_templates.PROCESSING.render(),
+            parse_mode='HTML',
+            rate_limit_args={'priority': PRIORITY_NOTICE}
+        )
+        await self.journal.message(entry.id, message.chat_id, message.message_id)
+        return message
 
-<b>💡 Рекомендации:</b>
-• Добавьте анализ Retention Rate по месяцам
-• Используйте визуализацию для наглядности
-• Попробуйте сегментировать клиентов по LTV
+    async def _edit_processing_msg(self, processing_msg, text: str, priority: int, reply_markup=None):
+        """Редактирование сообщения о проверке через планировщик.
 
-<b>🏆 Достижение разблокировано:</b>
-"Первое задание" - вы успешно сдали свою первую домашнюю работу!
+        Все правки одного сообщения склеиваются: еще не отправленное
+        "Вы #N в очереди" заменяется более свежей правкой или результатом.
         """
+        await processing_msg.get_bot().edit_message_text(
+            chat_id=processing_msg.chat_id,
+            message_id=processing_msg.message_id,
+            text=text,
+            parse_mode='HTML',
+            reply_markup=reply_markup,
+            rate_limit_args={
+                'priority': priority,
+                'coalesce_key': ('processing', processing_msg.chat_id, processing_msg.message_id),
+            }
+        )
+
+    async def _notify_queue_position(self, processing_msg, position: int):
+        """Обновление сообщения о позиции в очереди проверки"""
+        await self._edit_processing_msg(
+            processing_msg,
+            message_templates.QUEUE_POSITION.render(position=position),
+            PRIORITY_NOTICE
+        )
+
+    async def _show_feedback_progress(self, processing_msg, text: str):
+        """Промежуточный отзыв, пока проверяющий еще пишет"""
+        await self._edit_processing_msg(
+            processing_msg,
+            message_templates.render_feedback_progress(text),
+            PRIORITY_NORMAL
+        )
+
+    async def _deliver_homework_result(
+        self,
+        update: Optional[Update],
+        processing_msg,
+        editor: ProgressiveEditor,
+        submission: Submission,
+        result: Optional[GradingResult],
+        error: Optional[BaseException],
+    ):
+        """Доставка результата проверки из воркера очереди"""
+        entry_id = submission.context['journal_id']
         
-        keyboard = [
-            [
-                InlineKeyboardButton("📊 Следующее задание", callback_data="next_task"),
-                InlineKeyboardButton("🔄 Попробовать снова", callback_data="retry")
-            ],
-            [InlineKeyboardButton(
-                "🏠 В главное меню", 
-                web_app=WebAppInfo(url=MINI_APP_URL)
-            )]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        # Ключ повтора освобождается при любом исходе, в том числе при отмене
+        try:
+            # Промежуточные правки не должны перезаписать итог
+            await editor.close()
+            
+            if error is None:
+                # Оценка в журнале до отправки: после рестарта задание не проверяется заново
+                if not submission.context.get('graded'):
+                    await self.journal.graded(entry_id, asdict(result))
+                # Ключ - id в журнале: при доигрывании уже учтенная сдача не считается дважды
+                await self.user_stats.record(
+                    submission.user_id, submission.task_id, result.score, submission_id=entry_id,
+                )
+                
+                # Превращаем сообщение о загрузке в результат (вместо delete + send)
+                await self.send_homework_result(update, answer_preview(submission), result, processing_msg)
+                await self.journal.done(entry_id)
+        except BaseException as e:
+            self._release_submission(submission, e)
+            raise
+        
+        if error is not None:
+            # После ошибки то же задание можно отправить снова
+            self._release_submission(submission, error)
+            await self._edit_processing_msg(
+                processing_msg,
+                message_templates.GRADING_FAILED.render(),
+                PRIORITY_RESULT
+            )
+            await self.journal.done(entry_id, 'failed')
+            return
+        self._release_submission(submission)
+
+    def _release_submission(self, submission: Submission, error: Optional[BaseException] = None):
+        dedup_key = submission.context.get('dedup_key')
+        if dedup_key is not None:
+            self.dedup.release(dedup_key, error=error)
+
+    async def send_homework_result(
+        self,
+        update: Update,
+        user_answer: str,
+        result: GradingResult,
+        processing_msg=None,
+    ):
+        """Отправка результата проверки задания"""
+        result_text = message_templates.render_homework_result(
+            result.score,
+            user_answer,
+            result.feedback,
+            result.recommendations,
+            result.achievement,
+        )
+        reply_markup = keyboards.homework_result(MINI_APP_URL)
+        
+        if processing_msg is not None:
+            await self._edit_processing_msg(processing_msg, result_text, PRIORITY_RESULT, reply_markup)
+            return
         
         await update.message.reply_text(
             result_text,
@@ -302,14 +883,7 @@ class TrainingBot:
         text = update.message.text
         
         if text == "📊 Мои результаты":
-            await update.message.reply_text(
-                "📊 <b>Ваша статистика:</b>\n\n"
-                "Выполнено заданий: 0\n"
-                "Средний балл: -\n"
-                "Лучший результат: -\n\n"
-                "Начните с первого задания в тренажере!",
-                parse_mode='HTML'
-            )
+            await self.send_user_stats(update)
         elif text == "❓ Помощь":
             await self.help_command(update, context)
         else:
@@ -317,87 +891,155 @@ class TrainingBot:
                 "Используйте кнопки меню для навигации или нажмите /help для справки"
             )
 
+    async def send_user_stats(self, update: Update):
+        """Статистика пользователя из готовых агрегатов"""
+        stats = await self.user_stats.get(update.effective_user.id)
+        if stats is None or not stats.submissions:
+            text = message_templates.STATS_EMPTY.render()
+        else:
+            text = message_templates.STATS.render(
+                tasks_done=stats.tasks_done,
+                mean_score=f"{stats.mean_score:.0f}",
+                best_score=stats.best_score,
+                streak=stats.current_streak(day_of()),
+            )
+        await update.message.reply_text(text, parse_mode='HTML')
+
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Команда помощи"""
-        help_text = """
-❓ <b>Помощь по AI Тренажеру</b>
-
-<b>Основные команды:</b>
-/start - Главное меню
-/help - Эта справка
-
-<b>Как пользоваться:</b>
-1. Нажмите "🚀 Открыть тренажер"
-2. Выберите задание
-3. Изучите материалы
-4. Выполните задание
-5. Нажмите "Сдать домашку"
-
-<b>Важно:</b>
-• Приложение работает прямо в Telegram
-• Все данные сохраняются автоматически
-• Можно вернуться к заданию в любой момент
-
-<b>Проблемы?</b>
-Напишите @your_support_bot
-        """
-        
-        await update.message.reply_text(help_text, parse_mode='HTML')
+        await update.message.reply_text(message_templates.HELP.render(), parse_mode='HTML')
 
     async def handle_callback_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка inline кнопок"""
         query = update.callback_query
-        await query.answer()
         
-        if query.data == "next_task":
-            await query.edit_message_text(
-                "🚀 Следующее задание будет доступно скоро!",
-                reply_markup=None
-            )
-        elif query.data == "retry":
-            keyboard = [[InlineKeyboardButton(
-                "🔄 Открыть задание", 
-                web_app=WebAppInfo(url=f"{MINI_APP_URL}/tasks/data-analysis/cohort-analysis-sql")
-            )]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+        # Двойное нажатие той же кнопки: у нажатий разные id, ключ - сообщение и
+        # данные кнопки. Второе нажатие только гасит "часики" на кнопке
+        tap_key = ('tap', query.from_user.id, query.inline_message_id or query.message.message_id, query.data)
+        if self.dedup.claim(tap_key) is not None:
+            await query.answer()
+            return
+        
+        try:
+            await query.answer()
             
-            await query.edit_message_text(
-                "Попробуйте выполнить задание еще раз!",
-                reply_markup=reply_markup
-            )
+            if query.data == "next_task":
+                await query.edit_message_text(
+                    "🚀 Следующее задание будет доступно скоро!",
+                    reply_markup=None
+                )
+            elif query.data == "retry":
+                await query.edit_message_text(
+                    "Попробуйте выполнить задание еще раз!",
+                    reply_markup=keyboards.retry_task(f"{MINI_APP_URL}/tasks/data-analysis/cohort-analysis-sql")
+                )
+        except BaseException as e:
+            self.dedup.release(tap_key, error=e)
+            raise
+        self.dedup.release(tap_key)
 
-def main():
-    """Запуск бота"""
-    # Создаем приложение
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-    
-    # Создаем экземпляр бота
-    bot = TrainingBot()
+    async def drop_duplicate_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Апдейт, доставленный повторно (в том числе нажатие с тем же id), дальше не идет"""
+        if self.dedup.seen(('update', update.update_id)):
+            raise ApplicationHandlerStop
+
+def allowed_updates_for(application: Application) -> List[str]:
+    """Типы апдейтов, которые реально обрабатывают зарегистрированные хендлеры"""
+    allowed = set()
+    for group in application.handlers.values():
+        for handler in group:
+            update_types = None
+            for handler_class, types in HANDLER_UPDATE_TYPES:
+                if isinstance(handler, handler_class):
+                    update_types = types
+                    break
+            if update_types is None:
+                # Неизвестный хендлер - не рискуем потерять апдейты
+                return Update.ALL_TYPES
+            allowed.update(update_types)
+    return sorted(allowed)
+
+def build_application(bot: TrainingBot, concurrent_updates=None) -> Application:
+    """Сборка приложения с зарегистрированными обработчиками.
+
+    concurrent_updates - число или BaseUpdateProcessor (по умолчанию BOT_CONCURRENT_UPDATES).
+    """
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(BOT_CONCURRENT_UPDATES if concurrent_updates is None else concurrent_updates)
+        .rate_limiter(SchedulerRateLimiter(bot.send_scheduler))
+        .post_init(bot.post_init)
+        .post_stop(bot.post_stop)
+    )
+    if BOT_API_BASE_URL:
+        # Например, локальный fake_bot_api.py для нагрузочных тестов
+        builder = builder.base_url(f"{BOT_API_BASE_URL.rstrip('/')}/bot")
+    application = builder.build()
     
     # Регистрируем обработчики
-    application.add_handler(CommandHandler("start", bot.start_command))
-    application.add_handler(CommandHandler("help", bot.help_command))
+    # Группа -1 выполняется раньше остальных хендлеров
+    application.add_handler(TypeHandler(Update, bot.drop_duplicate_update), group=-1)
+    application.add_handler(CommandHandler("start", _instrumented('start', bot.start_command)))
+    application.add_handler(CommandHandler("help", _instrumented('help', bot.help_command)))
     
     # КРИТИЧЕСКИ ВАЖНО: Обработчик данных от WebApp
     application.add_handler(MessageHandler(
         filters.StatusUpdate.WEB_APP_DATA, 
-        bot.handle_web_app_data
+        _instrumented('web_app_data', bot.handle_web_app_data)
     ))
     
     # Обработчик обычных текстовых сообщений
     application.add_handler(MessageHandler(
         filters.TEXT & ~filters.COMMAND, 
-        bot.handle_text_message
+        _instrumented('text', bot.handle_text_message)
     ))
     
     # Обработчик callback кнопок
-    application.add_handler(CallbackQueryHandler(bot.handle_callback_query))
+    application.add_handler(CallbackQueryHandler(_instrumented('callback_query', bot.handle_callback_query)))
+    
+    return application
+
+def main():
+    """Запуск бота"""
+    parser = argparse.ArgumentParser(description='AI Тренажер - Telegram бот')
+    parser.add_argument('--mode', choices=['polling', 'webhook'], default=BOT_MODE)
+    parser.add_argument('--workers', type=int, default=BOT_WORKERS,
+                        help='больше 1 - фронт-процесс и воркеры с шардированием по user_id')
+    args = parser.parse_args()
+    
+    if args.workers > 1:
+        import bot_cluster
+        
+        bot_cluster.serve(args.workers, args.mode)
+        return
+    
+    # Создаем экземпляр бота и приложение
+    bot = TrainingBot()
+    application = build_application(bot)
+    allowed_updates = allowed_updates_for(application)
+    startup.mark('сборка приложения')
     
     # Запускаем бота
     logger.info("🚀 Бот запущен и готов к работе!")
     logger.info("📱 Ожидаем данные от WebApp через KeyboardButton")
+    logger.info(f"📬 Режим: {args.mode}, апдейты: {', '.join(allowed_updates)}, "
+                f"параллельно: {BOT_CONCURRENT_UPDATES}")
     
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if args.mode == 'webhook':
+        if not WEBHOOK_URL:
+            logger.error("❌ WEBHOOK_URL не установлен!")
+            sys.exit(1)
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=allowed_updates,
+        )
+    else:
+        application.run_polling(allowed_updates=allowed_updates)
 
 if __name__ == '__main__':
     main()
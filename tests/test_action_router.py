@@ -0,0 +1,78 @@
+# tests/test_action_router.py - Маршрутизация действий WebApp
+import asyncio
+import json
+
+import pytest
+
+from action_router import ActionRouter, Field, PayloadError, TruncatedPayload, UnknownActionError
+
+
+def make_router(max_payload_bytes=4096):
+    router = ActionRouter(max_payload_bytes)
+    calls = []
+
+    async def submit(user, data):
+        calls.append((user, data))
+        return 'submitted'
+
+    router.register('submit_homework', submit, {
+        'task_id': Field(str, required=True, max_length=16),
+        'user_answer': Field(str, default=''),
+    })
+    return router, calls
+
+
+def test_dispatch_calls_handler_with_validated_data():
+    router, calls = make_router()
+    raw = json.dumps({'action': 'submit_homework', 'task_id': 'hw1'})
+    assert asyncio.run(router.dispatch(raw, 'user')) == 'submitted'
+    assert calls == [('user', {'action': 'submit_homework', 'task_id': 'hw1', 'user_answer': ''})]
+
+
+def test_schema_errors():
+    router, _ = make_router()
+    with pytest.raises(PayloadError, match='task_id'):
+        router.parse(json.dumps({'action': 'submit_homework'}))
+    with pytest.raises(PayloadError, match='str'):
+        router.parse(json.dumps({'action': 'submit_homework', 'task_id': 5}))
+    with pytest.raises(PayloadError, match='16'):
+        router.parse(json.dumps({'action': 'submit_homework', 'task_id': 'x' * 17}))
+
+
+def test_unknown_action():
+    router, _ = make_router()
+    with pytest.raises(UnknownActionError) as info:
+        router.parse(json.dumps({'action': 'drop_tables'}))
+    assert info.value.action == 'drop_tables'
+    assert 'drop_tables' in info.value.user_message
+    with pytest.raises(UnknownActionError):
+        router.parse(json.dumps({'task_id': 'hw1'}))
+
+
+def test_rejects_oversize_and_non_objects():
+    router, _ = make_router(max_payload_bytes=64)
+    with pytest.raises(PayloadError, match='64'):
+        router.parse(json.dumps({'action': 'submit_homework', 'task_id': 'hw1', 'user_answer': 'x' * 64}))
+    # Кириллица: символов меньше лимита, байт - больше
+    with pytest.raises(PayloadError, match='64'):
+        router.parse(json.dumps({'action': 'submit_homework', 'user_answer': 'ж' * 20}, ensure_ascii=False))
+    with pytest.raises(PayloadError, match='JSON-объектом'):
+        router.parse('["submit_homework"]')
+    with pytest.raises(PayloadError, match='JSON'):
+        router.parse('{"action": "submit_homework",')
+
+
+def test_prescan_does_not_reject_real_action():
+    router, _ = make_router()
+    # Ключ "action" во вложенном объекте до настоящего
+    nested = json.dumps({'meta': {'action': 'other'}, 'action': 'submit_homework', 'task_id': 'hw1'})
+    assert router.parse(nested)[1]['task_id'] == 'hw1'
+    # Настоящий ключ записан через \uXXXX
+    escaped = '{"\\u0061ction": "submit_homework", "task_id": "hw1", "note": "\\"action\\": \\"x\\""}'
+    assert router.parse(escaped)[1]['action'] == 'submit_homework'
+
+
+def test_truncated_payload_for_logs():
+    assert str(TruncatedPayload('short')) == 'short'
+    text = str(TruncatedPayload('x' * 500, limit=10))
+    assert text.startswith('x' * 10 + '...') and '500' in text
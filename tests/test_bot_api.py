@@ -0,0 +1,131 @@
+# tests/test_bot_api.py - Клиент Bot API и планировщик отправки на фейковом Bot API
+import asyncio
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+
+from aiohttp import web  # noqa: E402
+
+from bot_api import AsyncBotApiClient, BotApiError, _retry_delay, _should_retry, is_idempotent  # noqa: E402
+from fake_bot_api import FakeBotApi  # noqa: E402
+from send_scheduler import SendScheduler  # noqa: E402
+
+TOKEN = '123456:TEST-TOKEN'
+
+
+def test_retry_rules():
+    assert is_idempotent('editMessageText') and is_idempotent('getUpdates')
+    assert not is_idempotent('sendMessage') and not is_idempotent('copyMessage')
+    # 429 - запрос не выполнен, повтор безопасен для любого метода
+    assert _should_retry('sendMessage', 429)
+    assert not _should_retry('sendMessage', 502)
+    assert _should_retry('editMessageText', 502)
+    assert not _should_retry('editMessageText', 400)
+
+
+def test_retry_delay_honours_retry_after():
+    assert _retry_delay(3, {'parameters': {'retry_after': 7}}, backoff=0.5) == 7.0
+    for attempt in range(4):
+        delay = _retry_delay(attempt, None, backoff=0.5)
+        assert 0.25 * 2 ** attempt <= delay <= 0.5 * 2 ** attempt
+
+
+def test_client_retries_rate_limited_calls():
+    async def scenario():
+        fake = FakeBotApi(rate_limit_every=2, retry_after=0)
+        url = await fake.start()
+        client = AsyncBotApiClient(TOKEN, base_url=url, backoff=0.01)
+        try:
+            for i in range(3):
+                message = await client.call('sendMessage', chat_id=1, text=f"m{i}")
+                assert message['text'] == f"m{i}"
+        finally:
+            await client.close()
+            await fake.stop()
+        # Каждый второй ответ - 429: m1 и m2 ушли со второй попытки
+        assert fake.rate_limited == 2
+        assert fake.method_counts['sendMessage'] == 3
+
+    asyncio.run(scenario())
+
+
+def test_client_does_not_repeat_send_on_server_error():
+    async def scenario():
+        hits = []
+
+        async def handle(request):
+            hits.append(request.match_info['method'])
+            return web.json_response({'ok': False, 'error_code': 502, 'description': 'Bad Gateway'}, status=502)
+
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        client = AsyncBotApiClient(TOKEN, base_url=f"http://127.0.0.1:{port}", max_retries=2, backoff=0.01)
+        try:
+            with pytest.raises(BotApiError) as info:
+                await client.call('sendMessage', chat_id=1, text='hi')
+            assert info.value.status == 502
+            # Сообщение могло дойти: повтор отправил бы его дважды
+            assert hits == ['sendMessage']
+            with pytest.raises(BotApiError):
+                await client.call('editMessageText', chat_id=1, message_id=1, text='hi')
+            assert hits.count('editMessageText') == 3
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+
+def test_scheduler_coalesces_edits_of_one_message():
+    async def scenario():
+        fake = FakeBotApi()
+        url = await fake.start()
+        scheduler = SendScheduler(chat_rate=5, chat_burst=1)
+        await scheduler.start()
+        client = AsyncBotApiClient(TOKEN, base_url=url, scheduler=scheduler)
+        try:
+            await client.call('sendMessage', chat_id=1, text='Проверяем...')
+            edits = [
+                client.call('editMessageText', chat_id=1, message_id=1, text=f"Позиция {n}",
+                            coalesce_key=('progress', 1))
+                for n in (3, 2, 1)
+            ]
+            results = await asyncio.gather(*edits)
+        finally:
+            await scheduler.stop()
+            await client.close()
+            await fake.stop()
+        # Уходит только последняя версия, ее ответ получают все вызовы
+        assert fake.method_counts['editMessageText'] == 1
+        assert [r['text'] for r in results] == ['Позиция 1'] * 3
+        assert scheduler.coalesced == 2
+
+    asyncio.run(scenario())
+
+
+def test_scheduler_retries_rate_limited_send():
+    async def scenario():
+        fake = FakeBotApi(rate_limit_every=2, retry_after=0)
+        url = await fake.start()
+        scheduler = SendScheduler(chat_rate=None)
+        await scheduler.start()
+        client = AsyncBotApiClient(TOKEN, base_url=url, scheduler=scheduler)
+        try:
+            await client.call('sendMessage', chat_id=1, text='first')
+            # Второй ответ - 429: повтор делает планировщик, а не клиент
+            message = await client.call('sendMessage', chat_id=1, text='hi')
+        finally:
+            await scheduler.stop()
+            await client.close()
+            await fake.stop()
+        assert message['text'] == 'hi'
+        assert fake.rate_limited == 1 and scheduler.rate_limited == 1
+        assert fake.method_counts['sendMessage'] == 2
+
+    asyncio.run(scenario())
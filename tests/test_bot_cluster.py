@@ -0,0 +1,168 @@
+# tests/test_bot_cluster.py - Маршрутизация апдейтов по воркерам кластера
+import asyncio
+import json
+import os
+
+import pytest
+
+pytest.importorskip('telegram')
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:TEST-TOKEN')
+
+from telegram import Bot, Update  # noqa: E402
+
+from bot_cluster import ClusterFront, HashRing, PerChatUpdateProcessor, _WorkerLink, routing_key  # noqa: E402
+from fake_bot_api import make_message_update  # noqa: E402
+
+
+class FakeWriter:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, line: bytes):
+        self.lines.append(json.loads(line))
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def make_front(workers: int) -> ClusterFront:
+    """Фронт без процессов: у каждого воркера - запоминающий сокет"""
+    front = ClusterFront(workers, socket_dir='unused')
+    front._acked = asyncio.Event()
+    for index in range(workers):
+        front._links[index] = _WorkerLink(index, process=None, writer=FakeWriter())
+    return front
+
+
+def user_moving(old: HashRing, new: HashRing) -> int:
+    return next(user_id for user_id in range(1, 10_000) if old.owner(user_id) != new.owner(user_id))
+
+
+def test_routing_key_prefers_user_then_chat_then_update_id():
+    message = make_message_update(1, 42, '/start')
+    assert routing_key(message) == 42
+    assert routing_key({'update_id': 2, 'callback_query': {'id': 'q', 'from': {'id': 7}, 'data': 'x'}}) == 7
+    assert routing_key({'update_id': 3, 'channel_post': {'message_id': 1, 'chat': {'id': -100}}}) == -100
+    assert routing_key({'update_id': 4}) == 4
+
+
+def test_routing_key_matches_processor_key_for_parsed_update():
+    raw = make_message_update(5, 42, 'ответ')
+    update = Update.de_json(raw, Bot('123456:TEST-TOKEN'))
+
+    assert routing_key(raw) == PerChatUpdateProcessor.key_for(update)
+
+
+def test_hash_ring_moves_about_one_nth_of_users():
+    three, four = HashRing(3), HashRing(4)
+    users = range(1, 20_001)
+
+    moved = [user_id for user_id in users if three.owner(user_id) != four.owner(user_id)]
+
+    assert {three.owner(user_id) for user_id in users} == {0, 1, 2}
+    assert all(four.owner(user_id) == 3 for user_id in moved)
+    assert 0.15 < len(moved) / len(users) < 0.35
+    assert [HashRing(3).owner(user_id) for user_id in range(100)] == [three.owner(user_id) for user_id in range(100)]
+
+
+def test_processor_keeps_order_per_user_and_overlaps_users():
+    async def run():
+        processor = PerChatUpdateProcessor(4)
+        bot = Bot('123456:TEST-TOKEN')
+        events = []
+        first_user_started = asyncio.Event()
+
+        async def handle(name, delay):
+            events.append(('start', name))
+            if name == 'a1':
+                first_user_started.set()
+            await asyncio.sleep(delay)
+            events.append(('end', name))
+
+        def update(update_id, user_id):
+            return Update.de_json(make_message_update(update_id, user_id, 'x'), bot)
+
+        await asyncio.gather(
+            processor.process_update(update(1, 1), handle('a1', 0.05)),
+            processor.process_update(update(2, 1), handle('a2', 0)),
+            processor.process_update(update(3, 2), handle('b1', 0)),
+        )
+        return events, processor.active_keys()
+
+    events, active = asyncio.run(run())
+
+    assert events.index(('end', 'a1')) < events.index(('start', 'a2'))
+    # Другой пользователь не ждет медленный апдейт первого
+    assert events.index(('end', 'b1')) < events.index(('end', 'a1'))
+    assert active == []
+
+
+def test_route_holds_moving_users_until_handoff_done():
+    async def run():
+        front = make_front(4)
+        old_ring, new_ring = HashRing(3), HashRing(4)
+        user_id = user_moving(old_ring, new_ring)
+        previous, owner = old_ring.owner(user_id), new_ring.owner(user_id)
+        front._old_ring, front.ring = old_ring, new_ring
+        front._held = {index: [] for index in range(3)}
+
+        front.route(make_message_update(1, user_id, 'во время передачи'))
+        assert front.held == 1
+        assert front._links[owner].writer.lines == []
+
+        handoff = asyncio.create_task(front._handoff(previous, 4))
+        await asyncio.sleep(0)
+        assert front._links[previous].writer.lines[-1] == {'op': 'rebalance', 'workers': 4}
+        # Состояние уходит новому владельцу раньше придержанного апдейта
+        front._send(owner, json.dumps({'op': 'adopt', 'state': {'sessions': {}}}).encode() + b'\n')
+        front._links[previous].handoff.set_result(1)
+        assert await handoff == 1
+        return front._links[owner].writer.lines
+
+    lines = asyncio.run(run())
+
+    assert [line.get('op') for line in lines] == ['adopt', None]
+    assert lines[1]['message']['text'] == 'во время передачи'
+
+
+def test_route_does_not_hold_users_that_stay():
+    front = make_front(4)
+    old_ring, new_ring = HashRing(3), HashRing(4)
+    user_id = next(user_id for user_id in range(1, 10_000) if old_ring.owner(user_id) == new_ring.owner(user_id))
+    front._old_ring, front.ring = old_ring, new_ring
+    front._held = {index: [] for index in range(3)}
+
+    front.route(make_message_update(1, user_id, 'x'))
+
+    assert front.held == 0
+    assert len(front._links[new_ring.owner(user_id)].writer.lines) == 1
+
+
+def test_deliver_waits_for_worker_ack_and_resends_lost_updates():
+    async def run():
+        front = make_front(1)
+        writer = front._links[0].writer
+        updates = [make_message_update(1, 42, 'a'), make_message_update(2, 42, 'b')]
+
+        async def ack(update_id):
+            await asyncio.sleep(0.01)
+            front._unacked.discard(update_id)
+            front._acked.set()
+
+        acked = asyncio.gather(ack(1), ack(2))
+        delivered = await front.deliver(updates, timeout=1)
+        await acked
+        # Второй апдейт воркер не подтвердил: offset не двигается, повтор уходит снова
+        lost = await front.deliver([make_message_update(3, 42, 'c')], timeout=0.01)
+        resent = await front.deliver([make_message_update(3, 42, 'c')], timeout=0.01)
+        return delivered, lost, resent, [line['update_id'] for line in writer.lines], front.redelivered
+
+    delivered, lost, resent, sent, redelivered = asyncio.run(run())
+
+    assert delivered is True
+    assert (lost, resent) == (False, False)
+    assert sent == [1, 2, 3, 3]
+    assert redelivered == 2
@@ -0,0 +1,159 @@
+# tests/test_dedup.py - Идемпотентность отправок и апдейтов
+import asyncio
+import threading
+import time
+
+import pytest
+
+from dedup import Deduplicator, RecentKeys, SharedClaims, SyncDeduplicator, submission_key
+
+
+def test_submission_key_ignores_whitespace_around_answer():
+    assert submission_key(1, 'hw1', 'SELECT 1;') == submission_key(1, 'hw1', '  SELECT 1;\n')
+    assert submission_key(1, 'hw1', 'SELECT 1;') != submission_key(2, 'hw1', 'SELECT 1;')
+
+
+def test_seen_remembers_update_ids():
+    async def scenario():
+        dedup = Deduplicator(window=60)
+        assert dedup.seen(('update', 1)) is False
+        assert dedup.seen(('update', 1)) is True
+        assert dedup.seen(('update', 2)) is False
+
+    asyncio.run(scenario())
+
+
+def test_recent_keys_forget_after_window():
+    now = [0.0]
+    keys = RecentKeys(window=3, capacity=100, clock=lambda: now[0])
+    keys.add('a')
+    now[0] = 2.5
+    assert 'a' in keys
+    now[0] = 10.0
+    assert 'a' not in keys
+
+
+def test_duplicate_joins_running_work():
+    async def scenario():
+        dedup = Deduplicator(window=60)
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return 'graded'
+
+        first, second = await asyncio.gather(dedup.once('k', work), dedup.once('k', work))
+        assert calls == 1
+        assert first == ('graded', False)
+        assert second == ('graded', True)
+        assert dedup.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_done_window_lets_resubmission_through():
+    async def scenario():
+        dedup = Deduplicator(window=60, done_window=0.2)
+        dedup.claim('k')
+        dedup.release('k', 'ok')
+        # Сразу после завершения повтор отклоняется, результат не хранится
+        future = dedup.claim('k')
+        assert future is not None and future.result() is None
+        await asyncio.sleep(0.5)
+        assert dedup.claim('k') is None
+
+    asyncio.run(scenario())
+
+
+def test_failed_work_is_not_remembered():
+    async def scenario():
+        dedup = Deduplicator(window=60)
+
+        async def broken():
+            await asyncio.sleep(0.01)
+            raise RuntimeError('grader down')
+
+        with pytest.raises(RuntimeError):
+            await dedup.once('k', broken)
+
+        async def fixed():
+            return 'ok'
+
+        assert await dedup.once('k', fixed) == ('ok', False)
+
+    asyncio.run(scenario())
+
+
+def test_duplicate_gets_error_of_running_work():
+    async def scenario():
+        dedup = Deduplicator(window=60)
+        started = asyncio.Event()
+
+        async def broken():
+            started.set()
+            await asyncio.sleep(0.05)
+            raise RuntimeError('grader down')
+
+        first = asyncio.create_task(dedup.once('k', broken))
+        await started.wait()
+        with pytest.raises(RuntimeError):
+            await dedup.once('k', broken)
+        with pytest.raises(RuntimeError):
+            await first
+
+    asyncio.run(scenario())
+
+
+def test_shared_claims_across_processes(tmp_path):
+    path = str(tmp_path / 'claims.sqlite3')
+    first_claims = SharedClaims(path, window=60)
+    second_claims = SharedClaims(path, window=60)
+
+    async def scenario():
+        first = Deduplicator(window=60, shared=first_claims)
+        second = Deduplicator(window=60, shared=second_claims)
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            return 'graded'
+
+        assert await first.once('k', work) == ('graded', False)
+        # Другой процесс знает только, что работа сделана
+        assert await second.once('k', work) == (None, True)
+        assert calls == 1
+
+        async def broken():
+            raise RuntimeError('grader down')
+
+        with pytest.raises(RuntimeError):
+            await first.once('other', broken)
+        assert await second.once('other', work) == ('graded', False)
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        first_claims.close()
+        second_claims.close()
+
+
+def test_sync_deduplicator_joins_threads():
+    dedup = SyncDeduplicator(window=60)
+    started = threading.Event()
+    results = []
+
+    def work():
+        started.set()
+        time.sleep(0.1)
+        return 'graded'
+
+    thread = threading.Thread(target=lambda: results.append(dedup.once('k', work)))
+    thread.start()
+    started.wait()
+    duplicate = dedup.once('k', work, timeout=5)
+    thread.join()
+    assert results == [('graded', False)]
+    assert duplicate == ('graded', True)
@@ -0,0 +1,153 @@
+# tests/test_grading.py - Очередь проверки и потоковая обратная связь
+import asyncio
+
+import pytest
+
+from grading import (
+    FakeStreamingGrader,
+    GradingQueue,
+    GradingResult,
+    ProgressiveEditor,
+    QueueFullError,
+    Submission,
+    parse_feedback,
+    render_stub_feedback,
+)
+
+
+class GatedGrader:
+    """Проверяющий, который записывает порядок заданий и ждет разрешения"""
+
+    def __init__(self):
+        self.order = []
+        self.gate = asyncio.Event()
+
+    async def grade(self, submission, on_progress=None):
+        self.order.append(submission.task_id)
+        await self.gate.wait()
+        return GradingResult(score=90, feedback='ok')
+
+
+def test_parse_feedback():
+    result = parse_feedback("Оценка: 120/100\nХорошо.\nРекомендации:\n• Добавьте график\n- Проверьте NULL")
+    assert result.score == 100 and result.parsed
+    assert result.feedback == 'Хорошо.'
+    assert result.recommendations == ['Добавьте график', 'Проверьте NULL']
+    assert parse_feedback('Без оценки').parsed is False
+
+
+def test_fake_streaming_grader_reports_growing_text():
+    progress = []
+
+    async def on_progress(text):
+        progress.append(text)
+
+    grader = FakeStreamingGrader(first_token_delay=0, token_delay=0, score=77)
+    result = asyncio.run(grader.grade(Submission(1, 'hw1', 'SELECT 1;'), on_progress))
+    assert result.score == 77 and result.parsed
+    assert len(progress) > 1
+    assert all(later.startswith(earlier) for earlier, later in zip(progress, progress[1:]))
+    assert progress[-1] == render_stub_feedback(77)
+
+
+def test_progressive_editor_throttles_edits():
+    async def scenario():
+        edits = []
+
+        async def edit(text):
+            edits.append(text)
+
+        editor = ProgressiveEditor(edit, min_interval=0.1, min_chars=5)
+        await editor.update('x' * 10)
+        await asyncio.sleep(0.01)
+        # Первая правка уходит сразу
+        assert edits == ['x' * 10]
+
+        for i in range(1, 21):
+            await editor.update('x' * (10 + 5 * i))
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.15)
+        assert 2 <= len(edits) <= 5
+        assert edits[-1] == 'x' * 110
+
+        # Прирост меньше min_chars не стоит отдельной правки
+        await editor.update('x' * 112)
+        await asyncio.sleep(0.15)
+        assert edits[-1] == 'x' * 110
+
+        await editor.close()
+        await editor.update('y' * 200)
+        await asyncio.sleep(0.15)
+        assert edits[-1] == 'x' * 110
+        assert editor.edits == len(edits)
+
+    asyncio.run(scenario())
+
+
+def test_queue_round_robin_between_users():
+    async def scenario():
+        grader = GatedGrader()
+        queue = GradingQueue(grader, workers=1, max_per_user=3, position_interval=60)
+        await queue.start()
+        results = []
+
+        async def on_result(submission, result, error):
+            results.append((submission.task_id, result.score))
+
+        positions = [
+            queue.submit(Submission(1, 'a1', ''), on_result),
+            queue.submit(Submission(1, 'a2', ''), on_result),
+            queue.submit(Submission(1, 'a3', ''), on_result),
+            queue.submit(Submission(2, 'b1', ''), on_result),
+        ]
+        assert positions == [1, 2, 3, 2]
+        with pytest.raises(QueueFullError):
+            queue.submit(Submission(1, 'a4', ''), on_result)
+        assert queue.active_users() == {1, 2}
+
+        grader.gate.set()
+        await queue.stop(timeout=5)
+        # Отправка второго студента не ждет всю пачку первого
+        assert grader.order == ['a1', 'b1', 'a2', 'a3']
+        assert sorted(results) == [('a1', 90), ('a2', 90), ('a3', 90), ('b1', 90)]
+        assert queue.active_users() == set()
+
+    asyncio.run(scenario())
+
+
+def test_queue_reports_changed_positions():
+    async def scenario():
+        grader = GatedGrader()
+        queue = GradingQueue(grader, workers=1, position_interval=0.05)
+        await queue.start()
+        updates = {}
+
+        async def on_result(submission, result, error):
+            pass
+
+        def tracker(task_id):
+            async def on_position(position):
+                updates.setdefault(task_id, []).append(position)
+            return on_position
+
+        queue.submit(Submission(1, 'a1', ''), on_result)
+        await asyncio.sleep(0.01)
+        assert grader.order == ['a1']
+
+        assert queue.submit(Submission(1, 'a2', ''), on_result, tracker('a2')) == 1
+        assert queue.submit(Submission(1, 'a3', ''), on_result, tracker('a3')) == 2
+        assert queue.submit(Submission(2, 'b1', ''), on_result, tracker('b1')) == 2
+        await asyncio.sleep(0.15)
+        # b1 встал в круг раньше a3: a3 сдвинулся на третье место
+        assert updates == {'a3': [3]}
+
+        grader.gate.set()
+        await queue.stop(timeout=5)
+
+    asyncio.run(scenario())
+
+
+def test_submit_requires_started_queue():
+    queue = GradingQueue(GatedGrader())
+    with pytest.raises(RuntimeError):
+        queue.submit(Submission(1, 'a1', ''), None)
@@ -0,0 +1,68 @@
+# tests/test_materials_catalog.py - Сборка каталога материалов из выгрузки и учебного плана
+import csv
+import os
+
+from materials_catalog import MaterialsCatalog, MaterialsSource
+
+COURSE_PLAN = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'tmp', 'course.csv')
+
+
+def write_table(directory, name, rows):
+    with open(directory / f"{name}.csv", 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_export(directory):
+    write_table(directory, 'courses', [{'id': 'c1', 'slug': 'vibe', 'updated_at': '2026-01-01'}])
+    write_table(directory, 'course_modules', [
+        {'id': 'm-uuid-1', 'course_id': 'c1', 'title': 'Модуль 1. Что такое вайб-кодинг',
+         'order_index': 1, 'updated_at': '2026-01-02'},
+    ])
+    write_table(directory, 'course_lessons', [
+        {'id': 'l1', 'module_id': 'm-uuid-1', 'trainer_assignment_id': 'a1', 'updated_at': '2026-01-03'},
+    ])
+    write_table(directory, 'assignments', [
+        {'id': 'a1', 'task_id': 'document-analysis', 'title': 'Анализ объемного документа', 'updated_at': '2026-01-01'},
+        {'id': 'a2', 'task_id': 'client-response', 'title': 'Ответ клиенту', 'updated_at': '2026-01-01'},
+        {'id': 'a3', 'task_id': '', 'title': 'Без ключа', 'updated_at': '2026-01-01'},
+    ])
+    # Документы задания - по documents.task_type = assignments.task_id
+    write_table(directory, 'documents', [
+        {'id': 'd2', 'task_type': 'document-analysis', 'file_path': 'marketing.pdf',
+         'description': 'Маркетинговое исследование', 'created_at': '2025-08-26', 'updated_at': '2025-08-26'},
+        {'id': 'd1', 'task_type': 'document-analysis', 'file_path': 'quarterly-report.pdf',
+         'description': 'Квартальный отчет', 'created_at': '2025-08-25', 'updated_at': '2025-08-25'},
+    ])
+
+
+def load(tmp_path):
+    write_export(tmp_path)
+    source = MaterialsSource(str(tmp_path), COURSE_PLAN, storage_url='https://db.example', app_url='https://app.example')
+    return MaterialsCatalog(*source.load())
+
+
+def test_documents_join_on_assignment_task_id(tmp_path):
+    catalog = load(tmp_path)
+
+    material = catalog.get('document-analysis')
+    assert material.table_filename == 'quarterly-report.pdf'
+    assert material.table_url == 'https://db.example/storage/v1/object/public/documents/quarterly-report.pdf'
+    assert material.course_url == 'https://app.example/course/vibe/lesson/l1'
+    assert catalog.get('client-response').table_url is None
+    assert len(catalog) == 2
+
+
+def test_exported_module_shares_key_with_course_plan(tmp_path):
+    catalog = load(tmp_path)
+
+    assert catalog.by_lesson('l1').task_id == 'document-analysis'
+    assert [material.task_id for material in catalog.by_module('module-1')] == ['document-analysis']
+    module = catalog.module('module-1')
+    assert module.course_id == 'c1'
+    assert module.week.startswith('Неделя 1')
+    assert module.homework
+    # Модули плана без строки в выгрузке тоже есть, варианты - отдельными ключами
+    assert catalog.module('module-7-2').title.startswith('Модуль 7. Вариант 2')
+    assert len([m for m in catalog.modules if m.module_id == 'module-1']) == 1
@@ -0,0 +1,38 @@
+# tests/test_message_templates.py - Длина сообщений с экранированным текстом
+from message_templates import (
+    MAX_MESSAGE_LENGTH,
+    escaped_head,
+    escaped_tail,
+    render_feedback_progress,
+    render_homework_result,
+)
+
+
+def test_progress_fits_after_escaping():
+    text = render_feedback_progress('SELECT a FROM t WHERE a < 1 & b > 2;\n' * 200)
+
+    assert len(text) <= MAX_MESSAGE_LENGTH
+    assert text.endswith('b &gt; 2;\n ▌')
+
+
+def test_tail_and_head_do_not_split_entities():
+    assert escaped_tail('a<b', 5) == '&lt;b'
+    assert escaped_tail('a<b', 4) == 'b'
+    assert escaped_head('a<b', 5) == 'a…'
+    assert escaped_head('a<b', 6) == 'a&lt;b'
+
+
+def test_long_result_is_cut_to_message_limit():
+    feedback = 'Запрос < ожидаемого & ' * 400
+    text = render_homework_result(70, 'ответ', feedback, ['первое', 'второе'])
+
+    assert len(text) <= MAX_MESSAGE_LENGTH
+    assert '…' in text
+    assert '• второе' in text
+
+
+def test_short_result_is_unchanged():
+    text = render_homework_result(90, 'ответ', 'Хорошо <3', ['Проверьте NULL'])
+
+    assert 'Хорошо &lt;3' in text
+    assert '…' not in text
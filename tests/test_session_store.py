@@ -0,0 +1,94 @@
+# tests/test_session_store.py - Гонки кэша с отложенной записью сессий
+import asyncio
+import json
+
+from session_store import MemorySessionStore, WriteBehindSessionStore
+
+
+class SlowBackend:
+    """Хранилище, чтение и запись которого ждут разрешения теста"""
+
+    def __init__(self, data=None):
+        self.data = dict(data or {})
+        self.release_read = asyncio.Event()
+        self.release_write = asyncio.Event()
+        self.batches = []
+
+    async def get(self, user_id):
+        value = self.data.get(user_id)
+        await self.release_read.wait()
+        return json.loads(value) if value is not None else None
+
+    async def write_batch(self, items):
+        await self.release_write.wait()
+        self.batches.append(dict(items))
+        for user_id, data in items:
+            if data is None:
+                self.data.pop(user_id, None)
+            else:
+                self.data[user_id] = data
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+def test_set_during_backend_read_is_not_overwritten():
+    async def run():
+        backend = SlowBackend({1: json.dumps({'step': 'old'})})
+        backend.release_write.set()
+        store = WriteBehindSessionStore(MemorySessionStore(), backend)
+        reader = asyncio.create_task(store.get(1))
+        await asyncio.sleep(0)
+        await store.set(1, {'step': 'new'})
+        await store.flush()
+        backend.release_read.set()
+        return await reader, await store.get(1)
+
+    read, cached = asyncio.run(run())
+
+    assert read == {'step': 'new'}
+    assert cached == {'step': 'new'}
+
+
+def test_delete_during_backend_read_is_not_undone():
+    async def run():
+        backend = SlowBackend({1: json.dumps({'step': 'old'})})
+        backend.release_write.set()
+        store = WriteBehindSessionStore(MemorySessionStore(), backend)
+        reader = asyncio.create_task(store.get(1))
+        await asyncio.sleep(0)
+        await store.delete(1)
+        await store.flush()
+        backend.release_read.set()
+        return await reader, await store.get(1)
+
+    assert asyncio.run(run()) == (None, None)
+
+
+def test_concurrent_flushes_keep_in_flight_batch_visible():
+    async def run():
+        backend = SlowBackend()
+        store = WriteBehindSessionStore(MemorySessionStore(), backend)
+        await store.set(1, {'step': 'first'})
+        first = asyncio.create_task(store.flush())
+        await asyncio.sleep(0)
+        await store.set(2, {'step': 'second'})
+        # forget() сбрасывает на диск параллельно с периодическим сбросом
+        forget = asyncio.create_task(store.forget([1, 2]))
+        await asyncio.sleep(0)
+        # Сессия вытеснена из LRU: пока пачка пишется, ее видно только в _flushing
+        store.cache.delete_nowait(1)
+        backend.release_read.set()
+        during = await store.get(1)
+        backend.release_write.set()
+        await asyncio.gather(first, forget)
+        return during, backend.batches
+
+    during, batches = asyncio.run(run())
+
+    assert during == {'step': 'first'}
+    assert batches == [{1: json.dumps({'step': 'first'}, ensure_ascii=False, separators=(',', ':'))},
+                       {2: json.dumps({'step': 'second'}, ensure_ascii=False, separators=(',', ':'))}]
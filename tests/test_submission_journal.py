@@ -0,0 +1,142 @@
+# tests/test_submission_journal.py - Восстановление незавершенных заданий из журнала
+import asyncio
+import json
+
+from submission_journal import (
+    SubmissionJournal,
+    SyncSubmissionJournal,
+    _encode,
+    accept_record,
+    orphan_journals,
+    read_journal,
+)
+
+
+def write_records(path, records, tail: bytes = b''):
+    with open(path, 'wb') as f:
+        f.write(b''.join(_encode(record) for record in records) + tail)
+
+
+def test_read_journal_returns_only_open_entries(tmp_path):
+    path = str(tmp_path / 'submissions.journal')
+    write_records(path, [
+        accept_record('a', 'bot', 1, 'task-1', 'ответ 1'),
+        accept_record('b', 'bot', 2, 'task-2', 'ответ 2', upload_id='f' * 64),
+        accept_record('c', 'webapp', 3, 'task-3', 'ответ 3'),
+        {'op': 'message', 'id': 'b', 'chat_id': 2, 'message_id': 20},
+        {'op': 'graded', 'id': 'b', 'result': {'score': 90, 'feedback': 'хорошо'}},
+        {'op': 'done', 'id': 'a', 'status': 'delivered'},
+        {'op': 'done', 'id': 'c', 'status': 'failed'},
+    ])
+
+    pending = read_journal(path)
+
+    assert [entry.id for entry in pending] == ['b']
+    entry = pending[0]
+    assert (entry.user_id, entry.task_id, entry.answer) == (2, 'task-2', 'ответ 2')
+    assert (entry.chat_id, entry.message_id) == (2, 20)
+    assert entry.result == {'score': 90, 'feedback': 'хорошо'}
+    assert entry.extra == {'upload_id': 'f' * 64}
+
+
+def test_torn_last_line_is_skipped(tmp_path):
+    path = str(tmp_path / 'submissions.journal')
+    write_records(path, [accept_record('a', 'bot', 1, 'task-1', 'ответ')], tail=b'{"op": "done", "id": "a"')
+
+    assert [entry.id for entry in read_journal(path)] == ['a']
+
+
+def test_missing_journal_has_nothing_to_replay(tmp_path):
+    assert read_journal(str(tmp_path / 'absent.journal')) == []
+
+
+def test_async_journal_replays_unfinished_entries_after_restart(tmp_path):
+    path = str(tmp_path / 'submissions.journal')
+
+    async def first_run():
+        journal = SubmissionJournal(path)
+        assert journal.open() == []
+        await journal.start()
+        await journal.accept('delivered', 'bot', 1, 'task-1', 'ответ 1')
+        await journal.done('delivered')
+        await journal.accept('graded', 'bot', 2, 'task-2', 'ответ 2')
+        await journal.message('graded', 2, 200)
+        await journal.graded('graded', {'score': 75, 'feedback': 'неплохо', 'recommendations': []})
+        await journal.accept('queued', 'bot', 3, 'task-3', 'ответ 3')
+        # Подтверждение "Проверяем" не ушло: задание закрыто как failed
+        await journal.accept('not-confirmed', 'bot', 4, 'task-4', 'ответ 4')
+        await journal.done('not-confirmed', 'failed')
+        await journal.close()
+
+    asyncio.run(first_run())
+
+    journal = SubmissionJournal(path)
+    pending = journal.open()
+    asyncio.run(journal.close())
+
+    assert [entry.id for entry in pending] == ['graded', 'queued']
+    graded, queued = pending
+    assert (graded.chat_id, graded.message_id) == (2, 200)
+    assert graded.result['score'] == 75
+    assert queued.message_id is None and queued.result is None
+
+
+def test_open_compacts_journal_to_pending_entries(tmp_path):
+    path = str(tmp_path / 'submissions.journal')
+    write_records(path, [
+        accept_record('a', 'bot', 1, 'task-1', 'ответ 1'),
+        {'op': 'done', 'id': 'a', 'status': 'delivered'},
+        accept_record('b', 'bot', 2, 'task-2', 'ответ 2'),
+        {'op': 'message', 'id': 'b', 'chat_id': 2, 'message_id': 20},
+    ])
+
+    journal = SubmissionJournal(path)
+    pending = journal.open()
+    asyncio.run(journal.close())
+
+    with open(path, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    assert [(record['op'], record['id']) for record in records] == [('accept', 'b'), ('message', 'b')]
+    # Повторное открытие сжатого журнала дает те же задания
+    assert read_journal(path) == pending
+
+
+def test_sync_journal_replays_unfinished_entries_after_restart(tmp_path):
+    path = str(tmp_path / 'webapp_submissions.journal')
+    journal = SyncSubmissionJournal(path)
+    journal.open()
+    journal.accept('sent', 'webapp', 1, 'task-1', 'ответ 1')
+    journal.done('sent')
+    journal.accept('crashed', 'webapp', 2, 'task-2', 'ответ 2')
+    journal.close()
+
+    journal = SyncSubmissionJournal(path)
+    pending = journal.open()
+    journal.close()
+
+    assert [(entry.id, entry.source, entry.user_id) for entry in pending] == [('crashed', 'webapp', 2)]
+
+
+def test_orphan_journals_of_removed_workers_are_adopted(tmp_path):
+    base = str(tmp_path / 'webapp_submissions.journal')
+    # Было три воркера, стало два: журнал .2 и одиночного режима без владельца
+    write_records(f"{base}.0", [accept_record('a', 'webapp', 1, 'task-1', 'ответ 1')])
+    write_records(f"{base}.2", [
+        accept_record('b', 'webapp', 2, 'task-2', 'ответ 2'),
+        accept_record('c', 'webapp', 3, 'task-3', 'ответ 3'),
+        {'op': 'done', 'id': 'c', 'status': 'delivered'},
+    ])
+    write_records(base, [accept_record('d', 'webapp', 4, 'task-4', 'ответ 4')])
+    write_records(f"{base}.compact", [])
+
+    owned = [f"{base}.0", f"{base}.1"]
+    orphans = orphan_journals(base, owned)
+    assert orphans == [base, f"{base}.2"]
+
+    journal = SyncSubmissionJournal(f"{base}.0")
+    pending = journal.open(orphans)
+    journal.close()
+
+    assert sorted(entry.id for entry in pending) == ['a', 'b', 'd']
+    assert sorted(entry.id for entry in read_journal(f"{base}.0")) == ['a', 'b', 'd']
+    assert orphan_journals(base, owned) == []
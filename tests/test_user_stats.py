@@ -0,0 +1,33 @@
+# tests/test_user_stats.py - Учет сдач в агрегатах статистики
+import asyncio
+
+from user_stats import SqliteStatsBackend, UserStats, UserStatsEngine
+
+
+def test_replayed_submission_is_counted_once(tmp_path):
+    async def run():
+        engine = UserStatsEngine(SqliteStatsBackend(str(tmp_path / 'stats.db')))
+        await engine.start()
+        assert await engine.record(1, 'task-1', 80, submission_id='entry-a')
+        await engine.close()
+
+        # Рестарт между учетом и закрытием записи в журнале: доигрывание той же сдачи
+        engine = UserStatsEngine(SqliteStatsBackend(str(tmp_path / 'stats.db')))
+        await engine.start()
+        assert not await engine.record(1, 'task-1', 80, submission_id='entry-a')
+        assert await engine.record(1, 'task-2', 60, submission_id='entry-b')
+        stats = await engine.get(1)
+        await engine.close()
+        return stats
+
+    stats = asyncio.run(run())
+
+    assert stats.submissions == 2
+    assert stats.score_sum == 140
+
+
+def test_decode_accepts_records_without_recent_ids():
+    stats = UserStats.decode('[["task-1"],1,90,90,1,1,739000]')
+
+    assert stats.recent_ids == []
+    assert UserStats.decode(stats.encode()) == stats
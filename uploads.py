@@ -0,0 +1,180 @@
+# uploads.py - Потоковая загрузка больших ответов и вложений на диск
+#
+# Тело запроса пишется во временный файл кусками по мере чтения из сокета:
+# sha256 считается по ходу записи, превышение лимита обрывает загрузку.
+# Готовый файл переименовывается в путь по хешу содержимого - id загрузки
+# это sha256, повторная загрузка того же файла места не занимает. Бот и
+# сервер WebApp делят каталог UPLOAD_DIR; проверяющий читает файл через
+# mmap, целиком в память процесса он не попадает.
+import asyncio
+import hashlib
+import logging
+import mmap
+import os
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import AsyncIterable, Iterable, Iterator, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+PARTIAL_SUFFIX = '.part'
+
+UPLOADS = metrics.Counter('uploads_total', 'Загрузки файлов', ['outcome'])
+UPLOAD_BYTES = metrics.Counter('upload_bytes_total', 'Байты сохраненных загрузок')
+
+_UPLOAD_ID = re.compile(r'[0-9a-f]{64}')
+
+
+class UploadTooLarge(ValueError):
+    """Тело запроса больше лимита (HTTP 413)"""
+
+    def __init__(self, limit: int):
+        super().__init__(f"Файл больше {limit} байт")
+        self.limit = limit
+
+
+@dataclass(frozen=True)
+class StoredUpload:
+    """Сохраненный файл: id - sha256 содержимого"""
+    id: str
+    path: str
+    size: int
+
+    @contextmanager
+    def mapped(self) -> Iterator[memoryview]:
+        """Содержимое только для чтения через mmap (страницы читаются по обращению)"""
+        if self.size == 0:
+            yield memoryview(b'')
+            return
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                yield view
+            finally:
+                view.release()
+
+    def read_text(self, limit: int) -> str:
+        """Первые limit байт как текст (оборванный UTF-8 символ в конце отбрасывается)"""
+        with self.mapped() as view:
+            data = bytes(view[:limit])
+        return data.decode('utf-8', errors='ignore' if self.size > limit else 'replace')
+
+
+class _UploadWriter:
+    """Временный файл загрузки: запись кусками с хешем и лимитом"""
+
+    def __init__(self, store: 'UploadStore'):
+        self.store = store
+        fd, self.temp_path = tempfile.mkstemp(dir=store.directory, suffix=PARTIAL_SUFFIX)
+        self.file = os.fdopen(fd, 'wb')
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.store.max_bytes:
+            raise UploadTooLarge(self.store.max_bytes)
+        self.hash.update(chunk)
+        self.file.write(chunk)
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def commit(self) -> StoredUpload:
+        self.file.close()
+        upload_id = self.hash.hexdigest()
+        path = self.store.path_for(upload_id)
+        if os.path.exists(path):
+            # Тот же файл уже загружен: продлеваем ему срок хранения
+            os.unlink(self.temp_path)
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self.temp_path, path)
+        UPLOADS.labels('stored').inc()
+        UPLOAD_BYTES.inc(self.size)
+        return StoredUpload(upload_id, path, self.size)
+
+    def abort(self, error: BaseException):
+        self.file.close()
+        try:
+            os.unlink(self.temp_path)
+        except FileNotFoundError:
+            pass
+        UPLOADS.labels('too_large' if isinstance(error, UploadTooLarge) else 'failed').inc()
+
+
+class UploadStore:
+    """Каталог загрузок: <directory>/<sha256[:2]>/<sha256>"""
+
+    def __init__(self, directory: str, max_bytes: int = 20 * 1024 * 1024, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, upload_id: str) -> str:
+        return os.path.join(self.directory, upload_id[:2], upload_id)
+
+    def get(self, upload_id: Optional[str]) -> Optional[StoredUpload]:
+        """Загрузка по id или None (неверный id, файл удален)"""
+        if not upload_id or not _UPLOAD_ID.fullmatch(upload_id):
+            return None
+        path = self.path_for(upload_id)
+        try:
+            size = os.stat(path).st_size
+        except FileNotFoundError:
+            return None
+        return StoredUpload(upload_id, path, size)
+
+    def save(self, chunks: Iterable[bytes]) -> StoredUpload:
+        """Запись потока кусков (Flask: request.stream)"""
+        writer = _UploadWriter(self)
+        try:
+            for chunk in chunks:
+                writer.write(chunk)
+            writer.sync()
+        except BaseException as e:
+            writer.abort(e)
+            raise
+        return writer.commit()
+
+    async def save_async(self, chunks: AsyncIterable[bytes]) -> StoredUpload:
+        """Запись асинхронного потока (aiohttp: request.content.iter_chunked).
+
+        Куски пишутся в страничный кэш сразу, fsync - в потоке: цикл
+        событий не ждет диска.
+        """
+        writer = _UploadWriter(self)
+        try:
+            async for chunk in chunks:
+                writer.write(chunk)
+            await asyncio.to_thread(writer.sync)
+        except BaseException as e:
+            writer.abort(e)
+            raise
+        return writer.commit()
+
+    def prune(self, max_age: float) -> int:
+        """Удаление загрузок и брошенных временных файлов старше max_age секунд"""
+        deadline = time.time() - max_age
+        removed = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.stat(path).st_mtime < deadline:
+                        os.unlink(path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+        if removed:
+            logger.info(f"🧹 Удалено устаревших загрузок: {removed}")
+        return removed
@@ -0,0 +1,407 @@
+# user_stats.py - Инкрементальная статистика пользователей для кнопки "📊 Мои результаты"
+#
+# Агрегаты (выполненные задания, сумма и лучший балл, серия дней) обновляются
+# при каждой проверке и хранятся компактной строкой в SQLite. Пересчет из
+# истории сдач нужен только при первичном заполнении:
+#   python -m user_stats backfill submissions.csv --telegram-ids telegram_ids.csv \
+#       --assignments assignments.csv --db user_stats.db
+#
+# Выгрузка user_assignment_submissions должна быть отсортирована по времени
+# сдачи (ORDER BY completed_at), иначе серии дней посчитаются неточно.
+# Бот ищет статистику по Telegram id и ключу задания (assignments.task_id),
+# а assignment_id переводится через выгрузку заданий. В схеме Supabase
+# связи user_id (UUID из auth.users) с Telegram id нет - ни колонки, ни
+# таблицы профилей. Файл соответствий user_id,telegram_id собирается
+# отдельно: из auth.users.raw_user_meta_data, если вход через Telegram
+# сохраняет там id, или из своей таблицы привязок. Без него статистика
+# из выгрузки не переносится: UUID не похож на Telegram id, и такие сдачи
+# пропускаются.
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних id сдач помнит агрегат: повторный учет той же сдачи
+# (доигрывание журнала после рестарта) пропускается
+RECENT_SUBMISSIONS = 16
+
+
+@dataclass
+class UserStats:
+    """Агрегаты одного пользователя: обновление и чтение за O(1)"""
+    tasks: Set[str] = field(default_factory=set)
+    submissions: int = 0
+    score_sum: int = 0
+    best_score: Optional[int] = None
+    streak: int = 0
+    best_streak: int = 0
+    last_day: int = 0
+    recent_ids: List[str] = field(default_factory=list)
+
+    @property
+    def tasks_done(self) -> int:
+        return len(self.tasks)
+
+    @property
+    def mean_score(self) -> Optional[float]:
+        return self.score_sum / self.submissions if self.submissions else None
+
+    def record(self, task_id: str, score: int, day: int, submission_id: Optional[str] = None) -> bool:
+        """Учет проверенной сдачи; day - порядковый номер даты (date.toordinal).
+
+        False - сдача с этим submission_id уже учтена.
+        """
+        if submission_id is not None:
+            if submission_id in self.recent_ids:
+                return False
+            self.recent_ids = self.recent_ids[-(RECENT_SUBMISSIONS - 1):] + [submission_id]
+        self.tasks.add(task_id)
+        self.submissions += 1
+        self.score_sum += score
+        if self.best_score is None or score > self.best_score:
+            self.best_score = score
+        if day == self.last_day + 1:
+            self.streak += 1
+        elif day > self.last_day:
+            self.streak = 1
+        # day <= last_day: тот же день или запоздалая запись, серия не меняется
+        self.last_day = max(self.last_day, day)
+        self.best_streak = max(self.best_streak, self.streak)
+        return True
+
+    def current_streak(self, today: int) -> int:
+        """Серия прервана, если вчера и сегодня сдач не было"""
+        return self.streak if today - self.last_day <= 1 else 0
+
+    def encode(self) -> str:
+        return json.dumps(
+            [sorted(self.tasks), self.submissions, self.score_sum, self.best_score,
+             self.streak, self.best_streak, self.last_day, self.recent_ids],
+            ensure_ascii=False,
+            separators=(',', ':'),
+        )
+
+    @classmethod
+    def decode(cls, data: str) -> 'UserStats':
+        # Записи до появления recent_ids - из 7 полей
+        tasks, submissions, score_sum, best_score, streak, best_streak, last_day, *rest = json.loads(data)
+        recent_ids = rest[0] if rest else []
+        return cls(set(tasks), submissions, score_sum, best_score, streak, best_streak, last_day, recent_ids)
+
+
+def day_of(moment: Optional[datetime] = None) -> int:
+    if moment is None:
+        return date.today().toordinal()
+    if moment.tzinfo is not None:
+        moment = moment.astimezone()
+    return moment.date().toordinal()
+
+
+class SqliteStatsBackend:
+    """Таблица user_stats(user_id, data) в SQLite (WAL), доступ из одного потока"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='stats-sqlite')
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS user_stats ('
+            'user_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)'
+        )
+        conn.commit()
+        self._conn = conn
+
+    def disconnect(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def read(self, user_id: str) -> Optional[str]:
+        row = self._conn.execute('SELECT data FROM user_stats WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def write_many(self, items: Iterable[Tuple[str, str]]):
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                'INSERT INTO user_stats (user_id, data, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at',
+                ((user_id, data, now) for user_id, data in items),
+            )
+
+    async def get(self, user_id: str) -> Optional[str]:
+        return await self._run(self.read, user_id)
+
+    async def write_batch(self, items: List[Tuple[str, str]]):
+        await self._run(self.write_many, items)
+
+    async def start(self):
+        if self._conn is None:
+            await self._run(self.connect)
+
+    async def close(self):
+        await self._run(self.disconnect)
+        self._executor.shutdown(wait=True)
+
+
+class UserStatsEngine:
+    """Статистика пользователей: LRU в памяти + отложенная запись на диск.
+
+    Вытесняются только уже сброшенные записи, грязные ждут flush().
+    Без backend статистика живет только в памяти процесса.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[SqliteStatsBackend] = None,
+        max_entries: int = 100_000,
+        flush_interval: float = 1.0,
+    ):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+
+        self._stats: "OrderedDict[str, UserStats]" = OrderedDict()
+        self._dirty: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.backend_reads = 0
+        self.flushes = 0
+
+    async def get(self, user_id: Any) -> Optional[UserStats]:
+        key = str(user_id)
+        stats = self._stats.get(key)
+        if stats is not None:
+            self._stats.move_to_end(key)
+            return stats
+        if self.backend is None:
+            return None
+        self.backend_reads += 1
+        data = await self.backend.get(key)
+        if data is None:
+            return None
+        # Пока читали с диска, запись могла появиться в памяти
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = UserStats.decode(data)
+            self._put(key, stats)
+        return stats
+
+    async def record(self, user_id: Any, task_id: str, score: int, moment: Optional[datetime] = None,
+                     submission_id: Optional[str] = None) -> bool:
+        """False - сдача submission_id уже учтена (повтор после рестарта)"""
+        key = str(user_id)
+        stats = await self.get(key)
+        if stats is None:
+            # Параллельная запись могла создать агрегат, пока читали диск
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = UserStats()
+                self._put(key, stats)
+        if not stats.record(task_id, score, day_of(moment), submission_id):
+            return False
+        if self.backend is not None:
+            self._dirty.add(key)
+        return True
+
+    def user_ids(self) -> List[str]:
+        return list(self._stats)
+
+    async def forget(self, user_ids: Iterable[Any]):
+        """Убирает агрегаты из памяти после сброса на диск (передача другому воркеру)"""
+        await self.flush()
+        for user_id in user_ids:
+            key = str(user_id)
+            self._stats.pop(key, None)
+            self._dirty.discard(key)
+
+    def adopt(self, user_id: Any, data: str):
+        """Принимает агрегат, переданный прежним владельцем пользователя"""
+        key = str(user_id)
+        self._put(key, UserStats.decode(data))
+        if self.backend is not None:
+            self._dirty.add(key)
+
+    def _put(self, key: str, stats: UserStats):
+        self._stats[key] = stats
+        if len(self._stats) <= self.max_entries:
+            return
+        for candidate in list(self._stats):
+            if len(self._stats) <= self.max_entries:
+                break
+            if candidate not in self._dirty and candidate != key:
+                del self._stats[candidate]
+
+    async def flush(self):
+        if self.backend is None or not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        batch = [(key, self._stats[key].encode()) for key in dirty if key in self._stats]
+        try:
+            await self.backend.write_batch(batch)
+        except Exception as e:
+            logger.error(f"Ошибка записи статистики на диск: {e}")
+            self._dirty |= dirty
+            return
+        self.flushes += 1
+
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def start(self):
+        if self.backend is not None:
+            await self.backend.start()
+            if self._task is None:
+                self._task = asyncio.create_task(self._flusher(), name='stats-flusher')
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.backend is not None:
+            await self.flush()
+            await self.backend.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'entries': len(self._stats),
+            'dirty': len(self._dirty),
+            'flushes': self.flushes,
+            'backend_reads': self.backend_reads,
+        }
+
+
+# ----------------------------------------------------------------------
+# Пересчет из выгрузки
+
+def read_submissions(path: str) -> Iterator[Dict[str, Any]]:
+    """Потоковое чтение выгрузки: CSV с заголовком или JSON Lines"""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if path.endswith(('.jsonl', '.ndjson')):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def read_mapping(path: str, key_column: str, value_column: str) -> Dict[str, str]:
+    """Соответствие ключ -> значение из выгрузки (строки без значения пропускаются)"""
+    mapping = {}
+    for row in read_submissions(path):
+        value = row.get(value_column)
+        if value not in (None, ''):
+            mapping[str(row[key_column])] = str(value)
+    return mapping
+
+
+def rebuild_stats(
+    rows: Iterable[Dict[str, Any]],
+    user_column: str = 'user_id',
+    task_column: str = 'assignment_id',
+    user_ids: Optional[Dict[str, str]] = None,
+    task_ids: Optional[Dict[str, str]] = None,
+) -> Dict[str, UserStats]:
+    """Один проход по сдачам: учитываются только оцененные записи.
+
+    user_ids и task_ids переводят ключи выгрузки в ключи бота (Telegram id,
+    task_id задания). Сдачи пользователей без Telegram id пропускаются:
+    бот их статистику не запросит.
+    """
+    aggregates: Dict[str, UserStats] = {}
+    skipped = 0
+    for row in rows:
+        score = row.get('score')
+        if score in (None, ''):
+            continue
+        user_id = str(row[user_column])
+        if user_ids is not None:
+            user_id = user_ids.get(user_id, '')
+        if not user_id.isdigit():
+            skipped += 1
+            continue
+        task_id = str(row[task_column])
+        if task_ids is not None:
+            task_id = task_ids.get(task_id, task_id)
+        moment = row.get('completed_at') or row.get('submitted_at') or row.get('updated_at')
+        day = day_of(datetime.fromisoformat(moment)) if moment else day_of()
+        stats = aggregates.get(user_id)
+        if stats is None:
+            stats = aggregates[user_id] = UserStats()
+        stats.record(task_id, int(score), day)
+    if skipped:
+        logger.warning(f"Пропущено сдач без Telegram id пользователя: {skipped}")
+    return aggregates
+
+
+def backfill(path: str, db_path: str, user_column: str = 'user_id', task_column: str = 'assignment_id',
+             batch_size: int = 1000, telegram_ids: Optional[str] = None,
+             assignments: Optional[str] = None) -> int:
+    """Пересборка агрегатов из выгрузки с записью пачками; возвращает число пользователей.
+
+    telegram_ids - соответствия (user_id, telegram_id), собранные вне
+    Supabase (см. начало модуля), assignments - выгрузка заданий (id,
+    task_id). Без них колонки выгрузки сдач уже должны содержать Telegram
+    id и ключ задания.
+    """
+    user_ids = read_mapping(telegram_ids, 'user_id', 'telegram_id') if telegram_ids else None
+    task_ids = read_mapping(assignments, 'id', 'task_id') if assignments else None
+    aggregates = rebuild_stats(read_submissions(path), user_column, task_column, user_ids, task_ids)
+    backend = SqliteStatsBackend(db_path)
+    backend.connect()
+    items = ((user_id, stats.encode()) for user_id, stats in aggregates.items())
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            break
+        backend.write_many(batch)
+    backend.disconnect()
+    return len(aggregates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Статистика пользователей')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    backfill_parser = subparsers.add_parser('backfill', help='пересчет агрегатов из выгрузки сдач')
+    backfill_parser.add_argument('export', help='CSV или JSON Lines выгрузка user_assignment_submissions')
+    backfill_parser.add_argument('--db', default='user_stats.db')
+    backfill_parser.add_argument('--user-column', default='user_id')
+    backfill_parser.add_argument('--task-column', default='assignment_id')
+    backfill_parser.add_argument(
+        '--telegram-ids',
+        help='соответствия user_id (UUID auth.users) -> telegram_id, колонки user_id, telegram_id; '
+             'в схеме Supabase их нет, файл собирается из метаданных входа или своей таблицы привязок',
+    )
+    backfill_parser.add_argument('--assignments', help='выгрузка assignments с колонками id, task_id')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    start = time.perf_counter()
+    users = backfill(args.export, args.db, args.user_column, args.task_column,
+                     telegram_ids=args.telegram_ids, assignments=args.assignments)
+    logger.info(f"Пересчитана статистика {users} пользователей за {time.perf_counter() - start:.2f} с")
+
+
+if __name__ == '__main__':
+    main()
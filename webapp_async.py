@@ -0,0 +1,391 @@
+# webapp_async.py - Асинхронный режим сервера WebApp запросов (aiohttp)
+#
+# Запуск: python webapp_async.py --workers 4 (или python webapp_server.py --mode async)
+# Контракт /api/submit-homework, /api/upload-homework и /api/answer-webapp-query
+# тот же, что у Flask-версии.
+import startup
+startup.install()
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from typing import List, Optional
+
+from aiohttp import web
+
+from bot_api import AsyncBotApiClient, BotApiError
+from dedup import Deduplicator, SharedClaims, submission_key
+from log_config import setup_logging
+from send_scheduler import PRIORITY_NOTICE, PRIORITY_RESULT, SendScheduler, SharedLimits
+from submission_journal import SubmissionJournal, new_entry_id, orphan_journals
+from uploads import UploadStore, UploadTooLarge
+from webapp_common import (
+    BOT_API_BASE_URL,
+    BOT_API_TIMEOUT,
+    DEDUP_CAPACITY,
+    DEDUP_DB,
+    DEDUP_DONE_WINDOW,
+    DEDUP_ERROR_RATE,
+    DEDUP_WINDOW,
+    REQUEST_SECONDS,
+    SEND_CHAT_RATE,
+    SEND_GLOBAL_RATE,
+    SEND_LIMITS_DB,
+    SEND_TOTAL_RATE,
+    TELEGRAM_BOT_TOKEN,
+    UPLOAD_CHUNK_SIZE,
+    UPLOAD_DIR,
+    UPLOAD_MAX_BYTES,
+    UPLOAD_PREVIEW_BYTES,
+    UPLOAD_RETENTION,
+    WEBAPP_JOURNAL,
+    build_homework_message,
+    build_webapp_query_result,
+    add_server_arguments,
+    init_data_verifier,
+    start_metrics_server,
+)
+
+startup.mark('импорты')
+
+logger = logging.getLogger(__name__)
+
+BOT_API_POOL_SIZE = int(os.getenv('BOT_API_POOL_SIZE', '100'))
+SHUTDOWN_TIMEOUT = float(os.getenv('WEBAPP_SHUTDOWN_TIMEOUT', '30'))
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type, X-Telegram-Init-Data',
+    'Access-Control-Allow-Methods': 'POST, OPTIONS',
+}
+
+BOT_API_KEY = web.AppKey('bot_api', AsyncBotApiClient)
+SCHEDULER_KEY = web.AppKey('send_scheduler', SendScheduler)
+IN_FLIGHT_KEY = web.AppKey('in_flight', list)
+JOURNAL_KEY = web.AppKey('journal', SubmissionJournal)
+REPLAY_KEY = web.AppKey('journal_replay', list)
+ADOPT_KEY = web.AppKey('journal_adopt', list)
+DEDUP_KEY = web.AppKey('dedup', Deduplicator)
+UPLOADS_KEY = web.AppKey('uploads', UploadStore)
+
+
+@web.middleware
+async def cors_middleware(request: web.Request, handler):
+    """Разрешаем CORS для WebApp (аналог flask_cors)"""
+    if request.method == 'OPTIONS':
+        return web.Response(headers=CORS_HEADERS)
+    response = await handler(request)
+    response.headers.update(CORS_HEADERS)
+    return response
+
+
+@web.middleware
+async def in_flight_middleware(request: web.Request, handler):
+    """Учет запросов в обработке для корректного завершения"""
+    in_flight = request.app[IN_FLIGHT_KEY]
+    in_flight[0] += 1
+    try:
+        return await handler(request)
+    finally:
+        in_flight[0] -= 1
+
+
+@web.middleware
+async def metrics_middleware(request: web.Request, handler):
+    """Длительность запроса по шаблону маршрута и статусу"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        resource = request.match_info.route.resource
+        endpoint = resource.canonical if resource is not None else 'unmatched'
+        REQUEST_SECONDS.labels(endpoint, status).observe(time.perf_counter() - start)
+        startup.first_request()
+
+
+async def accept_submission(app: web.Application, user_id: int, task_id: str, answer: str,
+                            upload_id: str = ''):
+    """Журнал и уведомление о получении; повтор того же задания ждет первое"""
+    async def notify():
+        # Задание фиксируется на диске до ответа клиенту
+        journal = app[JOURNAL_KEY]
+        entry_id = new_entry_id()
+        extra = {'upload_id': upload_id} if upload_id else {}
+        await journal.accept(entry_id, 'webapp', user_id, task_id, answer, **extra)
+
+        try:
+            await app[BOT_API_KEY].call(
+                'sendMessage',
+                chat_id=user_id,
+                text=build_homework_message(task_id, answer),
+                parse_mode='HTML',
+                priority=PRIORITY_NOTICE
+            )
+        except BotApiError:
+            await journal.done(entry_id, 'failed')
+            raise
+        await journal.done(entry_id)
+
+    # Двойная отправка формы: второй запрос ждет первый и получает тот же ответ
+    await app[DEDUP_KEY].once(submission_key(user_id, task_id, answer, upload_id), notify)
+
+
+async def submit_homework(request: web.Request) -> web.Response:
+    """Endpoint для отправки домашнего задания"""
+    try:
+        data = await request.json()
+        init_data = request.headers.get('X-Telegram-Init-Data', '')
+
+        verified = init_data_verifier.verify(init_data)
+        if verified is None:
+            return web.json_response({'error': 'Invalid init data'}, status=401)
+
+        task_id = data.get('taskId')
+        user_answer = data.get('userAnswer')
+
+        try:
+            await accept_submission(request.app, verified.user_id, task_id, user_answer)
+        except BotApiError as e:
+            logger.error(f"Error: {e}")
+            return web.json_response({'error': 'Failed to send message'}, status=500)
+
+        return web.json_response({
+            'success': True,
+            'message': 'Задание отправлено на проверку'
+        })
+
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def upload_homework(request: web.Request) -> web.Response:
+    """Endpoint для большого ответа или вложения: тело пишется на диск кусками.
+
+    Задание - в параметре taskId, initData - в заголовке. В ответе uploadId:
+    WebApp передает его боту в submit_homework для проверки.
+    """
+    try:
+        verified = init_data_verifier.verify(request.headers.get('X-Telegram-Init-Data', ''))
+        if verified is None:
+            return web.json_response({'error': 'Invalid init data'}, status=401)
+
+        store = request.app[UPLOADS_KEY]
+        # Заявленный размер проверяем до чтения тела; без Content-Length лимит - при записи
+        if request.content_length is not None and request.content_length > store.max_bytes:
+            return web.json_response({'error': f"Файл больше {store.max_bytes} байт"}, status=413)
+        try:
+            upload = await store.save_async(request.content.iter_chunked(store.chunk_size))
+        except UploadTooLarge as e:
+            return web.json_response({'error': str(e)}, status=413)
+
+        task_id = request.query.get('taskId', '')
+        preview = await asyncio.to_thread(upload.read_text, UPLOAD_PREVIEW_BYTES)
+        try:
+            await accept_submission(request.app, verified.user_id, task_id, preview, upload.id)
+        except BotApiError as e:
+            logger.error(f"Error: {e}")
+            return web.json_response({'error': 'Failed to send message'}, status=500)
+
+        return web.json_response({
+            'success': True,
+            'message': 'Файл получен',
+            'uploadId': upload.id,
+            'size': upload.size,
+        })
+
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def answer_webapp_query(request: web.Request) -> web.Response:
+    """Endpoint для ответа на WebApp query (для inline buttons)"""
+    try:
+        data = await request.json()
+
+        try:
+            await request.app[BOT_API_KEY].call(
+                'answerWebAppQuery',
+                web_app_query_id=data.get('queryId'),
+                result=build_webapp_query_result(data.get('result')),
+                priority=PRIORITY_RESULT
+            )
+            success = True
+        except BotApiError as e:
+            logger.error(f"Error: {e}")
+            success = False
+
+        return web.json_response({'success': success})
+
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def _drain_in_flight(app: web.Application):
+    """Дожидаемся завершения запросов, уже отправивших вызовы в Bot API"""
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+    while app[IN_FLIGHT_KEY][0] and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    if app[IN_FLIGHT_KEY][0]:
+        logger.warning(f"⚠️ Не дождались {app[IN_FLIGHT_KEY][0]} запросов при остановке")
+
+
+async def _start_scheduler(app: web.Application):
+    await app[SCHEDULER_KEY].start()
+
+
+async def _report_ready(app: web.Application):
+    startup.ready()
+
+
+async def _replay_journal(app: web.Application, pending):
+    """Повторная отправка уведомлений, не подтвержденных до рестарта"""
+    for entry in pending:
+        try:
+            await app[BOT_API_KEY].call(
+                'sendMessage',
+                chat_id=entry.user_id,
+                text=build_homework_message(entry.task_id, entry.answer),
+                parse_mode='HTML',
+                priority=PRIORITY_NOTICE
+            )
+        except BotApiError as e:
+            logger.error(f"Не удалось восстановить задание {entry.id} из журнала: {e}")
+            continue
+        await app[JOURNAL_KEY].done(entry.id)
+
+
+async def _start_journal(app: web.Application):
+    journal = app[JOURNAL_KEY]
+    pending = journal.open(app[ADOPT_KEY])
+    await journal.start()
+    if pending:
+        app[REPLAY_KEY].append(asyncio.create_task(_replay_journal(app, pending), name='journal-replay'))
+
+
+async def _prune_uploads(app: web.Application):
+    if UPLOAD_RETENTION > 0:
+        await asyncio.to_thread(app[UPLOADS_KEY].prune, UPLOAD_RETENTION)
+
+
+async def _close_journal(app: web.Application):
+    await asyncio.gather(*app[REPLAY_KEY], return_exceptions=True)
+    await app[JOURNAL_KEY].close()
+
+
+async def _close_bot_api(app: web.Application):
+    await app[SCHEDULER_KEY].stop()
+    await app[BOT_API_KEY].close()
+
+
+def create_app(global_rate: float = SEND_GLOBAL_RATE, journal_path: str = WEBAPP_JOURNAL,
+               dedup_path: Optional[str] = None, adopt_journals: Optional[List[str]] = None) -> web.Application:
+    """Сборка aiohttp-приложения; dedup_path - общие ключи повторов воркеров,
+    adopt_journals - журналы без владельца, которые доигрывает этот процесс"""
+    app = web.Application(middlewares=[metrics_middleware, cors_middleware, in_flight_middleware])
+    shared = SharedLimits(SEND_LIMITS_DB, SEND_TOTAL_RATE, SEND_CHAT_RATE) if SEND_LIMITS_DB else None
+    app[SCHEDULER_KEY] = SendScheduler(global_rate, SEND_CHAT_RATE, shared=shared)
+    app[BOT_API_KEY] = AsyncBotApiClient(
+        TELEGRAM_BOT_TOKEN or '',
+        base_url=BOT_API_BASE_URL,
+        timeout=BOT_API_TIMEOUT,
+        pool_size=BOT_API_POOL_SIZE,
+        scheduler=app[SCHEDULER_KEY],
+    )
+    app[IN_FLIGHT_KEY] = [0]
+    app[JOURNAL_KEY] = SubmissionJournal(journal_path)
+    app[REPLAY_KEY] = []
+    app[ADOPT_KEY] = adopt_journals or []
+    app[DEDUP_KEY] = Deduplicator(
+        DEDUP_WINDOW, DEDUP_CAPACITY, DEDUP_ERROR_RATE,
+        shared=SharedClaims(dedup_path, DEDUP_WINDOW, DEDUP_DONE_WINDOW) if dedup_path else None,
+        done_window=DEDUP_DONE_WINDOW,
+    )
+    app[UPLOADS_KEY] = UploadStore(UPLOAD_DIR, UPLOAD_MAX_BYTES, UPLOAD_CHUNK_SIZE)
+    app.router.add_post('/api/submit-homework', submit_homework)
+    app.router.add_post('/api/upload-homework', upload_homework)
+    app.router.add_post('/api/answer-webapp-query', answer_webapp_query)
+    app.on_startup.append(_start_scheduler)
+    app.on_startup.append(_start_journal)
+    app.on_startup.append(_prune_uploads)
+    app.on_startup.append(_report_ready)
+    app.on_shutdown.append(_drain_in_flight)
+    app.on_cleanup.append(_close_journal)
+    app.on_cleanup.append(_close_bot_api)
+    return app
+
+
+def _run_worker(host: str, port: int, reuse_port: bool, workers: int = 1, index: int = 0):
+    setup_logging()
+    start_metrics_server(index)
+    # Потолок отправки делится между воркерами (общие ведра - в SEND_LIMITS_DB),
+    # журнал у каждого свой, ключи повторов общие: двойная отправка формы может
+    # попасть в разные воркеры
+    journal_paths = [WEBAPP_JOURNAL] if workers <= 1 else [f"{WEBAPP_JOURNAL}.{i}" for i in range(workers)]
+    journal_path = journal_paths[index]
+    # Журналы прежнего, большего числа воркеров (или одиночного режима)
+    # доигрывает воркер 0, иначе их задания не восстановятся никогда
+    adopt = orphan_journals(WEBAPP_JOURNAL, journal_paths) if index == 0 else []
+    dedup_path = DEDUP_DB if workers > 1 and DEDUP_DB else None
+    web.run_app(
+        create_app(SEND_GLOBAL_RATE / workers, journal_path, dedup_path, adopt),
+        host=host,
+        port=port,
+        reuse_port=reuse_port,
+        shutdown_timeout=SHUTDOWN_TIMEOUT,
+        print=None,
+    )
+
+
+def serve(host: str = '0.0.0.0', port: int = 5000, workers: int = 1):
+    """Запуск async-режима: один процесс или несколько с SO_REUSEPORT"""
+    if workers <= 1:
+        logger.info(f"🚀 Async сервер запущен на {host}:{port}")
+        _run_worker(host, port, reuse_port=False)
+        return
+
+    processes: List[multiprocessing.Process] = []
+    for index in range(workers):
+        process = multiprocessing.Process(
+            target=_run_worker,
+            args=(host, port, True, workers, index),
+            name=f"webapp-worker-{index}",
+        )
+        process.start()
+        processes.append(process)
+    logger.info(f"🚀 Async сервер запущен на {host}:{port}, воркеров: {workers}")
+
+    def _forward(signum, frame):
+        # Воркеры сами дожидаются активных запросов по SIGTERM
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, _forward)
+    signal.signal(signal.SIGINT, _forward)
+    for process in processes:
+        process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Async сервер WebApp запросов')
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    setup_logging()
+    serve(args.host, args.port, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# webapp_common.py - Настройки и общие функции серверов WebApp (Flask и aiohttp)
+#
+# Модуль не импортирует ни Flask, ни requests: async-сервер
+# (python webapp_async.py) стартует без них.
+import argparse
+import logging
+import os
+
+from dotenv import load_dotenv
+
+import message_templates
+import metrics
+from telegram_auth import InitDataVerifier
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+BOT_API_BASE_URL = os.getenv('BOT_API_BASE_URL', 'https://api.telegram.org')
+BOT_API_TIMEOUT = float(os.getenv('BOT_API_TIMEOUT', '10'))
+
+# Лимиты Telegram общие с ботом: ведра в файле SEND_LIMITS_DB (тот же путь,
+# что у бота; пустой - только лимиты процесса), SEND_GLOBAL_RATE - потолок
+# этого сервера (при --workers делится между воркерами)
+SEND_LIMITS_DB = os.getenv('SEND_LIMITS_DB', 'send_limits.db')
+SEND_TOTAL_RATE = float(os.getenv('SEND_TOTAL_RATE', '30'))
+SEND_GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', '10'))
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', '1'))
+
+INIT_DATA_MAX_AGE = int(os.getenv('INIT_DATA_MAX_AGE', '86400'))
+
+# Секрет для проверки initData вычисляется один раз при старте
+init_data_verifier = InitDataVerifier(TELEGRAM_BOT_TOKEN or '', max_age=INIT_DATA_MAX_AGE)
+
+# Журнал принятых заданий: уведомление о получении переотправляется после рестарта
+WEBAPP_JOURNAL = os.getenv('WEBAPP_JOURNAL', 'webapp_submissions.journal')
+
+# Повторная отправка того же ответа, пока идет первая или в пределах
+# DEDUP_DONE_WINDOW после нее, не шлет второе уведомление. DEDUP_WINDOW -
+# срок, после которого освобождается отправка упавшего воркера
+DEDUP_WINDOW = float(os.getenv('DEDUP_WINDOW', '300'))
+DEDUP_DONE_WINDOW = float(os.getenv('DEDUP_DONE_WINDOW', '10'))
+DEDUP_CAPACITY = int(os.getenv('DEDUP_CAPACITY', '100000'))
+DEDUP_ERROR_RATE = float(os.getenv('DEDUP_ERROR_RATE', '1e-6'))
+# Воркеры async-сервера (--workers > 1) делят ключи отправок через этот файл
+DEDUP_DB = os.getenv('DEDUP_DB', 'webapp_dedup.db')
+
+# Загрузка больших ответов и вложений: каталог общий с ботом, файлы старше
+# UPLOAD_RETENTION секунд удаляются при старте сервера (0 - не удалять)
+UPLOAD_DIR = os.getenv('UPLOAD_DIR', 'uploads')
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', str(20 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(64 * 1024)))
+UPLOAD_RETENTION = float(os.getenv('UPLOAD_RETENTION', str(7 * 86400)))
+# Сколько байт файла показывать в уведомлении о получении
+UPLOAD_PREVIEW_BYTES = 2048
+
+# Метрики Prometheus: http://METRICS_ADDR:WEBAPP_METRICS_PORT/metrics, отдельно
+# от публичного порта приложения (0 - выключены); воркер i - на порту + i
+WEBAPP_METRICS_PORT = int(os.getenv('WEBAPP_METRICS_PORT', '9201'))
+METRICS_ADDR = os.getenv('METRICS_ADDR', '127.0.0.1')
+
+REQUEST_SECONDS = metrics.Histogram(
+    'webapp_request_seconds', 'Обработка HTTP-запроса сервером WebApp', ['endpoint', 'status'],
+)
+
+
+def start_metrics_server(index: int = 0):
+    """HTTP /metrics в отдельном потоке на локальном адресе"""
+    if not WEBAPP_METRICS_PORT:
+        return
+    try:
+        metrics.start_http_server(WEBAPP_METRICS_PORT + index, METRICS_ADDR)
+    except OSError as e:
+        logger.warning(f"Метрики не запущены на {METRICS_ADDR}:{WEBAPP_METRICS_PORT + index}: {e}")
+
+
+def build_homework_message(task_id: str, user_answer: str) -> str:
+    """Текст уведомления о получении домашнего задания"""
+    return message_templates.HOMEWORK_RECEIVED.render(
+        task_id=task_id,
+        answer=message_templates.truncate(user_answer, 500),
+    )
+
+
+def build_webapp_query_result(result: str) -> dict:
+    """Результат для answerWebAppQuery"""
+    return {
+        'type': 'article',
+        'id': '1',
+        'title': 'Домашнее задание отправлено',
+        'input_message_content': {
+            'message_text': result,
+            'parse_mode': 'HTML'
+        }
+    }
+
+
+def add_server_arguments(parser: argparse.ArgumentParser):
+    """Адрес, порт и число процессов - общие для обоих серверов"""
+    parser.add_argument('--host', default=os.getenv('WEBAPP_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', '5000')))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WEBAPP_WORKERS', '1')))
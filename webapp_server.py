@@ -1,58 +1,144 @@
 # webapp_server.py - Дополнительный сервер для обработки WebApp запросов
+#
+# Режим dev - этот Flask-сервер. Для продакшена: python webapp_async.py
+# (aiohttp, без импорта Flask и requests - быстрее холодный старт).
+import startup
+startup.install()
 
-from flask import Flask, request, jsonify
+from flask import Flask, g, request, jsonify
 from flask_cors import CORS
-import requests
+import argparse
+import logging
 import os
-import hashlib
-import hmac
-from urllib.parse import parse_qs
-from dotenv import load_dotenv
+import threading
+import time
+from functools import partial
 
-load_dotenv()
+from bot_api import BotApiClient, BotApiError
+from dedup import SyncDeduplicator, submission_key
+from send_scheduler import SharedLimits, SyncRateLimiter
+from submission_journal import SyncSubmissionJournal, new_entry_id, orphan_journals
+from uploads import UploadStore, UploadTooLarge
+from log_config import setup_logging
+from webapp_common import (
+    BOT_API_BASE_URL,
+    BOT_API_TIMEOUT,
+    DEDUP_CAPACITY,
+    DEDUP_DONE_WINDOW,
+    DEDUP_ERROR_RATE,
+    DEDUP_WINDOW,
+    REQUEST_SECONDS,
+    SEND_CHAT_RATE,
+    SEND_GLOBAL_RATE,
+    SEND_LIMITS_DB,
+    SEND_TOTAL_RATE,
+    TELEGRAM_BOT_TOKEN,
+    UPLOAD_CHUNK_SIZE,
+    UPLOAD_DIR,
+    UPLOAD_MAX_BYTES,
+    UPLOAD_PREVIEW_BYTES,
+    UPLOAD_RETENTION,
+    WEBAPP_JOURNAL,
+    add_server_arguments,
+    build_homework_message,
+    build_webapp_query_result,
+    init_data_verifier,
+    start_metrics_server,
+)
+
+startup.mark('импорты')
 
 app = Flask(__name__)
 CORS(app)  # Разрешаем CORS для WebApp
 
-TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-BOT_API_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
+# Общий клиент Bot API: keep-alive пул соединений, таймауты и повторы на 429
+bot_api = BotApiClient(
+    TELEGRAM_BOT_TOKEN or '',
+    base_url=BOT_API_BASE_URL,
+    timeout=BOT_API_TIMEOUT,
+    rate_limiter=SyncRateLimiter(
+        SEND_GLOBAL_RATE,
+        SEND_CHAT_RATE,
+        shared=SharedLimits(SEND_LIMITS_DB, SEND_TOTAL_RATE, SEND_CHAT_RATE) if SEND_LIMITS_DB else None,
+    ),
+)
+
+# Журнал принятых заданий: уведомление о получении переотправляется после рестарта
+webapp_journal = SyncSubmissionJournal(WEBAPP_JOURNAL)
+
+# Двойная отправка формы: второй запрос ждет первый и получает тот же ответ
+submissions = SyncDeduplicator(DEDUP_WINDOW, DEDUP_CAPACITY, DEDUP_ERROR_RATE, done_window=DEDUP_DONE_WINDOW)
+
+# Большие ответы и вложения: тело запроса пишется на диск кусками
+upload_store = UploadStore(UPLOAD_DIR, UPLOAD_MAX_BYTES, UPLOAD_CHUNK_SIZE)
+
+logger = logging.getLogger(__name__)
+
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def _observe_request(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        # Шаблон маршрута, а не путь: число меток не растет с параметрами
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.labels(endpoint, response.status_code).observe(time.perf_counter() - start)
+    startup.first_request()
+    return response
 
 def verify_telegram_web_app_data(init_data: str) -> bool:
     """Проверка подлинности данных от Telegram WebApp"""
-    try:
-        # Парсим init_data
-        parsed_data = parse_qs(init_data)
-        
-        # Извлекаем hash
-        received_hash = parsed_data.get('hash', [''])[0]
-        
-        # Создаем data-check-string
-        data_check_arr = []
-        for key, value in parsed_data.items():
-            if key != 'hash':
-                data_check_arr.append(f"{key}={value[0]}")
-        
-        data_check_arr.sort()
-        data_check_string = '\n'.join(data_check_arr)
-        
-        # Вычисляем secret_key
-        secret_key = hmac.new(
-            "WebAppData".encode(), 
-            TELEGRAM_BOT_TOKEN.encode(), 
-            hashlib.sha256
-        ).digest()
-        
-        # Вычисляем hash
-        calculated_hash = hmac.new(
-            secret_key,
-            data_check_string.encode(),
-            hashlib.sha256
-        ).hexdigest()
+    return init_data_verifier.verify(init_data) is not None
+
+def replay_webapp_journal(pending):
+    """Повторная отправка уведомлений, не подтвержденных до рестарта"""
+    for entry in pending:
+        try:
+            bot_api.call(
+                'sendMessage',
+                chat_id=entry.user_id,
+                text=build_homework_message(entry.task_id, entry.answer),
+                parse_mode='HTML'
+            )
+        except BotApiError as e:
+            logger.error(f"Не удалось восстановить задание {entry.id} из журнала: {e}")
+            continue
+        webapp_journal.done(entry.id)
+
+def ensure_journal():
+    """Открытие журнала при первом использовании; восстановление - в фоне"""
+    if webapp_journal.is_open:
+        return
+    # Журналы воркеров async-сервера, если раньше он работал с --workers
+    pending = webapp_journal.open(orphan_journals(WEBAPP_JOURNAL, [WEBAPP_JOURNAL]))
+    if pending:
+        threading.Thread(target=replay_webapp_journal, args=(pending,), name='journal-replay', daemon=True).start()
+
+def accept_submission(user_id: int, task_id: str, answer: str, upload_id: str = ''):
+    """Журнал и уведомление о получении; повтор того же задания ждет первое"""
+    def notify():
+        # Задание фиксируется на диске до ответа клиенту
+        ensure_journal()
+        entry_id = new_entry_id()
+        extra = {'upload_id': upload_id} if upload_id else {}
+        webapp_journal.accept(entry_id, 'webapp', user_id, task_id, answer, **extra)
         
-        return calculated_hash == received_hash
-    except Exception as e:
-        print(f"Error verifying data: {e}")
-        return False
+        # Отправляем сообщение пользователю через бота
+        try:
+            bot_api.call(
+                'sendMessage',
+                chat_id=user_id,
+                text=build_homework_message(task_id, answer),
+                parse_mode='HTML'
+            )
+        except BotApiError:
+            webapp_journal.done(entry_id, 'failed')
+            raise
+        webapp_journal.done(entry_id)
+    
+    submissions.once(submission_key(user_id, task_id, answer, upload_id), notify)
 
 @app.route('/api/submit-homework', methods=['POST'])
 def submit_homework():
@@ -61,52 +147,75 @@ def submit_homework():
         data = request.json
         init_data = request.headers.get('X-Telegram-Init-Data', '')
         
-        # Проверяем подлинность данных
-        if not verify_telegram_web_app_data(init_data):
+        # Проверяем подлинность данных (initData разбирается один раз)
+        verified = init_data_verifier.verify(init_data)
+        if verified is None:
             return jsonify({'error': 'Invalid init data'}), 401
         
-        # Парсим данные пользователя
-        parsed_data = parse_qs(init_data)
-        user_data = json.loads(parsed_data.get('user', ['{}'])[0])
-        user_id = user_data.get('id')
+        user_id = verified.user_id
         
         # Получаем данные задания
         task_id = data.get('taskId')
         user_answer = data.get('userAnswer')
         
-        # Отправляем сообщение пользователю через бота
-        message_text = f"""
-📝 <b>Получено домашнее задание!</b>
-
-<b>Задание:</b> {task_id}
-<b>Ваш ответ:</b>
-{user_answer[:500]}...
+        try:
+            accept_submission(user_id, task_id, user_answer)
+        except BotApiError as e:
+            logger.error(f"Не удалось отправить уведомление пользователю {user_id}: {e}")
+            return jsonify({
+                'error': 'Failed to send message'
+            }), 500
+        
+        # Здесь можно добавить вызов OpenAI для проверки
+        return jsonify({
+            'success': True,
+            'message': 'Задание отправлено на проверку'
+        })
+            
+    except Exception as e:
+        logger.exception(f"Ошибка обработки задания: {e}")
+        return jsonify({'error': str(e)}), 500
 
-⏳ Проверка займет несколько секунд...
-        """
+@app.route('/api/upload-homework', methods=['POST'])
+def upload_homework():
+    """Endpoint для большого ответа или вложения: тело пишется на диск кусками.
+    
+    Задание - в параметре taskId, initData - в заголовке. В ответе uploadId:
+    WebApp передает его боту в submit_homework для проверки.
+    """
+    try:
+        verified = init_data_verifier.verify(request.headers.get('X-Telegram-Init-Data', ''))
+        if verified is None:
+            return jsonify({'error': 'Invalid init data'}), 401
         
-        response = requests.post(
-            f"{BOT_API_URL}/sendMessage",
-            json={
-                'chat_id': user_id,
-                'text': message_text,
-                'parse_mode': 'HTML'
-            }
-        )
+        # Заявленный размер проверяем до чтения тела; без Content-Length лимит - при записи
+        if request.content_length is not None and request.content_length > upload_store.max_bytes:
+            return jsonify({'error': f"Файл больше {upload_store.max_bytes} байт"}), 413
+        try:
+            # request.stream не буферизует тело: читаем его кусками прямо из сокета
+            upload = upload_store.save(iter(partial(request.stream.read, upload_store.chunk_size), b''))
+        except UploadTooLarge as e:
+            return jsonify({'error': str(e)}), 413
         
-        if response.status_code == 200:
-            # Здесь можно добавить вызов OpenAI для проверки
-            return jsonify({
-                'success': True,
-                'message': 'Задание отправлено на проверку'
-            })
-        else:
+        user_id = verified.user_id
+        task_id = request.args.get('taskId', '')
+        try:
+            accept_submission(user_id, task_id, upload.read_text(UPLOAD_PREVIEW_BYTES), upload.id)
+        except BotApiError as e:
+            logger.error(f"Не удалось отправить уведомление пользователю {user_id}: {e}")
             return jsonify({
                 'error': 'Failed to send message'
             }), 500
+        
+        return jsonify({
+            'success': True,
+            'message': 'Файл получен',
+            'uploadId': upload.id,
+            'size': upload.size
+        })
             
     except Exception as e:
-        print(f"Error: {e}")
+        logger.exception(f"Ошибка загрузки файла: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/answer-webapp-query', methods=['POST'])
@@ -118,30 +227,47 @@ def answer_webapp_query():
         result = data.get('result')
         
         # Используем answerWebAppQuery
-        response = requests.post(
-            f"{BOT_API_URL}/answerWebAppQuery",
-            json={
-                'web_app_query_id': query_id,
-                'result': {
-                    'type': 'article',
-                    'id': '1',
-                    'title': 'Домашнее задание отправлено',
-                    'input_message_content': {
-                        'message_text': result,
-                        'parse_mode': 'HTML'
-                    }
-                }
-            }
-        )
+        try:
+            bot_api.call(
+                'answerWebAppQuery',
+                web_app_query_id=query_id,
+                result=build_webapp_query_result(result)
+            )
+            success = True
+        except BotApiError as e:
+            logger.error(f"Ошибка answerWebAppQuery: {e}")
+            success = False
         
         return jsonify({
-            'success': response.status_code == 200
+            'success': success
         })
         
     except Exception as e:
-        print(f"Error: {e}")
+        logger.exception(f"Ошибка ответа на WebApp query: {e}")
         return jsonify({'error': str(e)}), 500
 
+def main():
+    """Запуск сервера: dev (Flask) или async (aiohttp, несколько процессов)"""
+    parser = argparse.ArgumentParser(description='Сервер WebApp запросов')
+    parser.add_argument('--mode', choices=['dev', 'async'], default=os.getenv('WEBAPP_MODE', 'dev'))
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    setup_logging()
+
+    if args.mode == 'async':
+        from webapp_async import serve
+        serve(args.host, args.port, args.workers)
+    else:
+        ensure_journal()
+        if UPLOAD_RETENTION > 0:
+            upload_store.prune(UPLOAD_RETENTION)
+        startup.ready()
+        # /metrics - на локальном адресе; под перезагрузчиком Flask запросы
+        # обслуживает дочерний процесс, метрики - его
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_metrics_server()
+        # Запускаем сервер
+        app.run(host=args.host, port=args.port, debug=True)
+
 if __name__ == '__main__':
-    # Запускаем сервер
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    main()